@@ -733,6 +733,7 @@ public class WikiToJson extends Visitor {
 	}
 	*/
 	static GatewayServer gateway = null;
+	static final String BATCH_SEPARATOR = "\u0000";
 	public class ParseTools {
 
 		public String convertWikitextToJson(String wikitext)
@@ -747,11 +748,41 @@ public class WikiToJson extends Visitor {
 			return null;
 		}
 
+		/**
+		 * Converts several pages in one call, to save a gateway round trip per page
+		 * @param wikitexts The wikitext of each page, separated by NUL characters (which can't appear in wikitext)
+		 * @return The JSON of each page, separated by NUL characters (which JSON always escapes), with an empty
+		 *         string for any page that couldn't be converted
+		 */
+		public String convertWikitextsToJson(String wikitexts)
+				throws LinkTargetException, CompilerException,
+				FileNotFoundException, IOException {
+			StringBuilder result = new StringBuilder();
+			String[] pages = wikitexts.split(BATCH_SEPARATOR, -1);
+			for(int i = 0; i < pages.length; i++) {
+				if(i > 0)
+					result.append(BATCH_SEPARATOR);
+				String json = convertWikitextToJson(pages[i]);
+				if(json != null)
+					result.append(json);
+			}
+			return result.toString();
+		}
+
 		public String cleanedWikitext(String wikitext) {
 			return wikitext.replaceAll("&nbsp;", " ");
 		}
 
-		public WikiPage run(String wikitext) throws LinkTargetException,
+		/**
+		 * Lets clients check that the gateway is up and answering
+		 * @return Always true
+		 */
+		public boolean ping() {
+			return true;
+		}
+
+		// The parser keeps its state in static fields, so pages from different clients are parsed one at a time
+		public synchronized WikiPage run(String wikitext) throws LinkTargetException,
 				CompilerException, FileNotFoundException, IOException, JAXBException {
 			// Set-up a simple wiki configuration
 			SimpleWikiConfiguration config = new SimpleWikiConfiguration(
@@ -789,8 +820,12 @@ public class WikiToJson extends Visitor {
 		}
 	}
 	
+	/**
+	 * Launches the gateway
+	 * @param args Optionally, the port to listen on, where 0 picks any free port (defaults to 25333)
+	 */
 	public static void main(String[] args) {
-		int port = 25333;
+		int port = args.length > 0 ? Integer.parseInt(args[0]) : 25333;
 		int plus = 0;
 		while(gateway == null)
 			try {
@@ -802,7 +837,7 @@ public class WikiToJson extends Visitor {
 					throw ex;
 			}
 		gateway.start();
-		System.out.println("Gateway launched");
+		System.out.println("Gateway launched on port " + gateway.getListeningPort());
 		System.out.flush();
 		System.out.close(); // Marks that the gateway is ready, allows stdout to be read entirely (easier in python)
 	}
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+'''
+Compares the pages per second of writing pages one at a time through
+``filemanager.write_wikitext`` against writing them with
+``filemanager.batch_writer``, using a scratch archive in a temporary directory.
+
+::
+
+    usage: bench_batch_writer.py [-h] [-n PAGES] [-b BATCH_SIZE] [--sqlite]
+'''
+
+import argparse
+import os
+import random
+import tempfile
+from time import time
+
+from wikiparse import filemanager
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "reference"]
+    return [("Page %d" % i, " ".join(rng.choice(words) for _ in range(600))) for i in range(count)]
+
+
+def run(pages, path, batch_size=None):
+    archive = filemanager.Archive(path)
+    filemanager.use_archive(archive)
+    start = time()
+    if batch_size is None:
+        # As wikisplitter used to, so that the archive isn't flushed after every page
+        filemanager.enable_writing()
+        for title, content in pages:
+            filemanager.write_wikitext(title, content)
+        filemanager.flush()
+    else:
+        with filemanager.batch_writer(batch_size) as writer:
+            for title, content in pages:
+                writer.write_wikitext(title, content)
+    elapsed = time() - start
+    archive.close()
+    return len(pages) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark per-page against batched archive writes')
+    parser.add_argument('-n', '--pages', help="The number of pages to write", type=int, default=20000)
+    parser.add_argument('-b', '--batch_size', help="The batch writer's batch size", type=int, default=1000)
+    parser.add_argument('--sqlite', help="Benchmarks the SQLite backend instead of the zip backend", action="store_true", default=False)
+    args = parser.parse_args()
+
+    original = filemanager.use_archive(None)
+    pages = make_pages(args.pages)
+    ext = "sqlite" if args.sqlite else "zip"
+    with tempfile.TemporaryDirectory() as tmp:
+        single = run(pages, os.path.join(tmp, "single.%s" % ext))
+        batched = run(pages, os.path.join(tmp, "batched.%s" % ext), args.batch_size)
+    filemanager.use_archive(original)
+
+    print("per-page writes: %10.1f pages/sec" % single)
+    print("batched writes:  %10.1f pages/sec" % batched)
+    print("speedup:         %10.2fx" % (batched / single))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+'''
+Compares the size and read speed of an archive whose pages are compressed one
+at a time against one whose pages are compressed against a shared dictionary
+trained from a sample of them. By default this uses synthetic wikitext and
+parser JSON; pass a cache file to sample its pages instead.
+
+::
+
+    usage: bench_dictionary.py [-h] [-n PAGES] [-s SAMPLES] [--sqlite] [cache]
+'''
+
+import argparse
+import json
+import os
+import random
+import tempfile
+from time import time
+
+from wikiparse import storage
+
+
+def synthetic_tree(seed, paragraphs=40):
+    rng = random.Random(seed)
+    ids = iter(range(1, 10 ** 9))
+    words = "the of and to in a is that for it as was with be by on not he this are or his from at which".split()
+
+    def phrase(low, high):
+        return " ".join(rng.choice(words) for _ in range(rng.randint(low, high)))
+
+    def text():
+        return {"id": next(ids), "type": "text", "text": phrase(3, 30),
+                "properties": rng.choice([[], ["bold"], ["italic"], ["bold", "italic"]])}
+
+    def link():
+        return {"id": next(ids), "type": "internal_link", "label": "__link_", "children": [text()],
+                "target": phrase(1, 3), "default_text": text()}
+
+    def context(depth=0):
+        children = [text() if rng.random() < 0.6 or depth > 3 else (link() if rng.random() < 0.7 else context(depth + 1))
+                    for _ in range(rng.randint(2, 8))]
+        return {"id": next(ids), "type": "context", "label": "", "children": children}
+
+    root = context()
+    root["children"] = [context() for _ in range(paragraphs)]
+    return {"root": root, "refs": context(), "internal_links": [], "external_links": [], "sections": []}
+
+
+def synthetic_wikitext(seed):
+    rng = random.Random(seed)
+    words = "the of and to in a is that for it as was with be by on not he this are or his from at which".split()
+    infobox = ["{{Infobox person", "| name = ", "| image = ", "| birth_date = {{birth date|", "| occupation = ",
+               "| nationality = ", "| known_for = ", "}}"]
+    lines = [line + " ".join(rng.choice(words) for _ in range(rng.randint(0, 3))) for line in infobox]
+    for _ in range(rng.randint(5, 30)):
+        lines.append(" ".join(rng.choice(words + ["[[%s]]" % rng.choice(words)]) for _ in range(rng.randint(10, 80))))
+        if rng.random() < 0.3:
+            lines.append("<ref>{{cite web |url=http://example.com/%d |title=%s |access-date=2015}}</ref>"
+                         % (rng.randint(0, 10 ** 6), rng.choice(words)))
+    lines.append("[[Category:%s]]" % rng.choice(words))
+    return "\n".join(lines)
+
+
+def fill(path, pages, trained_from=None):
+    backend = storage.open_backend(path, use_dictionary=trained_from is not None)
+    if trained_from is not None:
+        backend.train_dictionary(source=trained_from)
+    backend.write_many(pages)
+    backend.flush()
+    return backend
+
+
+def read_all(backend, names):
+    start = time()
+    for name in names:
+        backend.read(name)
+    return (time() - start) / len(names)
+
+
+def file_size(path):
+    return sum(os.path.getsize(path + ext) for ext in ("", ".zdict") if os.path.exists(path + ext))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark per-page against shared-dictionary compression')
+    parser.add_argument('-n', '--pages', help="The number of synthetic pages to use", type=int, default=5000)
+    parser.add_argument('-s', '--samples', help="The number of pages to train the dictionary from", type=int, default=2000)
+    parser.add_argument('--sqlite', help="Benchmarks the SQLite backend instead of the zip backend", action="store_true", default=False)
+    parser.add_argument('cache', help="A cache file to take pages from instead of synthetic ones", nargs='?')
+    args = parser.parse_args()
+
+    if args.cache:
+        source = storage.open_backend(os.path.abspath(os.path.expanduser(args.cache)))
+        pages = [(name, source.read(name)) for name in source.names()]
+        source.close()
+    else:
+        pages = []
+        for seed in range(args.pages // 2):
+            pages.append(("Page %d.wtxt" % seed, synthetic_wikitext(seed).encode('utf-8')))
+            pages.append(("Page %d.json" % seed, json.dumps(synthetic_tree(seed, paragraphs=5)).encode('utf-8')))
+    names = [name for name, _ in pages]
+    ext = "sqlite" if args.sqlite else "zip"
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path = os.path.join(tmp, "plain.%s" % ext)
+        plain = fill(plain_path, pages)
+        shared_path = os.path.join(tmp, "shared.%s" % ext)
+        shared = fill(shared_path, pages, trained_from=plain)
+        plain_size = file_size(plain_path)
+        shared_size = file_size(shared_path)
+        plain_time = read_all(plain, names)
+        shared_time = read_all(shared, names)
+        plain.close()
+        shared.close()
+
+    raw_size = sum(len(content) for _, content in pages)
+    print("%d pages, %d B uncompressed" % (len(pages), raw_size))
+    print("per-page deflate:  %10d B  (%.2fx)  %8.1f us/read" % (plain_size, raw_size / plain_size, plain_time * 1e6))
+    print("shared dictionary: %10d B  (%.2fx)  %8.1f us/read" % (shared_size, raw_size / shared_size, shared_time * 1e6))
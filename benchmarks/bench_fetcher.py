@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+'''
+Compares warming up a cold cache one page at a time, the way
+``filemanager.read_wikitext`` fetches missing pages, against fetching every page
+with ``wikiparse.fetcher``. Both fetch from a local stand-in for a MediaWiki
+server that serves both ``action=raw`` and the query API. To resemble a remote
+server, it waits a fixed time before answering each request. Pages are cached in
+a scratch archive in a temporary directory, then checked against what the
+server holds.
+
+Fetching one page at a time is slow, so that path only fetches a sample of the
+pages, and both are reported in pages per second.
+
+::
+
+    usage: bench_fetcher.py [-h] [-n PAGES] [-s SERIAL_PAGES] [-l LATENCY]
+                            [-c CONCURRENCY] [-b BATCH_SIZE]
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import urllib.parse
+from time import time
+
+from wikiparse import fetcher, filemanager
+
+
+class StandInWiki(object):
+    '''A minimal keep-alive HTTP server with a MediaWiki-like API, holding the given pages.
+    '''
+
+    # The most page contents in a single query response, to exercise continuation
+    PAGES_PER_RESPONSE = 20
+
+    def __init__(self, pages, latency):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+
+    @staticmethod
+    def normalize(title):
+        title = title.replace('_', ' ')
+        return title[:1].upper() + title[1:]
+
+    def raw(self, params):
+        wikitext = self.pages.get(self.normalize(params['title']))
+        if wikitext is None:
+            return 404, b"", "text/plain"
+        return 200, wikitext.encode('utf-8'), "text/x-wiki; charset=UTF-8"
+
+    def query(self, params):
+        titles = params['titles'].split('|')
+        normalized = [{'from': title, 'to': self.normalize(title)} for title in titles if self.normalize(title) != title]
+        skip = int(params.get('rvcontinue', 0))
+        pages = []
+        for title in map(self.normalize, titles):
+            if title not in self.pages:
+                pages.append({'title': title, 'missing': True})
+            else:
+                pages.append({'pageid': hash(title) & 0xffffff, 'ns': 0, 'title': title})
+        with_content = [page for page in pages if 'missing' not in page]
+        for page in with_content[skip:skip + self.PAGES_PER_RESPONSE]:
+            page['revisions'] = [{'slots': {'main': {'contentmodel': 'wikitext', 'contentformat': 'text/x-wiki',
+                                                     'content': self.pages[page['title']]}}}]
+        response = {'batchcomplete': True, 'query': {'normalized': normalized, 'pages': pages}}
+        if skip + self.PAGES_PER_RESPONSE < len(with_content):
+            del response['batchcomplete']
+            response['continue'] = {'rvcontinue': str(skip + self.PAGES_PER_RESPONSE), 'continue': '||'}
+        return 200, json.dumps(response).encode('utf-8'), "application/json; charset=utf-8"
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                url = urllib.parse.urlsplit(target)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                params.update(urllib.parse.parse_qsl(body.decode('ascii')))
+                status, content, content_type = self.raw(params) if params.get('action') == 'raw' else self.query(params)
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s\r\n"
+                              % (status, "OK" if status == 200 else "Not Found", content_type, len(content),
+                                 "Connection: close\r\n" if close else "")).encode('latin-1') + content)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        '''Starts serving from a background thread.
+
+        :return: The server's base URL
+        :rtype: str
+        '''
+        started = threading.Event()
+        address = []
+
+        async def serve():
+            server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+            address.append(server.sockets[0].getsockname()[1])
+            started.set()
+            async with server:
+                await server.serve_forever()
+
+        threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+        started.wait()
+        return "http://127.0.0.1:%d" % address[0]
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "reference"]
+    return {"Page %d" % i: " ".join(rng.choice(words) for _ in range(rng.randint(50, 3000))) for i in range(count)}
+
+
+def use_scratch_cache(path, **options):
+    archive = filemanager.Archive(path, **options)
+    filemanager.use_archive(archive)
+    return archive
+
+
+def check(titles, pages):
+    wrong = sum(1 for title in titles if filemanager.read_wikitext(title) != pages[StandInWiki.normalize(title)])
+    if wrong:
+        raise AssertionError("%d of %d fetched pages differ from the server's" % (wrong, len(titles)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark fetching pages one at a time against the batched fetcher')
+    parser.add_argument('-n', '--pages', help="The number of pages to fetch with the batched fetcher", type=int, default=10000)
+    parser.add_argument('-s', '--serial_pages', help="The number of pages to fetch one at a time", type=int, default=300)
+    parser.add_argument('-l', '--latency', help="How long the server takes to answer each request, in seconds", type=float, default=0.02)
+    parser.add_argument('-c', '--concurrency', help="The batched fetcher's concurrency", type=int, default=4)
+    parser.add_argument('-b', '--batch_size', help="The batched fetcher's batch size", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    titles = list(pages)
+    # Like real titles, some differ from the canonical title and need normalizing, and some pages don't exist
+    requested = [title.replace(' ', '_') if i % 10 == 0 else title for i, title in enumerate(titles)]
+    wiki = StandInWiki(pages, args.latency)
+    base_url = wiki.start()
+
+    original = filemanager.use_archive(None)
+    options = {'fetch_url': base_url + "/w/index.php?%s", 'cache_pulls': True}
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = use_scratch_cache(os.path.join(tmp, "serial.zip"), **options)
+        sample = titles[:args.serial_pages]
+        start = time()
+        for title in sample:
+            filemanager._fetch_wikitext(title)
+        filemanager.flush()
+        serial_rate = len(sample) / (time() - start)
+        check(sample, pages)
+        archive.close()
+
+        archive = use_scratch_cache(os.path.join(tmp, "batched.zip"), **options)
+        wiki.requests = 0
+        start = time()
+        fetched = fetcher.fetch_pages(requested + ["Missing page %d" % i for i in range(100)],
+                                      api_url=base_url + "/w/api.php", concurrency=args.concurrency,
+                                      batch_size=args.batch_size, rate_limit=0)
+        batched_time = time() - start
+        # Pages are cached under the titles they were requested by
+        check(requested, pages)
+        archive.close()
+    filemanager.use_archive(original)
+
+    print("one at a time: %10.1f pages/sec (%d pages, %d ms latency)" % (serial_rate, len(sample), args.latency * 1000))
+    print("batched:       %10.1f pages/sec (%d pages in %.1fs, %d requests)"
+          % (fetched / batched_time, fetched, batched_time, wiki.requests))
+    print("speedup:       %10.1fx" % (fetched / batched_time / serial_rate))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+'''
+Measures the peak memory use (RSS) and speed of ``wikisplitter.find_pages``
+over a synthetic uncompressed xml dump of the given size, written to a
+temporary directory. For comparison, the page extractor that wikisplitter used
+before, which kept every page it had read attached to the dump's root element,
+is measured too. Each run happens in a fresh process, so that its peak memory
+is its own.
+
+::
+
+    usage: bench_find_pages.py [-h] [-s SIZE] [-d DIRECTORY]
+'''
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+from time import time
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+from wikiparse import wikisplitter
+
+HEADER = (b'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n'
+          b'  <siteinfo>\n    <sitename>Wikipedia</sitename>\n  </siteinfo>\n')
+FOOTER = b'</mediawiki>\n'
+
+
+def write_dump(path, size):
+    rng = random.Random(0)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "<ref>", "&"]
+    # A pool of page bodies, reused so that writing gigabytes doesn't take longer than reading them
+    bodies = [escape(" ".join(rng.choice(words) for _ in range(rng.randint(50, 3000)))) for _ in range(200)]
+    pages = 0
+    with open(path, 'wb') as dump:
+        dump.write(HEADER)
+        while dump.tell() < size:
+            redirect = '    <redirect title="Page %d" />\n' % (pages - 1) if pages % 10 == 9 else ''
+            dump.write(('  <page>\n    <title>Page %d</title>\n    <ns>0</ns>\n    <id>%d</id>\n%s'
+                        '    <revision>\n      <id>%d</id>\n      <timestamp>2020-01-01T00:00:00Z</timestamp>\n'
+                        '      <contributor>\n        <username>Someone</username>\n        <id>1</id>\n'
+                        '      </contributor>\n      <model>wikitext</model>\n      <format>text/x-wiki</format>\n'
+                        '      <text bytes="1" xml:space="preserve">%s</text>\n      <sha1>x</sha1>\n'
+                        '    </revision>\n  </page>\n'
+                        % (pages, pages + 1, redirect, pages + 1, bodies[pages % len(bodies)])).encode('utf-8'))
+            pages += 1
+        dump.write(FOOTER)
+    return pages
+
+
+def legacy_find_pages(xml_stream):
+    # The page extractor as it was: pages are emptied once read, but stay attached to the root
+    def no_ns(tag):
+        return tag.rpartition('}')[2].lower()
+
+    def find_el_by_tag(element, tag):
+        for el in list(element):
+            if no_ns(el.tag) == tag:
+                return el
+        return None
+
+    for event, element in ET.iterparse(xml_stream):
+        if no_ns(element.tag) == 'page':
+            el = find_el_by_tag(element, 'title')
+            title = el.text if el is not None else None
+            revision = find_el_by_tag(element, 'revision')
+            text = find_el_by_tag(revision, 'text') if revision is not None else None
+            yield title, text.text if text is not None else None
+            element.clear()
+
+
+def measure(mode, path):
+    find = wikisplitter.find_pages if mode == 'find_pages' else legacy_find_pages
+    start = time()
+    pages = 0
+    with open(path, 'rb') as dump:
+        for title, text in find(dump):
+            pages += 1
+    elapsed = time() - start
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    print("%d %f %d" % (pages, elapsed, peak))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the memory use and speed of find_pages')
+    parser.add_argument('-s', '--size', help="The size of the synthetic dump, in megabytes", type=int, default=2048)
+    parser.add_argument('-d', '--directory', help="Where to write the dump (defaults to a temporary directory)", default=None)
+    parser.add_argument('--measure', help=argparse.SUPPRESS, nargs=2, default=None)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmp:
+        path = os.path.join(tmp, "dump.xml")
+        start = time()
+        pages = write_dump(path, args.size * 1024 * 1024)
+        print("%d MB dump of %d pages written in %.1fs" % (os.path.getsize(path) // (1024 * 1024), pages, time() - start))
+        for mode in ('find_pages', 'legacy'):
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', mode, path],
+                                    stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            # wikisplitter prints a message of its own on exit
+            found, elapsed, peak = result.stdout.splitlines()[0].split()
+            print("%-10s %8d pages  %10.1f pages/sec  %8.1f MB/sec  peak RSS %7.1f MB"
+                  % (mode, int(found), int(found) / float(elapsed), os.path.getsize(path) / float(elapsed) / 2 ** 20,
+                     int(peak) / 2 ** 20))
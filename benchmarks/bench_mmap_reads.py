@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+'''
+Compares reading every page of a zip archive through :py:class:`zipfile.ZipFile`
+against reading them with ``ZipBackend.read_view``, which reads straight out of
+the memory-mapped archive, using a scratch archive in a temporary directory.
+
+::
+
+    usage: bench_mmap_reads.py [-h] [-n PAGES] [-c COMPRESSION_LEVEL]
+'''
+
+import argparse
+import os
+import random
+import tempfile
+from time import time
+
+from wikiparse import storage
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "reference"]
+    return [("Page %d.wtxt" % i, " ".join(rng.choice(words) for _ in range(600)).encode('utf-8'))
+            for i in range(count)]
+
+
+def pages_per_second(read, names):
+    start = time()
+    for name in names:
+        str(read(name), 'utf-8')
+    return len(names) / (time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark zipfile reads against memory-mapped reads')
+    parser.add_argument('-n', '--pages', help="The number of pages to read", type=int, default=20000)
+    parser.add_argument('-c', '--compression_level', help="The compression level (as in config.json) to store pages with", type=int, default=1)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    names = [name for name, _ in pages]
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = storage.ZipBackend(os.path.join(tmp, "pages.zip"), storage.compression_levels[args.compression_level])
+        backend.write_many(pages)
+        backend.flush()
+        zipfile_rate = pages_per_second(backend.archive.read, names)
+        mapped_rate = pages_per_second(backend.read_view, names)
+        backend.close()
+
+    print("zipfile reads: %10.1f pages/sec" % zipfile_rate)
+    print("mapped reads:  %10.1f pages/sec" % mapped_rate)
+    print("speedup:       %10.2fx" % (mapped_rate / zipfile_rate))
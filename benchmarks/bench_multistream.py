@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+'''
+Compares unpacking a dump from a single bz2 stream against unpacking a
+multistream dump of the same pages in parallel with
+``wikisplitter.find_multistream_pages``, using a synthetic dump in a temporary
+directory. Both ways must find the same pages in the same order. Parallel
+unpacking only helps on a machine with more than one core.
+
+::
+
+    usage: bench_multistream.py [-h] [-n PAGES] [-s STREAM_PAGES]
+                                [-w WORKERS [WORKERS ...]]
+'''
+
+import argparse
+import bz2
+import os
+import random
+import tempfile
+from time import time
+from xml.sax.saxutils import escape
+
+from wikiparse import wikisplitter
+
+HEADER = (b'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n'
+          b'  <siteinfo>\n    <sitename>Wikipedia</sitename>\n  </siteinfo>\n')
+FOOTER = b'</mediawiki>\n'
+
+
+def make_pages(count, seed=0):
+    rng = random.Random(seed)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "<ref>", "&"]
+    return [("Page %d: %s" % (i, rng.choice(words)), " ".join(rng.choice(words) for _ in range(rng.randint(50, 2000))))
+            for i in range(count)]
+
+
+def page_xml(page_id, title, text):
+    return ('  <page>\n    <title>%s</title>\n    <ns>0</ns>\n    <id>%d</id>\n    <revision>\n'
+            '      <text xml:space="preserve">%s</text>\n    </revision>\n  </page>\n'
+            % (escape(title), page_id, escape(text))).encode('utf-8')
+
+
+def write_dumps(pages, directory, stream_pages):
+    single = os.path.join(directory, "dump.xml.bz2")
+    multistream = os.path.join(directory, "dump-multistream.xml.bz2")
+    index = os.path.join(directory, "dump-multistream-index.txt.bz2")
+    xml = [page_xml(i + 1, title, text) for i, (title, text) in enumerate(pages)]
+    with open(single, 'wb') as dump:
+        dump.write(bz2.compress(HEADER + b''.join(xml) + FOOTER))
+    lines = []
+    with open(multistream, 'wb') as dump:
+        dump.write(bz2.compress(HEADER))
+        for start in range(0, len(xml), stream_pages):
+            offset = dump.tell()
+            for i in range(start, min(start + stream_pages, len(xml))):
+                lines.append("%d:%d:%s\n" % (offset, i + 1, pages[i][0]))
+            dump.write(bz2.compress(b''.join(xml[start:start + stream_pages])))
+        dump.write(bz2.compress(FOOTER))
+    with bz2.open(index, 'wt', encoding='utf-8') as index_file:
+        index_file.writelines(lines)
+    return single, multistream, index
+
+
+def timed(pages, find):
+    start = time()
+    found = list(find())
+    elapsed = time() - start
+    if found != pages:
+        raise AssertionError("Found %d pages, which differ from the %d in the dump" % (len(found), len(pages)))
+    return len(found) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark single-stream against parallel multistream unpacking')
+    parser.add_argument('-n', '--pages', help="The number of pages in the dump", type=int, default=20000)
+    parser.add_argument('-s', '--stream_pages', help="The number of pages in each stream", type=int, default=100)
+    parser.add_argument('-w', '--workers', help="The numbers of worker processes to try", type=int, nargs='+',
+                        default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    with tempfile.TemporaryDirectory() as tmp:
+        single, multistream, index = write_dumps(pages, tmp, args.stream_pages)
+        print("%d pages, %d CPUs" % (len(pages), os.cpu_count() or 1))
+        rate = timed(pages, lambda: wikisplitter.find_pages(bz2.open(single, 'r')))
+        print("single stream:          %10.1f pages/sec" % rate)
+        for workers in args.workers:
+            parallel = timed(pages, lambda: wikisplitter.find_multistream_pages(multistream, index, workers))
+            print("multistream, %2d workers: %10.1f pages/sec (%.2fx)" % (workers, parallel, parallel / rate))
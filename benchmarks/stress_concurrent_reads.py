@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+'''
+Reads pages concurrently from many threads, and from a pool of forked
+processes, and checks every result against reading the same pages serially.
+Pages are also written from another thread while the readers run, to check
+that reads stay consistent while the cache is being written. Uses a scratch
+cache in a temporary directory, and exits with an error if any read differs.
+
+::
+
+    usage: stress_concurrent_reads.py [-h] [-n PAGES] [-t THREADS] [-p PROCESSES]
+                                      [-r ROUNDS] [--sqlite] [--shards SHARDS]
+'''
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from wikiparse import storage
+
+backend = None
+
+
+def make_page(i):
+    rng = random.Random(i)
+    words = ["wiki", "page", "{{Infobox", "|name =", "[[link]]", "'''bold'''", "the", "of", "and", "reference"]
+    return ("Page %d.wtxt" % i, ("%d " % i + " ".join(rng.choice(words) for _ in range(rng.randint(10, 2000))))
+            .encode('utf-8'))
+
+
+def read_pages(names):
+    return [backend.read(name) for name in names]
+
+
+def check(label, names, expected, results):
+    wrong = [name for name, result in zip(names, results) if result != expected[name]]
+    print("%-10s %d reads, %d wrong" % (label, len(results), len(wrong)))
+    return not wrong
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check concurrent reads against serial reads')
+    parser.add_argument('-n', '--pages', help="The number of pages in the cache", type=int, default=5000)
+    parser.add_argument('-t', '--threads', help="The number of reader threads", type=int, default=16)
+    parser.add_argument('-p', '--processes', help="The number of reader processes", type=int, default=4)
+    parser.add_argument('-r', '--rounds', help="How many times each page is read", type=int, default=4)
+    parser.add_argument('--sqlite', help="Tests the SQLite backend instead of the zip backend", action="store_true", default=False)
+    parser.add_argument('--shards', help="The number of shards to split the cache into", type=int, default=1)
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = storage.open_backend(os.path.join(tmp, "pages.%s" % ("sqlite" if args.sqlite else "zip")),
+                                       shards=args.shards)
+        pages = dict(make_page(i) for i in range(args.pages))
+        backend.write_many(pages.items())
+        backend.flush()
+
+        names = list(pages) * args.rounds
+        random.Random(0).shuffle(names)
+        start = time()
+        ok &= check("serial", names, pages, read_pages(names))
+        print("%-10s %.2fs" % ("", time() - start))
+
+        # Writes new pages while the threads read
+        extra = dict(make_page(i) for i in range(args.pages, args.pages * 2))
+
+        def write_extra():
+            for name, content in extra.items():
+                backend.write(name, content)
+                if random.random() < 0.01:
+                    backend.flush()
+            backend.flush()
+
+        writer = threading.Thread(target=write_extra)
+        writer.start()
+        chunks = [names[i::args.threads * 4] for i in range(args.threads * 4)]
+        start = time()
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = [result for chunk in pool.map(read_pages, chunks) for result in chunk]
+        ok &= check("threads", [name for chunk in chunks for name in chunk], pages, results)
+        print("%-10s %.2fs" % ("", time() - start))
+        writer.join()
+        ok &= check("written", list(extra), extra, read_pages(extra))
+        pages.update(extra)
+
+        if hasattr(os, 'fork'):
+            start = time()
+            with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+                results = [result for chunk in pool.map(read_pages, chunks) for result in chunk]
+            ok &= check("processes", [name for chunk in chunks for name in chunk], pages, results)
+            print("%-10s %.2fs" % ("", time() - start))
+            # The parent's handles must still work after the children used their own
+            ok &= check("parent", names[:1000], pages, read_pages(names[:1000]))
+        backend.close()
+
+    if not ok:
+        sys.exit("Concurrent reads differed from serial reads")
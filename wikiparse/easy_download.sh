@@ -1,11 +1,25 @@
 set -e
+# Parts are downloaded, unpacked and deleted a few at a time, so that only that many are ever on disk at once. Give
+# how many as the first argument to unpack them concurrently (see wikisplitter.py); by default it's one at a time.
+parts_at_once=${1:-1}
+files=""
+count=0
 for url in $(python3 ./wikidownloader.py -l=eng -d=late -t=pages-articles -x=xml-PART.bz2 -n=multiple -s); do
    filename=$(basename "$url")
    echo "$filename"
    if ! [ -e $filename ]; then
       wget "$url"
    fi
-   python3 ./wikisplitter.py -u "$filename"
-   rm "$filename"
+   files="$files $filename"
+   count=$((count + 1))
+   if [ $count -ge $parts_at_once ]; then
+      python3 ./wikisplitter.py -u -w $parts_at_once $files
+      rm $files
+      files=""
+      count=0
+   fi
 done
-
+if [ -n "$files" ]; then
+   python3 ./wikisplitter.py -u -w $parts_at_once $files
+   rm $files
+fi
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+'''
+Fetches the wikitext of many pages at once from a MediaWiki site, to fill a
+cold cache much faster than :py:func:`wikiparse.filemanager.read_wikitext` can
+by fetching one page at a time. Pages are requested through the MediaWiki
+query API, many titles per request, over a small pool of persistent
+connections, with a limit on how many requests are made per second. Fetched
+pages are stored through :py:mod:`wikiparse.filemanager` like any other page.
+
+The API endpoint and limits default to ``api_url``, ``fetch_concurrency``,
+``fetch_batch_size``, ``fetch_rate_limit`` and ``fetch_timeout`` from
+``config.json``. Please keep
+the limits modest when fetching from Wikipedia itself.
+
+Run as a script to cache every page listed in a file, one title per line (or
+``-`` to read titles from standard input)::
+
+    python3 fetcher.py titles.txt
+
+::
+
+    usage: fetcher.py [-h] [-u] [-v] [-c CONCURRENCY] [-b BATCH_SIZE]
+                      [-r RATE_LIMIT]
+                      titles
+
+    Fetch and cache the wikitext of many pages
+
+    positional arguments:
+      titles                A file listing one title per line, or - for stdin
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -u, --update          Fetches pages again even if they are already cached
+      -v, --verbose         Prints a running count of fetched pages
+      -c CONCURRENCY, --concurrency CONCURRENCY
+                            The number of requests to make at the same time
+      -b BATCH_SIZE, --batch_size BATCH_SIZE
+                            The number of titles to request at once
+      -r RATE_LIMIT, --rate_limit RATE_LIMIT
+                            The most requests to make per second, or 0 for no
+                            limit
+'''
+
+import argparse
+import asyncio
+import email.utils
+import gzip
+import json
+import sys
+import urllib.parse
+import zlib
+from datetime import datetime, timezone
+
+from wikiparse import metrics
+
+USER_AGENT = "wikiparse/0.9 (https://github.com/scnerd/Wikiparse)"
+
+# How many times to retry a request that the server asked to be retried later
+MAX_RETRIES = 3
+
+
+class HTTPError(Exception):
+    '''Raised when the server answers a request with an error status.
+    '''
+
+    def __init__(self, status, body):
+        super(HTTPError, self).__init__("HTTP status %d: %s" % (status, body[:200]))
+        self.status = status
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server")
+    status = int(status_line.split(None, 2)[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'deflate':
+        body = zlib.decompress(body)
+    return status, headers, body
+
+
+def _retry_delay(retry_after, default):
+    # Retry-After is either a number of seconds or an HTTP date
+    if retry_after is None:
+        return default
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class ConnectionPool(object):
+    '''Keeps persistent HTTP/1.1 connections to a single server, making at most ``size`` requests at a time and
+    reusing connections between requests. Must be created and used from within a running event loop.
+
+    :param url: Any URL on the server, which sets the scheme, host and port to connect to
+    :type url: str
+    :param size: The most connections to keep open, and so the most requests in flight at once
+    :type size: int
+    :param timeout: How long, in seconds, to wait for a connection to open, or for a response once the request has
+                    been sent, before giving up with :py:class:`asyncio.TimeoutError`
+    :type timeout: float
+    '''
+
+    def __init__(self, url, size=4, timeout=60):
+        parts = urllib.parse.urlsplit(url)
+        self.ssl = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.size = size
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._host_header = parts.netloc.rpartition('@')[2]
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        self.connections_opened += 1
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl or None),
+                                      self.timeout)
+
+    async def _exchange(self, reader, writer, request):
+        writer.write(request)
+        await writer.drain()
+        return await _read_response(reader)
+
+    async def request(self, method, target, headers=None, body=b''):
+        '''Makes a request, on an idle connection if there is one.
+
+        :param method: The HTTP method, e.g. ``GET`` or ``POST``
+        :type method: str
+        :param target: The path and query string to request
+        :type target: str
+        :param headers: Any headers to send besides ``Host``, ``Content-Length`` and ``Accept-Encoding``
+        :type headers: dict
+        :param body: The request body
+        :type body: bytes
+        :return: The status, headers (with lowercase names) and decompressed body of the response
+        :rtype: (int, dict, bytes)
+        '''
+        lines = ["%s %s HTTP/1.1" % (method, target), "Host: %s" % self._host_header,
+                 "Content-Length: %d" % len(body), "Accept-Encoding: gzip"]
+        lines.extend("%s: %s" % header for header in (headers or {}).items())
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+        async with self._slots:
+            while True:
+                fresh = not self._idle
+                reader, writer = await self._connect() if fresh else self._idle.pop()
+                try:
+                    status, response_headers, content = await asyncio.wait_for(
+                        self._exchange(reader, writer, request), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if fresh:
+                        raise
+                    # The server closed this connection while it was idle, so try again on another one
+                    continue
+                except asyncio.TimeoutError:
+                    # The connection is left partway through a response, so it can't be reused
+                    writer.close()
+                    raise
+                if response_headers.get('connection', '').lower() == 'close':
+                    writer.close()
+                else:
+                    self._idle.append((reader, writer))
+                return status, response_headers, content
+
+    async def close(self):
+        '''Closes every idle connection.
+        '''
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class RateLimiter(object):
+    '''Spaces out requests so that at most ``rate`` start every second.
+
+    :param rate: The most requests per second, or 0 for no limit
+    :type rate: float
+    '''
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+
+    async def wait(self):
+        '''Waits until the next request may start.
+        '''
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class Fetcher(object):
+    '''Fetches the current wikitext of many pages through the MediaWiki query API.
+
+    :param api_url: The site's API endpoint, e.g. ``https://en.wikipedia.org/w/api.php``
+    :type api_url: str
+    :param concurrency: The number of requests to make at the same time
+    :type concurrency: int
+    :param batch_size: The number of titles to request at once (the API allows at most 50)
+    :type batch_size: int
+    :param rate_limit: The most requests to make per second, or 0 for no limit
+    :type rate_limit: float
+    :param timeout: How long, in seconds, to wait for the server before giving up on a request
+    :type timeout: float
+    '''
+
+    def __init__(self, api_url, concurrency=4, batch_size=50, rate_limit=0, timeout=60):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.requests = 0
+        self._path = urllib.parse.urlsplit(api_url).path or '/'
+
+    async def _query(self, pool, limiter, params):
+        body = urllib.parse.urlencode(params).encode('ascii')
+        headers = {"Content-Type": "application/x-www-form-urlencoded", "User-Agent": USER_AGENT}
+        for attempt in range(MAX_RETRIES + 1):
+            await limiter.wait()
+            self.requests += 1
+            with metrics.timed("fetch.request") as timer:
+                status, response_headers, content = await pool.request("POST", self._path, headers, body)
+                timer.bytes = len(content)
+            if status in (429, 503):
+                metrics.count("fetch.throttled")
+            if status in (429, 503) and attempt < MAX_RETRIES:
+                # The server is overloaded, or we are over its own rate limit
+                await asyncio.sleep(_retry_delay(response_headers.get('retry-after'), 2 ** attempt))
+                continue
+            if status != 200:
+                raise HTTPError(status, content)
+            return json.loads(content.decode('utf-8'))
+
+    async def _fetch_batch(self, pool, limiter, titles):
+        params = {'action': 'query', 'prop': 'revisions', 'rvprop': 'content', 'rvslots': 'main',
+                  'format': 'json', 'formatversion': '2', 'titles': '|'.join(titles)}
+        normalized = {}
+        found = {}
+        while True:
+            data = await self._query(pool, limiter, params)
+            query = data.get('query', {})
+            for entry in query.get('normalized', []):
+                normalized[entry['from']] = entry['to']
+            for page in query.get('pages', []):
+                if page.get('revisions'):
+                    found[page['title']] = page['revisions'][0]['slots']['main']['content']
+                elif page.get('missing'):
+                    found[page['title']] = None
+            # Large batches are split over several responses, each holding the content of only some of the pages
+            if 'continue' not in data:
+                break
+            params = dict(params, **data['continue'])
+        # Invalid titles, and any the server left out, are neither fetched nor known to be missing
+        return {title: found[normalized.get(title, title)] for title in titles if normalized.get(title, title) in found}
+
+    async def fetch(self, titles, callback=None):
+        '''Fetches the wikitext of the given pages.
+
+        :param titles: The titles of the pages to fetch
+        :type titles: list of str
+        :param callback: Called with the results of each batch as soon as it has been fetched, as a dict like the one
+                         this returns
+        :type callback: callable
+        :return: The wikitext of each page, or None for pages that don't exist. Pages with invalid titles, and any
+                 that the server left out of its responses, are left out.
+        :rtype: dict
+        '''
+        titles = list(titles)
+        batches = iter([titles[i:i + self.batch_size] for i in range(0, len(titles), self.batch_size)])
+        pool = ConnectionPool(self.api_url, self.concurrency, self.timeout)
+        limiter = RateLimiter(self.rate_limit)
+        results = {}
+
+        async def work():
+            for batch in batches:
+                pages = await self._fetch_batch(pool, limiter, batch)
+                results.update(pages)
+                if callback is not None:
+                    callback(pages)
+
+        try:
+            await asyncio.gather(*[work() for _ in range(self.concurrency)])
+        finally:
+            await pool.close()
+        return results
+
+
+def fetch_pages(titles, update=False, progress=None, api_url=None, concurrency=None, batch_size=None,
+                rate_limit=None, timeout=None):
+    '''Fetches the wikitext of many pages and writes it into the cache. Options that aren't given are taken from
+    ``config.json``. Pages that turn out not to exist are remembered as missing (see
+    :py:func:`wikiparse.filemanager.is_known_missing`), and aren't requested again until that expires.
+
+    :param titles: The titles of the pages to fetch
+    :type titles: iterable of str
+    :param update: Whether to fetch pages that are already cached or known to be missing too, replacing the cached
+                   wikitext
+    :type update: bool
+    :param progress: Called with the number of pages fetched so far after each batch
+    :type progress: callable
+    :param api_url: The site's API endpoint
+    :type api_url: str
+    :param concurrency: The number of requests to make at the same time
+    :type concurrency: int
+    :param batch_size: The number of titles to request at once
+    :type batch_size: int
+    :param rate_limit: The most requests to make per second, or 0 for no limit
+    :type rate_limit: float
+    :param timeout: How long, in seconds, to wait for the server before giving up on a request
+    :type timeout: float
+    :return: The number of pages fetched and cached, which excludes pages that don't exist
+    :rtype: int
+    '''
+    from wikiparse import filemanager
+    config = filemanager.config
+    fetcher = Fetcher(api_url or config['api_url'],
+                      concurrency or config['fetch_concurrency'],
+                      batch_size or config['fetch_batch_size'],
+                      config['fetch_rate_limit'] if rate_limit is None else rate_limit,
+                      timeout or config['fetch_timeout'])
+    # Titles that only differ in how they're written are the same page, and only need fetching once
+    titles = [title for title in dict.fromkeys(filemanager.canonical_title(title) for title in titles)
+              if update or not (filemanager.is_cached(title) or filemanager.is_known_missing(title))]
+    fetched = 0
+
+    with filemanager.batch_writer(overwrite=update) as writer:
+        def store(pages):
+            nonlocal fetched
+            for title, wikitext in pages.items():
+                if wikitext is not None:
+                    writer.write_wikitext(title, wikitext)
+                    fetched += 1
+                else:
+                    filemanager.mark_missing(title)
+            if progress is not None:
+                progress(fetched)
+
+        asyncio.run(fetcher.fetch(titles, store))
+    return fetched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch and cache the wikitext of many pages')
+    parser.add_argument('-u', '--update', help="Fetches pages again even if they are already cached", action="store_true", default=False)
+    parser.add_argument('-v', '--verbose', help="Prints a running count of fetched pages", action="store_true", default=False)
+    parser.add_argument('-c', '--concurrency', help="The number of requests to make at the same time", type=int, default=None)
+    parser.add_argument('-b', '--batch_size', help="The number of titles to request at once", type=int, default=None)
+    parser.add_argument('-r', '--rate_limit', help="The most requests to make per second, or 0 for no limit", type=float, default=None)
+    parser.add_argument('titles', help="A file listing one title per line, or - for stdin")
+    args = parser.parse_args()
+
+    titles_file = sys.stdin if args.titles == '-' else open(args.titles, encoding='utf-8')
+    with titles_file:
+        titles = [line.strip() for line in titles_file if line.strip()]
+
+    def progress(count):
+        if args.verbose:
+            sys.stdout.write("%d pages fetched\r" % count)
+            sys.stdout.flush()
+
+    count = fetch_pages(titles, args.update, progress, concurrency=args.concurrency, batch_size=args.batch_size,
+                        rate_limit=args.rate_limit)
+    print("Fetched %d of %d pages" % (count, len(titles)))
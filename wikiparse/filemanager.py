@@ -3,227 +3,959 @@ Manages all loading and caching of data for wikiparse.
 This module is meant primarily for use within wikiparse,
 but can be used from the outside to provide raw data or
 aid in debugging.
-   
+
+Pages are kept in an :py:class:`Archive`: a page cache on disk (see
+:py:mod:`wikiparse.storage`), along with in-memory caches of recently read
+pages. The functions in this module all work on the default archive, which is
+set up from ``config.json``. Nothing is read or opened until it's first needed,
+so importing this module is quick and has no side effects. To work with other
+caches, possibly several at once, open them as :py:class:`Archive` objects,
+which have the same methods as this module::
+
+    with filemanager.Archive("~/simplewiki.zip", try_pulls=False) as archive:
+        wikitext = archive.read_wikitext("Python")
+
 .. moduleauthor:: David Maxson <jexmax@gmail.com>
 '''
 
 global WIKITEXT, JSON
 
-import zipfile
-import os, json, re, atexit
-from unidecode import unidecode
-import atexit
+import os, json, re, atexit, threading, weakref, zlib
+import multiprocessing.util
+from wikiparse import metrics, titleindex
+from wikiparse.storage import DelayedKeyboardInterrupt, LockTimeout, SqliteBackend, open_backend, compression_levels
+from wikiparse.pagecache import LRUCache
+from itertools import islice
+from time import time
 
-# http://stackoverflow.com/questions/842557/how-to-prevent-a-block-of-code-from-being-interrupted-by-keyboardinterrupt-in-py
-import signal
-import logging
-
-class DelayedKeyboardInterrupt(object):
-    def __enter__(self):
-        self.signal_received = False
-        self.old_handler = signal.getsignal(signal.SIGINT)
-        signal.signal(signal.SIGINT, self.handler)
+WIKITEXT = "wtxt"
+JSON = "json"
+JSON_SOURCE = "jsrc"
+# Kinds of entry kept about a page, rather than holding the page, which aren't found by title searches
+RECORD_TYPES = (JSON_SOURCE,)
 
-    def handler(self, signal, frame):
-        self.signal_received = (signal, frame)
-        logging.debug('SIGINT received. Delaying KeyboardInterrupt.')
+# The memory budget for remembering which pages' json was found not to be stale
+FRESH_SOURCES_BYTES = 4 * 1024 * 1024
 
-    def __exit__(self, type, value, traceback):
-        signal.signal(signal.SIGINT, self.old_handler)
-        if self.signal_received:
-            self.old_handler(*self.signal_received)
-           
-# END SO CODE
+WIKIPARSE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-WIKITEXT = "wtxt"
-JSON = "json"
+def load_config():
+    '''Reads the settings in ``config.json``.
 
-WIKIPARSE_DIR = os.path.dirname(__file__)
+    :rtype: dict
+    '''
+    with open(os.path.join(WIKIPARSE_DIR, "config.json")) as config_file:
+        return json.load(config_file)
 
-config = json.load(open(os.path.join(WIKIPARSE_DIR, "config.json")))
-wd = os.getcwd()
-os.chdir(WIKIPARSE_DIR)
-archive_path = os.path.abspath(os.path.expanduser(config['cache_zip']))
-os.chdir(wd)
-text_encoding = config['encoding']
-disallowed_filenames = config['disallowed_file_names']
+def _pick_path(title, ext):
+    return "%s.%s" % (title, ext)
 
-global page_archive
-page_archive = None
-compression_levels = [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA]
-compression = compression_levels[config['compression_level']]
+# Every archive whose backend is open, to be closed when the interpreter exits
+_open_archives = weakref.WeakSet()
 
 def report():
     print("Archive has been closed properly")
-def open_archive(mode):
-    global page_archive
-    if page_archive is not None:
-        page_archive.close()
-        atexit.unregister(report)
-        atexit.unregister(page_archive.close)
-    page_archive = zipfile.ZipFile(archive_path, mode, compression, allowZip64=True)
-    atexit.register(report)
-    atexit.register(page_archive.close)
-
-
-if not os.path.exists(archive_path):
-    # Creates skeleton archive
-    open_archive('w')
-open_archive('r')
 
-def enable_writing():
-    open_archive('a')
-
-if config['verbose_filemanager']:
-    def _verbose(txt):
-        print(txt)
-else:
-    def _verbose(txt):
-        pass
-
-def possible_titles(partial_title=None, max_edit_distance=-1):
-    '''Retrieves all cached pages starting with the specified title text.
-    
-    :param partial_title: The beginning of a title.
-    :type partial_title: str
-    :returns: A generator that provides the possible title names matching the specified title beginning
-    :rtype: Generator of str
+def _close_archives():
+    archives = list(_open_archives)
+    for archive in archives:
+        archive.close()
+    if archives:
+        report()
+
+atexit.register(_close_archives)
+
+def _reset_after_fork():
+    for archive in list(_open_archives):
+        archive._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Processes started by multiprocessing exit without running atexit handlers, but do run its finalizers
+multiprocessing.util.register_after_fork(
+    _close_archives, lambda close: multiprocessing.util.Finalize(None, close, exitpriority=0))
+
+class Archive(object):
+    '''A page cache, which holds the wikitext and json of pages (see :py:mod:`wikiparse.storage`), along with
+    in-memory caches of the pages read most recently. The cache's file is only opened once it's first used.
+
+    :param path: The file holding the cache, or None for the one set in the configuration (``cache_zip`` or
+                 ``cache_sqlite``, depending on ``storage_backend``)
+    :type path: str
+    :param config: The settings to use instead of those in ``config.json``
+    :type config: dict
+    :param options: Settings to override, e.g. ``try_pulls=False``
     '''
-    if partial_title is not None:
-        if max_edit_distance >= 0:
-            from editdistance import eval as distance
-            return (title for title in page_archive.namelist() if distance(title.lower().rpartition('.')[0], partial_title.lower()) <= max_edit_distance)
+
+    def __init__(self, path=None, config=None, **options):
+        self.config = load_config() if config is None else dict(config)
+        self.config.update(options)
+        metrics.configure(self.config)
+        if path is None:
+            # Relative paths in the configuration are relative to the wikiparse directory
+            path = os.path.join(WIKIPARSE_DIR, os.path.expanduser(
+                self.config['cache_sqlite'] if self.config['storage_backend'] == 'sqlite' else self.config['cache_zip']))
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.text_encoding = self.config['encoding']
+        self.disallowed_filenames = self.config['disallowed_file_names']
+        self.compression = compression_levels[self.config['compression_level']]
+        self.page_caches = {
+            WIKITEXT: LRUCache(self.config['wikitext_cache_bytes']),
+            JSON: LRUCache(self.config['json_cache_bytes']),
+        }
+        # The titles whose json was found not to be stale, which are checked again once any of their entries is written
+        self._fresh_sources = LRUCache(FRESH_SOURCES_BYTES)
+        self._backend = None
+        # Whether a run of writes was started, rather than writes being committed a little after they're made
+        self._writing = False
+        self._lock = threading.Lock()
+        # Commits writes made outside a run of writes, once none have been made for write_idle_timeout seconds
+        self._commit_timer = None
+        self._commit_lock = threading.Lock()
+        self._last_write = 0
+        # When each title was last found missing, so that this process remembers even if the misses aren't cached
+        self._missing = {}
+        self._missing_table = None
+
+    @property
+    def backend(self):
+        '''The :py:class:`wikiparse.storage.StorageBackend` holding the pages, which is opened on first use.
+        '''
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._verbose("Opening %s" % self.path)
+                    with metrics.timed("storage.open"):
+                        self._backend = open_backend(self.path, self.compression, self.text_encoding,
+                                                     self.config['sqlite_batch_size'], self.config['shards'],
+                                                     self.config['compression_dictionary'],
+                                                     self.config['write_lock_timeout'])
+                    self._backend.hidden_suffixes = tuple("." + page_type for page_type in RECORD_TYPES)
+                    _open_archives.add(self)
+        return self._backend
+
+    @property
+    def missing_table(self):
+        '''The :py:class:`wikiparse.storage.SqliteBackend` next to the cache (with ``.missing`` appended to its path)
+        that records when pages were found missing, keyed by canonical title. These are kept apart from the pages so
+        that they can be updated in place, and aren't found by title searches.
+        '''
+        if self._missing_table is None:
+            with self._lock:
+                if self._missing_table is None:
+                    self._missing_table = SqliteBackend("%s.missing" % self.path, compression_levels[0], batch_size=1)
+                    _open_archives.add(self)
+        return self._missing_table
+
+    def close(self):
+        '''Flushes and closes the cache's file. It is opened again if the archive is used afterwards.
+        '''
+        with self._lock:
+            self._writing = False
+            self._cancel_commit()
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+            if self._missing_table is not None:
+                self._missing_table.close()
+                self._missing_table = None
+            _open_archives.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _verbose(self, txt):
+        if self.config['verbose_filemanager']:
+            print(txt)
+
+    def cache_stats(self):
+        '''Reports how the in-memory page caches are performing. Each kind of page (:py:data:`WIKITEXT` and
+        :py:data:`JSON`) has its own cache and memory budget, set by ``wikitext_cache_bytes`` and
+        ``json_cache_bytes`` in the configuration.
+
+        :return: The statistics for each kind of page (see :py:meth:`wikiparse.pagecache.LRUCache.stats`)
+        :rtype: dict
+        '''
+        return {page_type: cache.stats() for page_type, cache in self.page_caches.items()}
+
+    def clear_caches(self):
+        '''Empties the in-memory page caches.
+        '''
+        for cache in self.page_caches.values():
+            cache.clear()
+        self._fresh_sources.clear()
+
+    def enable_writing(self):
+        '''Starts a run of writes, which are only committed to disk by :py:meth:`flush`. Otherwise, writes are
+        committed once none have been made for ``write_idle_timeout`` seconds, since committing a zip archive means
+        writing out its whole directory, and writing to it again means reading that directory back in. Until writes
+        are committed, other processes can't write to a zip archive (or to the shards that were written to).
+        '''
+        self.backend.enable_writing()
+        self._writing = True
+
+    def flush(self):
+        '''Commits every write so far to disk, and ends the run of writes started by :py:meth:`enable_writing`, which
+        lets other processes write to the archive. Writes are also committed when the process exits normally, but
+        a process that will be killed, e.g. a worker of a :py:class:`multiprocessing.pool.Pool` that is terminated
+        rather than closed, must flush what it wrote first.
+        '''
+        self._writing = False
+        self._cancel_commit()
+        if self._backend is not None:
+            self._backend.flush()
+
+    def _commit_later(self):
+        with self._commit_lock:
+            self._last_write = time()
+            if self._commit_timer is None:
+                self._start_commit_timer(self.config['write_idle_timeout'])
+
+    def _start_commit_timer(self, delay):
+        self._commit_timer = threading.Timer(delay, self._commit)
+        self._commit_timer.daemon = True
+        self._commit_timer.start()
+
+    def _commit(self):
+        with self._commit_lock:
+            idle = time() - self._last_write
+            if idle < self.config['write_idle_timeout']:
+                # Written to since the timer was started, so wait for the writes to stop
+                self._start_commit_timer(self.config['write_idle_timeout'] - idle)
+                return
+            self._commit_timer = None
+            backend = self._backend
+        if backend is not None and not self._writing:
+            backend.flush()
+
+    def _cancel_commit(self):
+        with self._commit_lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+
+    def _after_fork(self):
+        # The parent's commit timer doesn't run in the child, which commits its own writes
+        self._commit_timer = None
+        self._commit_lock = threading.Lock()
+
+    def rebuild_title_index(self):
+        '''Rebuilds the title index from the archive's central directory. This normally happens automatically
+        whenever the index is found to be out of sync with the archive, but can be forced if the index is suspected
+        to be damaged.
+        '''
+        self.backend.reindex()
+
+    def possible_titles(self, partial_title=None, max_edit_distance=-1, limit=None, ignore_case=False,
+                        ignore_spaces=False):
+        '''Retrieves all cached pages starting with the specified title text.
+
+        :param partial_title: The beginning of a title.
+        :type partial_title: str
+        :param max_edit_distance: If non-negative, instead finds pages whose titles are within this many edits of
+                                  ``partial_title`` (ignoring case), ordered from closest to furthest
+        :type max_edit_distance: int
+        :param limit: The maximum number of titles to generate, or None for no limit
+        :type limit: int
+        :param ignore_case: Whether to match the title beginning case-insensitively
+        :type ignore_case: bool
+        :param ignore_spaces: Whether to treat spaces and underscores as the same character when matching
+        :type ignore_spaces: bool
+        :returns: A generator that provides the possible title names matching the specified title beginning
+        :rtype: Generator of str
+        '''
+        if partial_title is not None:
+            if max_edit_distance >= 0:
+                matches = self.backend.fuzzy_search(partial_title, max_edit_distance)
+                return islice((title for dist, title in matches), limit)
+            else:
+                return islice(self.backend.prefix_search(partial_title, ignore_case, ignore_spaces), limit)
         else:
-            return (title for title in page_archive.namelist() if title.startswith(partial_title))
-    else:
-        return page_archive.namelist()
+            return [name for name in self.backend.names() if not name.endswith(self.backend.hidden_suffixes)]
 
-def _pick_path(title, ext):
-    return bytes(("%s.%s" % (title, ext)), text_encoding)
+    def _invalidate(self, path):
+        title, _, page_type = path.rpartition('.')
+        cache = self.page_caches.get(page_type)
+        if cache is not None:
+            cache.invalidate(path)
+        if page_type in (WIKITEXT, JSON, JSON_SOURCE):
+            self._fresh_sources.invalidate(title)
+            if page_type == WIKITEXT:
+                # Json converted from the wikitext that was there before is stale now
+                self.page_caches[JSON].invalidate(_pick_path(title, JSON))
 
-def _write_page(title, page_type, content, overwrite=False):
-    # This prevents corruption of the zip file if the write is cancelled by a keyboard interrupt
-    with DelayedKeyboardInterrupt():
-        if content is None:
-            return
-        if page_archive.mode is not 'a':
-            open_archive('a')
-        path = _pick_path(title, page_type)
-        _verbose("Writing to %s" % path)
-        if not overwrite and path.decode(text_encoding) in page_archive.namelist():
-            _verbose("Failed to write %s, file already exists (enable overwriting to dismiss this)" % title)
-            return
+    def _encode(self, content, path=None):
+        if type(content) is bytes:
+            return content
         try:
-            content = bytes(content, text_encoding) if type(content) is not bytes else content
-        except TypeError as ex:
-            print(str(ex))
-            print("Tried to convert '%s' to 'bytes'" % str(type(content)))
-        ftarget = path
+            return bytes(content, self.text_encoding)
+        except TypeError:
+            raise TypeError("Can't write %s to %s, pages must be str or bytes"
+                            % (type(content).__name__, path or "the archive")) from None
+
+    def canonical_title(self, title):
+        '''Gets the title a page is stored under, which is its canonical title (see
+        :py:func:`wikiparse.titleindex.canonical_title`) unless ``canonical_titles`` is turned off in the
+        configuration. Pages stored under other titles, e.g. by older versions of wikiparse, can still be read by any
+        title that has the same canonical title.
+
+        :param title: The name of a wikipedia page
+        :type title: str
+        :rtype: str
+        '''
+        return titleindex.canonical_title(title) if self.config['canonical_titles'] else title
+
+    def _canonical_path(self, title, page_type):
+        return _pick_path(self.canonical_title(title), page_type)
+
+    def _read_entry(self, title, page_type, read):
+        # Reads a page with the given backend method, looking for it under another title if it isn't stored under
+        # its canonical title
+        path = self._canonical_path(title, page_type)
+        content = read(path)
+        if content is None and self.config['canonical_titles']:
+            alias = self.backend.resolve_alias(path)
+            if alias is not None:
+                content = read(alias)
+        return content
+
+    def _stored_path(self, title, page_type):
+        path = self._canonical_path(title, page_type)
+        if self.config['canonical_titles'] and path not in self.backend:
+            return self.backend.resolve_alias(path) or path
+        return path
+
+    def _write_page(self, title, page_type, content, overwrite=False):
+        # This prevents corruption of the zip file if the write is cancelled by a keyboard interrupt
+        with DelayedKeyboardInterrupt():
+            if content is None:
+                return
+            path = self._canonical_path(title, page_type)
+            self._verbose("Writing to %s" % path)
+            content = self._encode(content, path)
+            self._invalidate(path)
+            with metrics.timed("storage.write", len(content)):
+                written = self.backend.write(path, content, overwrite)
+            if not self._writing:
+                self._commit_later()
+            if not written:
+                self._verbose("Failed to write %s, file already exists (enable overwriting to dismiss this)" % title)
+            return written
+
+    def _cache_page(self, write, title, *args, **kwargs):
+        # Caches a page that was fetched or converted to be read, which is skipped rather than failing the read if
+        # another process is busy writing to the cache
         try:
-            ftarget = page_archive.getinfo(path)
-        except KeyError:
-            pass
-        page_archive.writestr(ftarget, content)
+            write(title, *args, **kwargs)
+        except LockTimeout as ex:
+            self._verbose("Couldn't cache %s: %s" % (title, ex))
 
-def write_wikitext(title, content, overwrite=False):
-    '''Writes a wikitext page to its appropriate file
+    def batch_writer(self, batch_size=1000, overwrite=False):
+        '''Creates a context manager for writing many pages at once. Pages are buffered and written in groups, and
+        everything is flushed to disk when the context exits::
 
-    :param title: The title of the page that is being written
-    :type title: str
-    :param content: The wikitext as a string
-    :type content: str
-    :param overwrite: Whether or not to overwrite the existing file if the file already exists
-    :type overwrite: bool
-    '''
-    _write_page(title, WIKITEXT, content, overwrite)
+            with filemanager.batch_writer() as writer:
+                for title, wikitext in pages:
+                    writer.write_wikitext(title, wikitext)
+
+        :param batch_size: The number of pages to buffer before writing them
+        :type batch_size: int
+        :param overwrite: Whether or not to overwrite pages that already exist
+        :type overwrite: bool
+        :rtype: BatchWriter
+        '''
+        return BatchWriter(self, batch_size, overwrite)
+
+    def write_wikitext(self, title, content, overwrite=False):
+        '''Writes a wikitext page to its appropriate file
+
+        :param title: The title of the page that is being written
+        :type title: str
+        :param content: The wikitext as a string
+        :type content: str
+        :param overwrite: Whether or not to overwrite the existing file if the file already exists
+        :type overwrite: bool
+        '''
+        self._write_page(title, WIKITEXT, content, overwrite)
+
+    def write_json(self, title, content, overwrite=False, wikitext=None):
+        '''Writes a json page to its appropriate file
+
+        :param title: The title of the page that is being written
+        :type title: str
+        :param content: The json as a string
+        :type content: str
+        :param overwrite: Whether or not to overwrite the existing file if the file already exists
+        :type overwrite: bool
+        :param wikitext: The wikitext the json was converted from. If given, this is recorded along with the json (see
+                         :py:meth:`source_stamp`), so that the json is known to be stale once the page's wikitext
+                         changes.
+        :type wikitext: str
+        '''
+        written = self._write_page(title, JSON, content, overwrite)
+        # Json that was already cached, and so kept, still came from whatever wikitext it came from before
+        if written and wikitext is not None:
+            self._write_page(title, JSON_SOURCE, self.source_stamp(wikitext), overwrite)
+
+    def source_stamp(self, wikitext):
+        '''Describes where a page's json came from: a CRC-32 of the wikitext it was converted from, and the version
+        of the parser that converted it. This is cached along with the json.
+
+        :param wikitext: The page's wikitext
+        :type wikitext: str
+        :rtype: str
+        '''
+        return "%08x %s" % (zlib.crc32(self._encode(wikitext)), parser_version())
+
+    def _current_stamp(self, title):
+        # The checksum of cached wikitext can usually be found without reading the wikitext itself
+        checksum = self._read_entry(title, WIKITEXT, self.backend.checksum)
+        return None if checksum is None else "%08x %s" % (checksum, parser_version())
+
+    def _is_stale(self, title, recorded):
+        if recorded is None:
+            return False
+        current = self._current_stamp(title)
+        return current is not None and current != str(recorded, 'ascii')
+
+    def is_json_stale(self, title):
+        '''Checks whether the cached json for a page was converted from other wikitext than is cached now, or by
+        another version of the parser. This is cheap: it only reads the small record kept along with the json, and
+        (with the zip backend) takes the wikitext's checksum from the archive's directory. Json cached without a
+        record of its source, e.g. by older versions of wikiparse, or for pages whose wikitext isn't cached, is never
+        considered stale.
+
+        :param title: The name of the wikipedia page to check
+        :type title: str
+        :rtype: bool
+        '''
+        with DelayedKeyboardInterrupt():
+            return self._is_stale(title, self._read_entry(title, JSON_SOURCE, self.backend.read))
+
+    def _check_source(self, title):
+        # Like is_json_stale, but remembers the pages found not to be stale until they're next written to
+        if not self.config['check_json_sources']:
+            return False
+        key = self.canonical_title(title)
+        if self._fresh_sources.get(key):
+            return False
+        stale = self.is_json_stale(title)
+        if not stale:
+            self._fresh_sources.put(key, True)
+        return stale
+
+    def stale_json(self):
+        '''Finds every page whose cached json is stale (see :py:meth:`is_json_stale`), e.g. after updating the cache
+        from a newer dump, so that only those pages need to be converted again.
+
+        :return: The title of each page with stale json
+        :rtype: Generator of str
+        '''
+        for title, recorded in self.scan_pages(JSON_SOURCE):
+            if self._is_stale(title, recorded):
+                yield title
+
+    def _missing_since(self, title):
+        title = self.canonical_title(title)
+        found = self._missing.get(title)
+        if found is None:
+            recorded = self.missing_table.read(title)
+            if recorded is None:
+                return None
+            found = self._missing[title] = float(recorded)
+        return found
+
+    def is_known_missing(self, title):
+        '''Checks whether a page was found not to exist on Wikipedia recently enough (within ``missing_title_ttl``
+        seconds) to not bother fetching it again. Pages that are cached are never missing.
+
+        :param title: The name of the wikipedia page to check
+        :type title: str
+        :rtype: bool
+        '''
+        ttl = self.config['missing_title_ttl']
+        if ttl <= 0:
+            return False
+        found = self._missing_since(title)
+        return found is not None and time() - found < ttl and not self.is_cached(title)
+
+    def mark_missing(self, title):
+        '''Records that a page doesn't exist on Wikipedia, so that it isn't fetched again for ``missing_title_ttl``
+        seconds. This is recorded in the :py:attr:`missing_table` if ``cache_pulls`` is set, so that other processes
+        know too.
+
+        :param title: The name of the wikipedia page that's missing
+        :type title: str
+        '''
+        now = time()
+        title = self.canonical_title(title)
+        self._missing[title] = now
+        if self.config['cache_pulls'] and self.config['missing_title_ttl'] > 0:
+            self.missing_table.write(title, b"%.0f" % now, overwrite=True)
+
+    def forget_missing(self, title):
+        '''Lets a page that was found missing be fetched again straight away, e.g. once it's known to have been
+        created.
+
+        :param title: The name of the wikipedia page
+        :type title: str
+        '''
+        title = self.canonical_title(title)
+        self._missing[title] = 0.0
+        if title in self.missing_table:
+            self.missing_table.write(title, b"0", overwrite=True)
+
+    def missing_titles(self):
+        '''Lists the pages that are known to be missing (see :py:meth:`is_known_missing`).
+
+        :return: The title of each missing page
+        :rtype: Generator of str
+        '''
+        ttl = self.config['missing_title_ttl']
+        if ttl <= 0:
+            return
+        now = time()
+        for title, recorded in self.missing_table.scan():
+            found = self._missing.get(title, float(recorded))
+            if now - found < ttl and not self.is_cached(title):
+                yield title
+
+    def _cached_page(self, path, type):
+        text = self.page_caches[type].get(path)
+        # Checked here, since cache hits are cheap enough for even a call that does nothing to add to them
+        if text is not None and metrics.enabled:
+            metrics.count("page_cache.hits")
+        return text
+
+    def _read_page(self, title, type):
+        path = self._canonical_path(title, type)
+        text = self._cached_page(path, type)
+        if text is not None:
+            return text
+        return self._load_page(title, type, path)
+
+    def _load_page(self, title, type, path):
+        # Reads a page that isn't in the in-memory page cache from storage, and caches it
+        metrics.count("page_cache.misses")
+        self._verbose("Reading from %s" % path)
+        with DelayedKeyboardInterrupt(), metrics.timed("storage.read") as timer:
+            content = self._read_entry(title, type, self.backend.read_view)
+            if content is not None:
+                timer.bytes = len(content)
+        if content is None:
+            self._verbose("Read failed, file does not exist")
+            return None
+        with metrics.timed("storage.decode", len(content)):
+            text = str(content, self.text_encoding)
+        self.page_caches[type].put(path, text)
+        return text
+
+    def is_cached(self, title, page_type=WIKITEXT):
+        '''Checks whether a page is cached, without reading it.
+
+        :param title: The name of the wikipedia page to look for
+        :type title: str
+        :param page_type: The kind of page, e.g. :py:data:`WIKITEXT` or :py:data:`JSON`
+        :type page_type: str
+        :rtype: bool
+        '''
+        path = self._canonical_path(title, page_type)
+        return path in self.backend or (self.config['canonical_titles'] and self.backend.resolve_alias(path) is not None)
+
+    def read_raw(self, title, page_type=WIKITEXT):
+        '''Reads the stored bytes of a cached page without decoding them or fetching anything, for callers that only
+        need to search or copy pages and so never need them as a str. The bytes aren't kept in the in-memory page
+        cache, and with the zip backend they are read straight out of the memory-mapped archive without being
+        copied. Use ``str(content, archive.text_encoding)`` to decode them.
+
+        :param title: The name of the wikipedia page to read
+        :type title: str
+        :param page_type: The kind of page, e.g. :py:data:`WIKITEXT` or :py:data:`JSON`
+        :type page_type: str
+        :return: The page's stored bytes, which are only valid until the cache is next written to, or None if the
+                 page isn't cached
+        :rtype: memoryview
+        '''
+        return self._read_entry(title, page_type, self.backend.read_view)
+
+    def scan_pages(self, page_type=WIKITEXT, titles=None):
+        '''Reads every cached page of one kind in storage order, which is much faster than reading them by title
+        when processing a whole cache. Like :py:meth:`read_raw`, pages are returned as undecoded bytes.
+
+        :param page_type: The kind of page, e.g. :py:data:`WIKITEXT` or :py:data:`JSON`
+        :type page_type: str
+        :param titles: Only read these pages, skipping any that aren't cached
+        :type titles: iterable of str
+        :return: The title each page is stored under, and its stored bytes
+        :rtype: Generator of (str, memoryview)
+        '''
+        suffix = "." + page_type
+        if titles is None:
+            paths = (path for path in self.backend.names() if path.endswith(suffix))
+        else:
+            paths = (self._stored_path(title, page_type) for title in titles)
+        for path, content in self.backend.scan(paths):
+            yield path[:-len(suffix)], content
+
+    def _fetch_wikitext(self, title):
+        import urllib.parse
+        import urllib.request as url
+        self._verbose("Pulling '%s' from wikipedia" % title)
+        params = urllib.parse.urlencode({'action': 'raw', 'title': title})
+        try:
+            with metrics.timed("fetch.page") as timer:
+                content = url.urlopen(self.config['fetch_url'] % params).read()
+                timer.bytes = len(content)
+        except urllib.error.HTTPError as ex:
+            # Other errors, such as the server being overloaded, say nothing about whether the page exists
+            if ex.code == 404:
+                metrics.count("fetch.missing")
+                self.mark_missing(title)
+            return None
+        wikitext = str(content, self.text_encoding)
+        if self.config['cache_pulls']:
+            self._cache_page(self.write_wikitext, title, wikitext)
+        return wikitext
+
+    def _parse_wikitext_to_json(self, wikitext):
+        self._verbose("Converting wikitext to json")
+        # Includes waiting for a free parser, unlike the parser.call stage
+        with metrics.timed("parse.page", len(wikitext)):
+            return _initialize_wikiparser(self.config).submit(wikitext).result()
+
+    def read_wikitext(self, title):
+        '''Reads the wikitext for the specified page, fetching it directly from wikipedia if no cached version is
+        available. Pages that were recently found not to exist aren't fetched again (see
+        :py:meth:`is_known_missing`).
+
+        :param title: The name of the wikipedia page to retrieve wikitext for
+        :type title: str
+        :return: The wikitext
+        :rtype: str
+        '''
+        ret = self._read_page(title, WIKITEXT)
+        if ret is not None:
+            return ret
+        elif self.config['try_pulls']:
+            if self.is_known_missing(title):
+                metrics.count("fetch.known_missing")
+                return None
+            return self._fetch_wikitext(title)
+        else:
+            return None
+
+    def read_json(self, title):
+        '''Reads the json for the specified page, generating it with the parser from the wikitext if no cached
+        version is available
+
+        :param title: The name of the wikipedia page to retrieve json for
+        :type title: str
+        :return: The json text
+        :rtype: str
+        '''
+        path = self._canonical_path(title, JSON)
+        # Json in the page cache was checked when it was read, and is dropped from it when the page's wikitext is
+        # written, so only json read from storage needs checking
+        ret = self._cached_page(path, JSON)
+        stale = False
+        if ret is None:
+            stale = self._check_source(title)
+            ret = None if stale else self._load_page(title, JSON, path)
+        if ret is not None:
+            metrics.count("json.cached")
+            return ret
+        else:
+            wikitext = self.read_wikitext(title)
+            if wikitext is not None:
+                metrics.count("json.converted")
+                if stale:
+                    metrics.count("json.stale")
+                    self._verbose("Cached json for %s is stale, converting it again" % title)
+                res_json = self._parse_wikitext_to_json(wikitext)
+                if self.config['cache_pulls']:
+                    self._cache_page(self.write_json, title, res_json, overwrite=stale, wikitext=wikitext)
+                return res_json
+            else:
+                return None
+
+    def read_tree(self, title):
+        '''Reads the parsed page tree for the specified page, which is the structure of the page's json.
 
-def write_json(title, content, overwrite=False):
-    '''Writes a json page to its appropriate file
+        :param title: The name of the wikipedia page to retrieve the tree for
+        :type title: str
+        :return: The page tree, as :py:func:`json.loads` would return it, or None if the page wasn't found
+        :rtype: dict
+        '''
+        res_json = self.read_json(title)
+        if res_json is None:
+            return None
+        with metrics.timed("json.decode", len(res_json)):
+            return json.loads(res_json)
+
+class BatchWriter(object):
+    '''Buffers page writes and stores them in large groups, which saves a little time per page over writing pages one
+    at a time, and keeps the archive open for writing until it's done. Create one with
+    :py:meth:`Archive.batch_writer`.
+
+    Each group is written under a single keyboard interrupt guard, so interrupting a batch still leaves the archive
+    intact: the group being written is finished first, and any pages still buffered are lost.
 
-    :param title: The title of the page that is being written
-    :type title: str
-    :param content: The json as a string
-    :type content: str
-    :param overwrite: Whether or not to overwrite the existing file if the file already exists
+    For zip archives, other processes can't write to the archive while a batch writer is open, and wait for it for
+    up to ``write_lock_timeout`` seconds, so batch writers shouldn't be kept open for longer than it takes to write
+    their pages.
+
+    :param archive: The archive to write to
+    :type archive: Archive
+    :param batch_size: The number of pages to buffer before writing them
+    :type batch_size: int
+    :param overwrite: Whether or not to overwrite pages that already exist
     :type overwrite: bool
     '''
-    _write_page(title, JSON, content, overwrite)
 
-def _read_page(title, type):
-    path = _pick_path(title, type)
-    _verbose("Reading from %s" % path)
-    try:
+    def __init__(self, archive, batch_size=1000, overwrite=False):
+        self.archive = archive
+        self.batch_size = batch_size
+        self.overwrite = overwrite
+        self.written = 0
+        self._pending = []
+
+    def write(self, title, page_type, content):
+        '''Queues a page to be written.
+
+        :param title: The title of the page that is being written
+        :type title: str
+        :param page_type: The kind of page, e.g. :py:data:`WIKITEXT` or :py:data:`JSON`
+        :type page_type: str
+        :param content: The page content
+        :type content: str
+        :raises TypeError: If the content is neither str nor bytes, in which case the page isn't queued
+        '''
+        if content is None:
+            return
+        path = self.archive._canonical_path(title, page_type)
+        # Encoding now means a page that can't be written is refused here, rather than failing the whole batch later
+        self._pending.append((path, self.archive._encode(content, path)))
+        if len(self._pending) >= self.batch_size:
+            self.write_pending()
+
+    def write_wikitext(self, title, content):
+        '''Queues a wikitext page to be written.
+        '''
+        self.write(title, WIKITEXT, content)
+
+    def write_json(self, title, content, wikitext=None):
+        '''Queues a json page to be written. If given the wikitext it was converted from, the page's source is also
+        recorded (see :py:meth:`Archive.write_json`).
+        '''
+        if content is None:
+            return
+        if not self.overwrite and self.archive.is_cached(title, JSON):
+            # The json already cached is kept, and so is the record of where it came from
+            return
+        self.write(title, JSON, content)
+        if wikitext is not None:
+            self.write(title, JSON_SOURCE, self.archive.source_stamp(wikitext))
+
+    def write_pending(self):
+        '''Writes every queued page now.
+        '''
+        if self._pending:
+            self.archive._verbose("Writing a batch of %d pages" % len(self._pending))
+            with DelayedKeyboardInterrupt(), \
+                    metrics.timed("storage.write_batch", sum(len(content) for _, content in self._pending)):
+                self.written += self.archive.backend.write_many(self._pending, self.overwrite)
+            for path, _ in self._pending:
+                self.archive._invalidate(path)
+            self._pending = []
+
+    def __enter__(self):
+        self.archive.enable_writing()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not KeyboardInterrupt:
+            self.write_pending()
         with DelayedKeyboardInterrupt():
-            return str(page_archive.read(path), text_encoding)
-    except KeyError:
-        _verbose("Read failed, file does not exist")
-        return None
+            self.archive.flush()
 
-def _fetch_wikitext(title):
-    import urllib.parse
-    import urllib.request as url
-    _verbose("Pulling '%s' from wikipedia" % title)
-    params = urllib.parse.urlencode({'action': 'raw', 'title': title})
-    try:
-        wikitext = str(url.urlopen(config['fetch_url'] % params).read(), text_encoding)
-    except urllib.error.HTTPError:
-        return None
-    if config['cache_pulls']:
-        write_wikitext(title, wikitext)
-    return wikitext
-
-gateway = None
-def _initialize_wikiparser():
-    import subprocess, atexit
-    from py4j.java_gateway import JavaGateway as java
-    global gateway
-    if gateway is None:
-        _verbose("Launching gateway")
-        # Launch gateway server
-        wikitojson = subprocess.Popen(["java", "-jar", os.path.join(WIKIPARSE_DIR, "WikiToJson.jar")], stdout=subprocess.PIPE, universal_newlines=True)
-        atexit.register(wikitojson.kill)
-        wikitojson.stdout.read() # Wait until the gateway has launched
-        _verbose("Gateway launched")
-        gateway = java()
-    return gateway
-
-def _parse_wikitext_to_json(wikitext):
-    _verbose("Converting wikitext to json")
-    return _initialize_wikiparser().convertWikitextToJson(wikitext)
+_default_archive = None
+_default_archive_lock = threading.Lock()
+def default_archive():
+    '''Gets the archive that the functions in this module work on, setting it up from ``config.json`` if need be.
 
-def read_wikitext(title):
-    '''Reads the wikitext for the specified page, fetching it directly from wikipedia if no cached version is available
+    :rtype: Archive
+    '''
+    global _default_archive
+    if _default_archive is None:
+        with _default_archive_lock:
+            if _default_archive is None:
+                _default_archive = Archive()
+    return _default_archive
 
-    :param title: The name of the wikipedia page to retrieve wikitext for
-    :type title: str
-    :return: The wikitext
-    :rtype: str
+def use_archive(archive):
+    '''Makes the functions in this module work on another archive from now on.
+
+    :param archive: The archive to use, or None to go back to one set up from ``config.json``
+    :type archive: Archive
+    :return: The archive that was in use before, which is left open
+    :rtype: Archive
     '''
-    ret = _read_page(title, WIKITEXT)
-    if ret is not None:
-        return ret
-    elif config['try_pulls']:
-        return _fetch_wikitext(title)
-    else:
-        return None
+    global _default_archive
+    with _default_archive_lock:
+        previous, _default_archive = _default_archive, archive
+    return previous
 
-def read_json(title):
-    '''Reads the json for the specified page, generating it with the parser from the wikitext if no cached version is available
+# Settings that used to be read when this module was imported, which now come from the default archive
+_ARCHIVE_ATTRIBUTES = {
+    'backend': 'backend',
+    'config': 'config',
+    'archive_path': 'path',
+    'text_encoding': 'text_encoding',
+    'compression': 'compression',
+    'disallowed_filenames': 'disallowed_filenames',
+    'page_caches': 'page_caches',
+}
+
+def __getattr__(name):
+    if name in _ARCHIVE_ATTRIBUTES:
+        return getattr(default_archive(), _ARCHIVE_ATTRIBUTES[name])
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+parser_pool = None
+_parser_pool_lock = threading.Lock()
+def _initialize_wikiparser(config=None):
+    # The parsers are shared by every archive in the process, and set up from the settings of the first to need them
+    global parser_pool
+    with _parser_pool_lock:
+        if parser_pool is None:
+            from wikiparse.parserpool import ParserPool
+            config = config or default_archive().config
+            daemon_dir = os.path.abspath(os.path.expanduser(config['parser_daemon_dir'])) if config['parser_daemon'] else None
+            parser_pool = ParserPool(config['parser_workers'], config['parser_batch_size'],
+                                     os.path.join(WIKIPARSE_DIR, "WikiToJson.jar"), daemon_dir)
+            if config['verbose_filemanager']:
+                print("Starting a pool of %d parser gateways" % parser_pool.workers)
+            atexit.register(parser_pool.close)
+    return parser_pool
+
+def parse_wikitexts(wikitexts):
+    '''Converts many pages of wikitext to json at once, spread over the pool of ``parser_workers`` parser gateways
+    (see :py:mod:`wikiparse.parserpool`). This is much faster than parsing pages one at a time with
+    :py:func:`read_json`. The json isn't cached.
+
+    :param wikitexts: The wikitext of each page
+    :type wikitexts: iterable of str
+    :return: A future for the json of each page, in the same order
+    :rtype: list of concurrent.futures.Future
+    '''
+    return _initialize_wikiparser().submit_many(wikitexts)
+
+_parser_version = None
+def parser_version():
+    '''Identifies the build of the parser in use (see :py:func:`wikiparse.parserpool.parser_version`).
 
-    :param title: The name of the wikipedia page to retrieve json for
-    :type title: str
-    :return: The json text
     :rtype: str
     '''
-    ret = _read_page(title, JSON)
-    if ret is not None:
-        return ret
-    else:
-        wikitext = read_wikitext(title)
-        if wikitext is not None:
-            res_json = _parse_wikitext_to_json(wikitext)
-            if config['cache_pulls']:
-                write_json(title, res_json)
-            return res_json
-        else:
-            return None
+    global _parser_version
+    if _parser_version is None:
+        from wikiparse.parserpool import parser_version as jar_version
+        _parser_version = jar_version(os.path.join(WIKIPARSE_DIR, "WikiToJson.jar"))
+    return _parser_version
+
+def cache_stats():
+    '''See :py:meth:`Archive.cache_stats`.'''
+    return default_archive().cache_stats()
+
+def clear_caches():
+    '''See :py:meth:`Archive.clear_caches`.'''
+    default_archive().clear_caches()
+
+def enable_writing():
+    default_archive().enable_writing()
+
+def flush():
+    '''See :py:meth:`Archive.flush`.'''
+    default_archive().flush()
+
+def rebuild_title_index():
+    '''See :py:meth:`Archive.rebuild_title_index`.'''
+    default_archive().rebuild_title_index()
+
+def possible_titles(partial_title=None, max_edit_distance=-1, limit=None, ignore_case=False, ignore_spaces=False):
+    '''See :py:meth:`Archive.possible_titles`.'''
+    return default_archive().possible_titles(partial_title, max_edit_distance, limit, ignore_case, ignore_spaces)
+
+def batch_writer(batch_size=1000, overwrite=False):
+    '''See :py:meth:`Archive.batch_writer`.'''
+    return default_archive().batch_writer(batch_size, overwrite)
+
+def write_wikitext(title, content, overwrite=False):
+    '''See :py:meth:`Archive.write_wikitext`.'''
+    default_archive().write_wikitext(title, content, overwrite)
+
+def write_json(title, content, overwrite=False, wikitext=None):
+    '''See :py:meth:`Archive.write_json`.'''
+    default_archive().write_json(title, content, overwrite, wikitext)
+
+def source_stamp(wikitext):
+    '''See :py:meth:`Archive.source_stamp`.'''
+    return default_archive().source_stamp(wikitext)
+
+def is_json_stale(title):
+    '''See :py:meth:`Archive.is_json_stale`.'''
+    return default_archive().is_json_stale(title)
+
+def stale_json():
+    '''See :py:meth:`Archive.stale_json`.'''
+    return default_archive().stale_json()
+
+def canonical_title(title):
+    '''See :py:meth:`Archive.canonical_title`.'''
+    return default_archive().canonical_title(title)
+
+def is_cached(title, page_type=WIKITEXT):
+    '''See :py:meth:`Archive.is_cached`.'''
+    return default_archive().is_cached(title, page_type)
+
+def is_known_missing(title):
+    '''See :py:meth:`Archive.is_known_missing`.'''
+    return default_archive().is_known_missing(title)
+
+def mark_missing(title):
+    '''See :py:meth:`Archive.mark_missing`.'''
+    default_archive().mark_missing(title)
+
+def forget_missing(title):
+    '''See :py:meth:`Archive.forget_missing`.'''
+    default_archive().forget_missing(title)
+
+def missing_titles():
+    '''See :py:meth:`Archive.missing_titles`.'''
+    return default_archive().missing_titles()
+
+def read_raw(title, page_type=WIKITEXT):
+    '''See :py:meth:`Archive.read_raw`.'''
+    return default_archive().read_raw(title, page_type)
+
+def scan_pages(page_type=WIKITEXT, titles=None):
+    '''See :py:meth:`Archive.scan_pages`.'''
+    return default_archive().scan_pages(page_type, titles)
+
+def _fetch_wikitext(title):
+    return default_archive()._fetch_wikitext(title)
+
+def read_wikitext(title):
+    '''See :py:meth:`Archive.read_wikitext`.'''
+    return default_archive().read_wikitext(title)
+
+def read_json(title):
+    '''See :py:meth:`Archive.read_json`.'''
+    return default_archive().read_json(title)
+
+def read_tree(title):
+    '''See :py:meth:`Archive.read_tree`.'''
+    return default_archive().read_tree(title)
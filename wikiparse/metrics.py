@@ -0,0 +1,333 @@
+'''
+Counters, latency histograms and byte counts for each stage of getting a page:
+reading it from the cache, fetching it from Wikipedia, converting it with the
+parser, and building its tree. Metrics are off by default, and cost next to
+nothing while off. Turn them on with ``metrics`` in ``config.json``, with the
+``WIKIPARSE_METRICS`` environment variable (which overrides the configuration,
+e.g. ``WIKIPARSE_METRICS=1``), or from Python::
+
+    from wikiparse import metrics
+    metrics.enable()
+    ...
+    print(metrics.format_report())
+
+Each stage is timed as it happens, under a dotted name such as ``storage.read``
+or ``parser.call``, and :py:func:`snapshot` reads everything recorded so far.
+With ``metrics_report_interval`` (or ``WIKIPARSE_METRICS_INTERVAL``) set to a
+number of seconds, a report is also printed to standard error that often.
+
+For tracing, functions added with :py:func:`add_listener` are called with each
+timing as it's recorded, which lets them pass timings on to another monitoring
+system.
+'''
+
+import os
+import sys
+import threading
+from time import perf_counter
+
+ENVIRONMENT_VARIABLE = "WIKIPARSE_METRICS"
+INTERVAL_ENVIRONMENT_VARIABLE = "WIKIPARSE_METRICS_INTERVAL"
+
+# Latencies are counted in buckets of powers of two microseconds, up to about 35 minutes
+BUCKETS = 32
+
+#: Whether metrics are being recorded
+enabled = False
+
+_lock = threading.Lock()
+_counters = {}
+_stages = {}
+_listeners = []
+_reporter = None
+
+
+class Histogram(object):
+    '''The latencies and sizes recorded for one stage. Latencies are kept in buckets of powers of two microseconds, so
+    percentiles are estimates, accurate to within a factor of two.
+    '''
+
+    def __init__(self):
+        #: How many times the stage ran
+        self.count = 0
+        #: How many times the stage raised an exception
+        self.errors = 0
+        #: The total time spent in the stage, in seconds
+        self.seconds = 0.0
+        #: The longest the stage took, in seconds
+        self.max = 0.0
+        #: The total number of bytes the stage handled
+        self.bytes = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds, nbytes=0, error=False):
+        self.count += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += nbytes
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        '''Estimates the latency that the given fraction of runs took at most.
+
+        :param fraction: Between 0 and 1, e.g. 0.99 for the 99th percentile
+        :type fraction: float
+        :return: The latency, in seconds
+        :rtype: float
+        '''
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                # The top of the bucket, unless the slowest run was quicker than that
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        '''
+        :return: The stage's ``count``, ``errors``, ``seconds``, ``bytes``, and the ``mean``, ``p50``, ``p90``,
+                 ``p99`` and ``max`` latencies in seconds
+        :rtype: dict
+        '''
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'mean': self.seconds / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class _Timer(object):
+    '''Times a stage when used as a context manager. The number of bytes handled can be set on it before it exits.
+    '''
+    __slots__ = ('stage', 'bytes', '_start')
+
+    def __init__(self, stage, nbytes):
+        self.stage = stage
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        observe(self.stage, perf_counter() - self._start, self.bytes or 0, type is not None)
+
+
+class _NullTimer(object):
+    '''Stands in for a timer while metrics are off. Bytes set on it are never read.
+    '''
+    __slots__ = ('bytes',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage, nbytes=None):
+    '''Times a stage of work::
+
+        with metrics.timed("storage.read") as timer:
+            content = backend.read(path)
+            timer.bytes = len(content)
+
+    :param stage: The stage's name
+    :type stage: str
+    :param nbytes: The number of bytes the stage handles, if already known
+    :type nbytes: int
+    :return: A context manager, which does nothing while metrics are off
+    '''
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(stage, nbytes)
+
+
+def observe(stage, seconds, nbytes=0, error=False):
+    '''Records one run of a stage that was timed some other way.
+
+    :param stage: The stage's name
+    :type stage: str
+    :param seconds: How long the stage took
+    :type seconds: float
+    :param nbytes: The number of bytes the stage handled
+    :type nbytes: int
+    :param error: Whether the stage failed
+    :type error: bool
+    '''
+    if not enabled:
+        return
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.add(seconds, nbytes, error)
+    for listener in _listeners:
+        listener(stage, seconds, nbytes, error)
+
+
+def count(name, amount=1):
+    '''Adds to a counter, such as the number of page cache hits.
+
+    :param name: The counter's name
+    :type name: str
+    :param amount: How much to add
+    :type amount: int
+    '''
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def add_listener(listener):
+    '''Calls a function with every timing recorded from now on, as ``listener(stage, seconds, nbytes, error)``. The
+    function is called on whichever thread ran the stage, so it should be quick and thread-safe.
+
+    :param listener: The function to call
+    :type listener: callable
+    '''
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    '''Stops calling a function added with :py:func:`add_listener`.
+
+    :param listener: The function to stop calling
+    :type listener: callable
+    '''
+    _listeners.remove(listener)
+
+
+def snapshot():
+    '''Reads everything recorded so far.
+
+    :return: The value of each counter, under ``counters``, and the summary of each stage (see
+             :py:meth:`Histogram.summary`), under ``stages``
+    :rtype: dict
+    '''
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'stages': {stage: histogram.summary() for stage, histogram in _stages.items()},
+        }
+
+
+def reset():
+    '''Forgets everything recorded so far.
+    '''
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+
+
+def format_report(metrics=None):
+    '''Lays out the recorded metrics as a table.
+
+    :param metrics: The metrics to lay out, as returned by :py:func:`snapshot`, or None for the current ones
+    :type metrics: dict
+    :rtype: str
+    '''
+    metrics = metrics or snapshot()
+    lines = ["%-24s %9s %7s %10s %9s %9s %9s %9s %12s"
+             % ("stage", "count", "errors", "total s", "mean ms", "p50 ms", "p99 ms", "max ms", "bytes")]
+    for stage, summary in sorted(metrics['stages'].items()):
+        lines.append("%-24s %9d %7d %10.3f %9.3f %9.3f %9.3f %9.3f %12d"
+                     % (stage, summary['count'], summary['errors'], summary['seconds'], summary['mean'] * 1e3,
+                        summary['p50'] * 1e3, summary['p99'] * 1e3, summary['max'] * 1e3, summary['bytes']))
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append("%-24s %9d" % (name, value))
+    return "\n".join(lines)
+
+
+class _Reporter(threading.Thread):
+
+    def __init__(self, interval, file):
+        threading.Thread.__init__(self, name="wikiparse-metrics", daemon=True)
+        self.interval = interval
+        self.file = file
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            print(format_report(), file=self.file or sys.stderr)
+            (self.file or sys.stderr).flush()
+
+
+def start_reporting(interval, file=None):
+    '''Prints a report (see :py:func:`format_report`) every so often, on a background thread, replacing any reports
+    started before.
+
+    :param interval: How often to report, in seconds
+    :type interval: float
+    :param file: Where to print the reports, which defaults to standard error
+    :type file: file
+    '''
+    global _reporter
+    stop_reporting()
+    _reporter = _Reporter(interval, file)
+    _reporter.start()
+
+
+def stop_reporting():
+    '''Stops the reports started by :py:func:`start_reporting`.
+    '''
+    global _reporter
+    if _reporter is not None:
+        _reporter.stopped.set()
+        _reporter = None
+
+
+def enable(report_interval=0):
+    '''Starts recording metrics.
+
+    :param report_interval: If positive, also prints a report this often, in seconds
+    :type report_interval: float
+    '''
+    global enabled
+    enabled = True
+    if report_interval > 0:
+        start_reporting(report_interval)
+
+
+def disable():
+    '''Stops recording metrics, keeping what was recorded so far.
+    '''
+    global enabled
+    enabled = False
+    stop_reporting()
+
+
+def _environment_setting():
+    setting = os.environ.get(ENVIRONMENT_VARIABLE)
+    if setting is None:
+        return None
+    return setting.strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def configure(config):
+    '''Turns metrics on as the configuration (``metrics`` and ``metrics_report_interval``) says, unless the
+    ``WIKIPARSE_METRICS`` environment variable says otherwise. Metrics that are already on are left on.
+
+    :param config: The settings from ``config.json``
+    :type config: dict
+    '''
+    wanted = _environment_setting()
+    if wanted is None:
+        wanted = config.get('metrics', False)
+    interval = float(os.environ.get(INTERVAL_ENVIRONMENT_VARIABLE) or config.get('metrics_report_interval', 0))
+    if wanted and not enabled:
+        enable(interval)
+
+if _environment_setting():
+    enable(float(os.environ.get(INTERVAL_ENVIRONMENT_VARIABLE) or 0))
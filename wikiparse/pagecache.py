@@ -0,0 +1,101 @@
+'''
+An in-memory cache of decoded pages, which saves decompressing and decoding
+pages that are read again and again. This module is used internally by
+:py:mod:`wikiparse.filemanager`, which keeps a separate cache for each kind
+of page (wikitext and JSON) so that each can be given its own memory budget.
+'''
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''A mapping with a memory budget in bytes, which evicts its least recently used entries to stay within budget.
+    Sizes are estimated with :py:func:`sys.getsizeof`, so they include Python's per-object overhead.
+
+    :param max_bytes: The memory budget; a budget of 0 disables the cache
+    :type max_bytes: int
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Gets a cached value, marking it as recently used.
+
+        :param key: The key to look up
+        :return: The cached value, or None if it isn't cached
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        '''Caches a value, evicting older entries if necessary. Values larger than the whole budget aren't cached.
+
+        :param key: The key to store the value under
+        :param value: The value to cache
+        '''
+        size = sys.getsizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, key):
+        '''Removes a value from the cache, if it's there.
+
+        :param key: The key to remove
+        '''
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        '''Removes every value from the cache.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''Reports how the cache is performing.
+
+        :return: The cache's ``hits``, ``misses``, ``evictions``, number of ``entries``, ``bytes`` used and
+                 ``max_bytes`` budget
+        :rtype: dict
+        '''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+'''
+Keeps long-lived WikiToJson parser gateways, or *daemons*, running for every
+Python process on the host to share, so that short-lived jobs don't each spend
+seconds launching a JVM of their own.
+
+Each daemon has a numbered slot, and keeps its state in a small JSON file in the
+daemon directory (``parser_daemon_dir`` in ``config.json``): the port it
+actually listens on, its process id, and whether it can convert a batch of
+pages in one call. Attaching to a running daemon only takes reading that file
+and connecting to the port. Daemons are started on demand, under a lock file per
+slot, so however many processes attach at once, each slot only ever gets one
+daemon. Before attaching, a daemon is pinged, and if it doesn't answer (it may
+have crashed, or exited on a page it couldn't parse) a new one is started in its
+place.
+
+With ``parser_daemon`` enabled in ``config.json``, :py:mod:`wikiparse.filemanager`
+converts pages on daemons rather than on gateways of its own, attaching to one
+daemon slot per ``parser_workers``. Daemons keep running once started, so this
+script can start them ahead of time, check on them, or stop them::
+
+    python3 parserdaemon.py start -w 4
+    python3 parserdaemon.py status
+    python3 parserdaemon.py stop
+
+::
+
+    usage: parserdaemon.py [-h] [-w WORKERS] [-d DIRECTORY] {start,stop,status}
+
+    Manage the shared parser daemons
+
+    positional arguments:
+      {start,stop,status}   Whether to start, stop, or report on the daemons
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -w WORKERS, --workers WORKERS
+                            The number of daemon slots to manage (defaults to
+                            the configured number of parser workers)
+      -d DIRECTORY, --directory DIRECTORY
+                            The daemon directory (defaults to the configured
+                            one)
+'''
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+
+from wikiparse.parserpool import DEFAULT_JAR, ParserGateway, launch_jvm
+from wikiparse.storage import FileLock
+
+# How long, in seconds, a daemon gets to answer a ping before it's considered hung
+PING_TIMEOUT = 5
+
+# What py4j reports when a gateway built before gateways could be pinged is asked to ping
+_NO_PING_METHOD = "Method ping([]) does not exist"
+
+if os.name == 'posix':
+    # Detached from the launching process's session, so the daemon outlives it and its terminal
+    _DETACHED = {'start_new_session': True}
+else:
+    _DETACHED = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+class ParserDaemon(object):
+    '''One slot for a shared parser daemon.
+
+    :param directory: The directory holding the daemons' state, lock and log files
+    :type directory: str
+    :param slot: The daemon's slot number
+    :type slot: int
+    :param jar: The WikiToJson jar to run, if the daemon has to be started
+    :type jar: str
+    '''
+
+    def __init__(self, directory, slot=0, jar=DEFAULT_JAR):
+        self.directory = directory
+        self.slot = slot
+        self.jar = jar
+        self.state_path = os.path.join(directory, "parser-%d.json" % slot)
+        self.lock_path = os.path.join(directory, "parser-%d.lock" % slot)
+        self.log_path = os.path.join(directory, "parser-%d.log" % slot)
+
+    def state(self):
+        '''Reads what the daemon last published about itself, whether or not it's still running.
+
+        :return: The daemon's ``port``, ``pid`` and whether it ``batches`` pages, or None if it was never started
+        :rtype: dict
+        '''
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+    def ping(self, state=None):
+        '''Checks that the daemon is up and answering.
+
+        :param state: The daemon's state, if it has already been read
+        :type state: dict
+        :rtype: bool
+        '''
+        from py4j.java_gateway import JavaGateway, GatewayParameters
+        from py4j.protocol import Py4JError, Py4JNetworkError
+        state = state or self.state()
+        if state is None:
+            return False
+        gateway = JavaGateway(gateway_parameters=GatewayParameters(port=state['port'], read_timeout=PING_TIMEOUT))
+        try:
+            return gateway.entry_point.ping()
+        except Py4JNetworkError:
+            return False
+        except Py4JError as ex:
+            # Built before gateways could be pinged, but it answered all the same. Anything else is a daemon that
+            # isn't working.
+            return _NO_PING_METHOD in str(ex)
+        finally:
+            gateway.close()
+
+    def _publish(self, state):
+        temporary = self.state_path + ".tmp"
+        with open(temporary, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary, self.state_path)
+
+    def start(self):
+        '''Starts the daemon, unless it's already running.
+
+        :return: The running daemon's state (see :py:meth:`state`)
+        :rtype: dict
+        '''
+        state = self.state()
+        if state is not None and self.ping(state):
+            return state
+        os.makedirs(self.directory, exist_ok=True)
+        lock = FileLock(self.lock_path)
+        lock.acquire()
+        try:
+            # Another process may have started it while this one waited for the lock
+            state = self.state()
+            if state is not None and self.ping(state):
+                return state
+            with open(self.log_path, 'a') as log:
+                process, port, batches = launch_jvm(self.jar, stdin=subprocess.DEVNULL, stderr=log, **_DETACHED)
+            state = {'port': port, 'pid': process.pid, 'batches': batches}
+            self._publish(state)
+            return state
+        finally:
+            lock.release()
+
+    def stop(self):
+        '''Stops the daemon, if it's running.
+
+        :return: Whether the daemon was running
+        :rtype: bool
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        lock = FileLock(self.lock_path)
+        lock.acquire()
+        try:
+            state = self.state()
+            # Only a daemon that answers is known to still own its process id
+            running = state is not None and self.ping(state)
+            if running:
+                try:
+                    os.kill(state['pid'], signal.SIGTERM)
+                except OSError:
+                    pass
+            if state is not None:
+                os.remove(self.state_path)
+            return running
+        finally:
+            lock.release()
+
+
+class DaemonGateway(ParserGateway):
+    '''A connection to a shared parser daemon, which is started first if it isn't running. Closing the connection
+    leaves the daemon running for other processes.
+
+    :param daemon: The daemon to attach to
+    :type daemon: ParserDaemon
+    '''
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        state = daemon.start()
+        self.process = None
+        self.port = state['port']
+        self.supports_batches = state['batches']
+        self._connect()
+
+    def close(self):
+        '''Disconnects from the daemon.
+        '''
+        self.gateway.close()
+
+
+def daemons(directory, workers, jar=DEFAULT_JAR):
+    '''Lists the daemon slots used by a pool of parser workers.
+
+    :param directory: The daemon directory
+    :type directory: str
+    :param workers: The number of parser workers
+    :type workers: int
+    :param jar: The WikiToJson jar to run
+    :type jar: str
+    :rtype: list of ParserDaemon
+    '''
+    return [ParserDaemon(directory, slot, jar) for slot in range(workers)]
+
+
+if __name__ == '__main__':
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")) as config_file:
+        config = json.load(config_file)
+    parser = argparse.ArgumentParser(description='Manage the shared parser daemons')
+    parser.add_argument('command', help="Whether to start, stop, or report on the daemons", choices=['start', 'stop', 'status'])
+    parser.add_argument('-w', '--workers', help="The number of daemon slots to manage (defaults to the configured number of parser workers)", type=int, default=None)
+    parser.add_argument('-d', '--directory', help="The daemon directory (defaults to the configured one)", default=None)
+    args = parser.parse_args()
+
+    directory = os.path.abspath(os.path.expanduser(args.directory or config['parser_daemon_dir']))
+    for daemon in daemons(directory, args.workers or config['parser_workers'] or os.cpu_count() or 1):
+        if args.command == 'start':
+            state = daemon.start()
+            print("Daemon %d is running on port %d" % (daemon.slot, state['port']))
+        elif args.command == 'stop':
+            print("Daemon %d %s" % (daemon.slot, "stopped" if daemon.stop() else "wasn't running"))
+        else:
+            state = daemon.state()
+            if state is not None and daemon.ping(state):
+                print("Daemon %d is running on port %d (process %d)" % (daemon.slot, state['port'], state['pid']))
+            else:
+                print("Daemon %d isn't running" % daemon.slot)
@@ -0,0 +1,398 @@
+'''
+Runs several WikiToJson parser gateways at once, so that wikitext can be
+converted to JSON on as many cores as there are gateways. The parser itself
+keeps global state while converting a page, so a single gateway can only ever
+convert one page at a time.
+
+Converting several pages in one call, and telling a gateway which port to use,
+need a gateway built from the current sources in ``WikiToJson/``. The
+``WikiToJson.jar`` that ships with wikiparse was built before either existed,
+so until it's rebuilt, every call converts a single page (see below).
+
+A :py:class:`ParserPool` starts one gateway JVM per worker, each on its own
+port, and feeds them all from one queue, so whichever gateway is free takes
+the next pages. Pages are queued with :py:meth:`ParserPool.submit`, which
+returns a :py:class:`concurrent.futures.Future` for the JSON. Each worker
+takes as many queued pages as it can (up to the pool's batch size) and
+converts them in a single call to its gateway, which saves a round trip per
+page when many pages are queued at once.
+
+This module is used by :py:mod:`wikiparse.filemanager`, which keeps a pool of
+``parser_workers`` gateways, but it can also be used directly::
+
+    with ParserPool(4) as pool:
+        futures = [pool.submit(wikitext) for wikitext in wikitexts]
+        jsons = [future.result() for future in futures]
+
+Launching a JVM takes seconds, which adds up over many short-lived jobs. With
+``daemon_dir`` set, a pool instead attaches to long-lived parser daemons shared
+by every process on the host, starting them only if they aren't running yet
+(see :py:mod:`wikiparse.parserdaemon`).
+
+Gateways built from older versions of WikiToJson convert one page per call,
+and can't be told which port to listen on: they take the first free port from
+25333 on, without saying which. The pool finds the port such a gateway took
+from the ports its process is listening on, as listed in ``/proc``, and converts
+pages one at a time. Where there's no ``/proc``, the jar has to be rebuilt.
+'''
+
+import logging
+import os
+import queue
+import subprocess
+import threading
+import zipfile
+import zlib
+from concurrent.futures import Future
+from time import time
+
+from wikiparse import metrics
+
+WIKIPARSE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_JAR = os.path.join(WIKIPARSE_DIR, "WikiToJson.jar")
+
+# Separates the pages sent to and returned from a gateway in one call. Wikitext can't contain NUL characters (XML
+# disallows them), and JSON always escapes them.
+BATCH_SEPARATOR = '\x00'
+
+# Gateways that can't be told which port to use take the first free one from this one on
+DEFAULT_PORT = 25333
+# The most ports after DEFAULT_PORT that such gateways try
+LEGACY_PORT_RANGE = 1000
+
+
+def parser_version(jar=DEFAULT_JAR):
+    '''Identifies a build of the parser, so that json converted by an older build can be told apart. The version is
+    a checksum of the checksums of every file in the jar, which only changes when the parser (or a library it uses)
+    actually does, however many times the jar is rebuilt.
+
+    :param jar: The WikiToJson jar
+    :type jar: str
+    :return: The version, as 8 hex digits
+    :rtype: str
+    '''
+    version = 0
+    with zipfile.ZipFile(jar) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            if not info.filename.startswith("META-INF/"):
+                version = zlib.crc32(("%s %08x\n" % (info.filename, info.CRC)).encode('utf-8'), version)
+    return "%08x" % version
+
+
+class ParserError(Exception):
+    '''Raised when a gateway fails to convert a page.
+    '''
+    pass
+
+
+def launch_jvm(jar=DEFAULT_JAR, **kwargs):
+    '''Launches a WikiToJson gateway JVM on any free port, and waits until it is listening.
+
+    :param jar: The WikiToJson jar to run
+    :type jar: str
+    :param kwargs: Any other arguments for :py:class:`subprocess.Popen`
+    :return: The JVM's process, the port it listens on, and whether it can convert a batch of pages in one call
+    :rtype: tuple(subprocess.Popen, int, bool)
+    '''
+    process = subprocess.Popen(["java", "-jar", jar, "0"], stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+    launched = process.stdout.read()  # The gateway closes its output once it is listening
+    process.stdout.close()
+    if not launched:
+        process.wait()
+        raise ParserError("The parser gateway exited before it was launched")
+    words = launched.split()
+    if launched.startswith("Gateway launched on port") and words[-1].isdigit():
+        return process, int(words[-1]), True
+    # Built before gateways could take a port or a batch of pages
+    port = _listening_port(process.pid)
+    if port is None:
+        process.kill()
+        process.wait()
+        raise ParserError("Couldn't find the port the parser gateway was listening on; rebuild %s from the sources in "
+                          "WikiToJson/ so that it can be told which port to use" % jar)
+    return process, port, False
+
+
+def _listening_port(pid):
+    # Looks the process's listening sockets up in /proc, where there is one
+    try:
+        fd_dir = "/proc/%d/fd" % pid
+        inodes = set()
+        for fd in os.listdir(fd_dir):
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(target[len("socket:["):-1])
+        ports = []
+        for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+            if not os.path.exists(table):
+                continue
+            with open(table) as sockets:
+                next(sockets)
+                for line in sockets:
+                    # The fields are: entry, local address:port (in hex), remote address:port, state (0A is
+                    # listening), queues, timers, retransmits, uid, timeout, inode
+                    fields = line.split()
+                    if fields[3] == '0A' and fields[9] in inodes:
+                        ports.append(int(fields[1].rpartition(':')[2], 16))
+    except OSError:
+        return None
+    ports = [port for port in ports if DEFAULT_PORT <= port <= DEFAULT_PORT + LEGACY_PORT_RANGE]
+    return min(ports) if ports else None
+
+
+class ParserGateway(object):
+    '''A single WikiToJson gateway JVM, and the py4j connection to it.
+
+    :param jar: The WikiToJson jar to run
+    :type jar: str
+    '''
+
+    def __init__(self, jar=DEFAULT_JAR):
+        self.process, self.port, self.supports_batches = launch_jvm(jar)
+        self._connect()
+
+    def _connect(self):
+        from py4j.java_gateway import JavaGateway, GatewayParameters
+        self.gateway = JavaGateway(gateway_parameters=GatewayParameters(port=self.port))
+        self.tools = self.gateway.entry_point
+
+    def convert(self, wikitexts):
+        '''Converts pages of wikitext to JSON.
+
+        :param wikitexts: The wikitext of each page
+        :type wikitexts: list of str
+        :return: The JSON of each page, or None where the gateway couldn't convert it
+        :rtype: list of str
+        '''
+        if not self.supports_batches or len(wikitexts) == 1:
+            return [self.tools.convertWikitextToJson(wikitext) for wikitext in wikitexts]
+        jsons = self.tools.convertWikitextsToJson(BATCH_SEPARATOR.join(wikitexts)).split(BATCH_SEPARATOR)
+        return [json or None for json in jsons]
+
+    def close(self):
+        '''Shuts the gateway down.
+        '''
+        try:
+            self.gateway.shutdown()
+        except Exception:
+            pass
+        self.process.kill()
+        self.process.wait()
+
+
+class WorkerStats(object):
+    '''What one of a pool's workers has done so far.
+    '''
+
+    def __init__(self):
+        #: The number of pages the worker has converted
+        self.pages = 0
+        #: The number of pages the worker failed to convert
+        self.failures = 0
+        #: The number of calls the worker has made to its gateway
+        self.calls = 0
+        #: The time the worker has spent waiting on its gateway, in seconds
+        self.seconds = 0.0
+
+
+class ParserPool(object):
+    '''A pool of parser gateways converting queued pages of wikitext to JSON. Gateways are launched as they are first
+    needed, and relaunched if they crash.
+
+    :param workers: The number of gateways to run, which defaults to the number of CPUs
+    :type workers: int
+    :param batch_size: The most pages to send to a gateway in a single call
+    :type batch_size: int
+    :param jar: The WikiToJson jar to run
+    :type jar: str
+    :param daemon_dir: If given, workers attach to the shared parser daemons kept in this directory (see
+                       :py:mod:`wikiparse.parserdaemon`), starting them if need be, instead of launching gateways of
+                       their own
+    :type daemon_dir: str
+    '''
+
+    def __init__(self, workers=None, batch_size=16, jar=DEFAULT_JAR, daemon_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.jar = jar
+        self.daemon_dir = daemon_dir
+        self.pages_converted = 0
+        self.calls = 0
+        self.worker_stats = [WorkerStats() for _ in range(self.workers)]
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._gateways = []
+        self._warned = False
+        self._closed = False
+
+    def _start(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The parser pool has been closed")
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._work, args=(i,), name="parser-worker-%d" % i,
+                                              daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _new_gateway(self, slot):
+        if self.daemon_dir is None:
+            return ParserGateway(self.jar)
+        from wikiparse.parserdaemon import ParserDaemon, DaemonGateway
+        return DaemonGateway(ParserDaemon(self.daemon_dir, slot, self.jar))
+
+    def _launch(self, slot):
+        gateway = self._new_gateway(slot)
+        with self._lock:
+            self._gateways.append(gateway)
+            warn = not gateway.supports_batches and not self._warned
+            self._warned = self._warned or warn
+        if warn:
+            logging.warning("%s is out of date, so pages are converted one per call; rebuild it to convert them in "
+                            "batches" % self.jar)
+        return gateway
+
+    def _discard(self, gateway):
+        with self._lock:
+            self._gateways.remove(gateway)
+        gateway.close()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Leave the signal to stop for this worker's next turn
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _fail(self, stats, future, message):
+        with self._lock:
+            stats.failures += 1
+        metrics.count("parser.failures")
+        future.set_exception(ParserError(message))
+
+    def _convert(self, gateway, batch, stats):
+        start = time()
+        with metrics.timed("parser.call", sum(len(wikitext) for wikitext, _ in batch)):
+            jsons = gateway.convert([wikitext for wikitext, _ in batch])
+        if len(jsons) != len(batch):
+            # There's no telling which page each result belongs to, so the pages are retried one at a time
+            raise ParserError("The parser gateway returned %d results for %d pages" % (len(jsons), len(batch)))
+        metrics.count("parser.pages", len(batch))
+        with self._lock:
+            self.calls += 1
+            self.pages_converted += len(batch)
+            stats.calls += 1
+            stats.seconds += time() - start
+        for (_, future), json in zip(batch, jsons):
+            if json is None:
+                self._fail(stats, future, "The parser failed to convert the page")
+            else:
+                with self._lock:
+                    stats.pages += 1
+                future.set_result(json)
+
+    def _work(self, slot):
+        stats = self.worker_stats[slot]
+        gateway = None
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if gateway is None:
+                try:
+                    gateway = self._launch(slot)
+                except Exception as ex:
+                    for _, future in batch:
+                        if future.set_running_or_notify_cancel():
+                            self._fail(stats, future, "Couldn't launch a parser gateway: %s" % ex)
+                    continue
+            batch = [(wikitext, future) for wikitext, future in batch if future.set_running_or_notify_cancel()]
+            try:
+                self._convert(gateway, batch, stats)
+            except Exception:
+                # The parser exits on pages it can't handle, taking the rest of the batch with it, so retry those
+                # one at a time on a fresh gateway to find the culprit
+                logging.exception("A parser gateway failed, relaunching it")
+                self._discard(gateway)
+                gateway = None
+                for wikitext, future in batch:
+                    if future.done():
+                        continue
+                    try:
+                        if gateway is None:
+                            gateway = self._launch(slot)
+                        self._convert(gateway, [(wikitext, future)], stats)
+                    except Exception as ex:
+                        if not future.done():
+                            self._fail(stats, future, "The parser failed to convert the page: %s" % ex)
+                        if gateway is not None:
+                            self._discard(gateway)
+                            gateway = None
+        if gateway is not None:
+            self._discard(gateway)
+
+    def submit(self, wikitext):
+        '''Queues a page of wikitext to be converted to JSON.
+
+        :param wikitext: The page's wikitext
+        :type wikitext: str
+        :return: A future for the page's JSON, which raises :py:class:`ParserError` if the page can't be converted
+        :rtype: concurrent.futures.Future
+        '''
+        self._start()
+        future = Future()
+        self._queue.put((wikitext, future))
+        return future
+
+    def submit_many(self, wikitexts):
+        '''Queues many pages of wikitext to be converted to JSON. Pages queued together are converted in as few calls
+        to the gateways as possible.
+
+        :param wikitexts: The wikitext of each page
+        :type wikitexts: iterable of str
+        :return: A future for each page's JSON, in the same order
+        :rtype: list of concurrent.futures.Future
+        '''
+        return [self.submit(wikitext) for wikitext in wikitexts]
+
+    def convert_many(self, wikitexts):
+        '''Converts many pages of wikitext to JSON, spread over the pool's gateways.
+
+        :param wikitexts: The wikitext of each page
+        :type wikitexts: iterable of str
+        :return: The JSON of each page, in the same order
+        :rtype: list of str
+        '''
+        return [future.result() for future in self.submit_many(wikitexts)]
+
+    def close(self):
+        '''Stops every gateway, once the pages already queued have been converted.
+        '''
+        with self._lock:
+            self._closed = True
+            threads = self._threads
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,1351 @@
+'''
+Storage backends for the page cache. Every backend stores a flat mapping of
+entry names (e.g. ``Python (programming language).wtxt``) to raw bytes, and
+is used through :py:mod:`wikiparse.filemanager` rather than directly.
+
+Two backends are available:
+
+* :py:class:`ZipBackend` keeps pages in a single zip archive. This is the
+  original cache format, and the easiest to move around or inspect.
+* :py:class:`SqliteBackend` keeps pages in an SQLite database, which supports
+  in-place updates, indexed lookups and concurrent readers.
+
+Either kind can also be split into shards with :py:class:`ShardedBackend`,
+where each page lives in one of several files chosen by a hash of its title.
+Shards are locked independently, so separate processes can write to
+different shards at the same time.
+
+Use :py:func:`open_backend` to open any of these based on its file name, and
+:py:func:`copy_pages` to migrate a cache from one backend to another.
+
+Backends can be shared between threads, and keep working in child processes
+after a fork. Reads go through handles that belong to a single thread (or, for
+zip archives, a single process), which are handed out by a
+:py:class:`HandlePool`, and only writes are serialized, by a lock on the
+backend. A child process never touches the handles it inherited, which still
+belong to its parent, and instead opens its own.
+
+Pages are small and share a lot of text with each other (template names,
+infobox keys, JSON keys, ...), which compressing each page on its own can't
+take advantage of. Any backend can instead compress pages against a shared
+preset dictionary (a :py:class:`SharedDictionary`, trained from a sample of
+the cache's own pages with :py:meth:`StorageBackend.train_dictionary`). Reading
+such pages is transparent, whether or not new pages are still being compressed
+this way.
+'''
+
+import bz2
+import heapq
+import lzma
+import mmap
+import os
+import pickle
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import threading
+import weakref
+import zipfile
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from itertools import chain, islice
+from time import sleep, time
+
+from wikiparse.titleindex import TitleIndex, PrefixIndex, FuzzyIndex, AliasIndex, fold_title
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where archives can only be written by one process at a time
+    fcntl = None
+
+# http://stackoverflow.com/questions/842557/how-to-prevent-a-block-of-code-from-being-interrupted-by-keyboardinterrupt-in-py
+import signal
+import logging
+
+class DelayedKeyboardInterrupt(object):
+    def __enter__(self):
+        self.signal_received = False
+        # Signals are only delivered to (and handlers can only be set from) the main thread
+        self.active = threading.current_thread() is threading.main_thread()
+        if self.active:
+            self.old_handler = signal.getsignal(signal.SIGINT)
+            signal.signal(signal.SIGINT, self.handler)
+
+    def handler(self, signal, frame):
+        self.signal_received = (signal, frame)
+        logging.debug('SIGINT received. Delaying KeyboardInterrupt.')
+
+    def __exit__(self, type, value, traceback):
+        if self.active:
+            signal.signal(signal.SIGINT, self.old_handler)
+        if self.signal_received:
+            self.old_handler(*self.signal_received)
+
+# END SO CODE
+
+compression_levels = [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA]
+
+# How many titles may be written after a search index was built before it gets rebuilt on the next search
+INDEX_MAX_TAIL = 10000
+
+# How many bytes of an entry to copy at a time while compacting
+COPY_CHUNK_SIZE = 1 << 20
+
+# How many entries copy_pages reads before writing them all at once, which bounds how much of the cache is in memory
+COPY_BATCH_SIZE = 1000
+
+# The size of a trained dictionary. Deflate can't refer back further than 32KB, so larger ones wouldn't help.
+DICTIONARY_SIZE = 32768
+
+# The pieces of text that dictionaries are built from: lines of wikitext, template parameters, JSON values, etc.
+_DICTIONARY_SEGMENT = re.compile(rb'[^\n,{}\[\]|]{3,200}[\n,{}\[\]|]?')
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    '''Builds a preset dictionary for zlib from a sample of pages, out of the pieces of text that appear in the most
+    pages. Such pieces compress to a short back-reference into the dictionary instead of being spelled out again in
+    every page.
+
+    :param samples: The content of the sample pages
+    :type samples: iterable of bytes
+    :param size: The largest size of the dictionary, in bytes
+    :type size: int
+    :rtype: bytes
+    '''
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(_DICTIONARY_SEGMENT.findall(sample)))
+    # Pieces found in a single page don't help any other page
+    ranked = sorted(((count * len(segment), segment) for segment, count in counts.items() if count > 1), reverse=True)
+    chosen = []
+    total = 0
+    for _, segment in ranked:
+        if total + len(segment) <= size:
+            chosen.append(segment)
+            total += len(segment)
+    # Deflate encodes matches closer to the end of the dictionary more cheaply, so the most useful pieces go last
+    return b''.join(reversed(chosen))
+
+
+class SharedDictionary(object):
+    '''The preset dictionaries that a cache's pages are compressed against, kept in a file next to the cache.
+
+    Retraining adds a new dictionary instead of replacing the old one, since pages compressed against the old one
+    still need it to be read. Each compressed page starts with :py:data:`MAGIC` and the id of its dictionary, followed
+    by a raw deflate stream.
+
+    :param path: The dictionary file, which needn't exist yet
+    :type path: str
+    '''
+
+    MAGIC = b'\x00WZD'
+    _HEADER = struct.Struct('<4sI')
+
+    def __init__(self, path):
+        self.path = path
+        self._dictionaries = None
+        self._current = None
+
+    def reload(self):
+        '''Reloads the dictionaries from disk, e.g. after another process trained a new one.
+        '''
+        self._dictionaries = {}
+        self._current = None
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as dictionary_file:
+                saved = pickle.load(dictionary_file)
+            self._dictionaries = saved['dictionaries']
+            self._current = saved['current']
+
+    @property
+    def current(self):
+        '''The id of the dictionary that new pages are compressed against, or None if none has been trained.
+        '''
+        if self._dictionaries is None:
+            self.reload()
+        return self._current
+
+    def add(self, dictionary):
+        '''Saves a new dictionary and makes it the current one.
+
+        :param dictionary: The dictionary, as returned by :py:func:`train_dictionary`
+        :type dictionary: bytes
+        :return: The new dictionary's id
+        :rtype: int
+        '''
+        self.reload()
+        dictionary_id = zlib.adler32(dictionary)
+        self._dictionaries[dictionary_id] = dictionary
+        self._current = dictionary_id
+        with open(self.path + '.tmp', 'wb') as dictionary_file:
+            pickle.dump({'dictionaries': self._dictionaries, 'current': self._current}, dictionary_file,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + '.tmp', self.path)
+        return dictionary_id
+
+    def compress(self, content):
+        '''Compresses a page against the current dictionary.
+
+        :param content: The page content
+        :type content: bytes
+        :rtype: bytes
+        '''
+        dictionary_id = self.current
+        compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, -15,
+                                      zdict=self._dictionaries[dictionary_id])
+        return self._HEADER.pack(self.MAGIC, dictionary_id) + compressor.compress(content) + compressor.flush()
+
+    def decompress(self, content):
+        '''Decompresses a page compressed by :py:meth:`compress`, against whichever dictionary it was compressed with.
+
+        :param content: The compressed page
+        :type content: bytes
+        :rtype: bytes
+        '''
+        _, dictionary_id = self._HEADER.unpack_from(content)
+        if self._dictionaries is None or dictionary_id not in self._dictionaries:
+            self.reload()
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            raise ValueError("Missing compression dictionary %08x in %s" % (dictionary_id, self.path))
+        decompressor = zlib.decompressobj(-15, zdict=dictionary)
+        return decompressor.decompress(content[self._HEADER.size:]) + decompressor.flush()
+
+    @classmethod
+    def is_compressed(cls, content):
+        '''Checks whether some entry content was compressed by :py:meth:`compress`.
+
+        :param content: The entry content
+        :type content: bytes
+        :rtype: bool
+        '''
+        return content[:len(cls.MAGIC)] == cls.MAGIC
+
+
+# Every backend and handle pool, so that they can be reset in a child process after a fork
+_fork_aware = weakref.WeakSet()
+# The handles a child process inherited from its parent. These are kept forever, since letting them be garbage
+# collected would close them, which for a zip archive being written would also write its central directory.
+_inherited = []
+
+
+def _reset_after_fork():
+    for resource in list(_fork_aware):
+        resource._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class HandlePool(object):
+    '''Hands out a separate handle on some storage to each thread that uses it, or if ``per_thread`` is False, to each
+    process (for handles that are safe to share between threads). Handles are opened on first use, and a child
+    process opens its own instead of using the ones it inherited from its parent.
+
+    :param opener: Opens a new handle
+    :type opener: callable
+    :param per_thread: Whether each thread gets its own handle, rather than each process
+    :type per_thread: bool
+    '''
+
+    def __init__(self, opener, per_thread=True):
+        self._opener = opener
+        self.per_thread = per_thread
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shared = None
+        self._handles = []
+        _fork_aware.add(self)
+
+    def get(self):
+        '''Gets the current thread's handle, opening it if necessary.
+        '''
+        if self.per_thread:
+            handle = getattr(self._local, 'handle', None)
+            if handle is None:
+                handle = self._local.handle = self._opener()
+                with self._lock:
+                    self._handles.append(handle)
+            return handle
+        handle = self._shared
+        if handle is None:
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._opener()
+                    self._handles.append(self._shared)
+                handle = self._shared
+        return handle
+
+    def clear(self):
+        '''Forgets every handle, so that new ones are opened when next used, e.g. because the storage has changed in a
+        way that open handles won't see. Handles aren't closed, since other threads may still be using them; they
+        are closed once garbage collected.
+        '''
+        with self._lock:
+            self._local = threading.local()
+            self._shared = None
+            self._handles = []
+
+    def close(self, closer=lambda handle: handle.close()):
+        '''Closes every handle opened by this process.
+
+        :param closer: Closes a single handle
+        :type closer: callable
+        '''
+        with self._lock:
+            handles = self._handles
+            self._local = threading.local()
+            self._shared = None
+            self._handles = []
+        for handle in handles:
+            closer(handle)
+
+    def _after_fork(self):
+        _inherited.extend(self._handles)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shared = None
+        self._handles = []
+
+
+class LockTimeout(OSError):
+    '''Raised when another process holds a lock for longer than a :py:class:`FileLock` was willing to wait.
+    '''
+    pass
+
+
+class FileLock(object):
+    '''An exclusive, inter-process lock on a file, held between :py:meth:`acquire` and :py:meth:`release`.
+
+    :param path: The lock file, which is created if necessary
+    :type path: str
+    :param timeout: How long to wait for the lock, in seconds, before raising :py:class:`LockTimeout`, or None to wait
+                    for as long as it takes
+    :type timeout: float
+    '''
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        if self._file is None:
+            lock_file = open(self.path, 'a')
+            try:
+                if fcntl is not None:
+                    self._lock(lock_file)
+            except BaseException:
+                lock_file.close()
+                raise
+            self._file = lock_file
+
+    def _lock(self, lock_file):
+        if self.timeout is None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            return
+        deadline = time() + self.timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time() >= deadline:
+                    raise LockTimeout("%s is still locked by another process after %gs" % (self.path, self.timeout))
+                sleep(0.05)
+
+    def release(self):
+        if self._file is not None:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class StorageBackend(object):
+    '''The interface shared by all storage backends.
+
+    Besides reading and writing entries, every backend exposes a *generation*: a counter that only ever increases as
+    new entries are added (until the backend is compacted), along with the list of entry names added since any earlier
+    generation. This lets the
+    search indexes in :py:mod:`wikiparse.titleindex` cheaply catch up with entries written after they were built.
+
+    Backends also share the handling of dictionary compression: when ``use_dictionary`` is set and a dictionary has
+    been trained, new entries are compressed against it instead of with the backend's usual compression method.
+
+    Entries whose names end with one of :py:attr:`hidden_suffixes` (e.g. records kept about pages, rather than the
+    pages themselves) are left out of :py:meth:`prefix_search` and :py:meth:`fuzzy_search`.
+
+    :param path: The file in which the pages are stored
+    :type path: str
+    :param use_dictionary: Whether to compress new entries against the cache's :py:class:`SharedDictionary`
+    :type use_dictionary: bool
+    '''
+
+    def __init__(self, path, use_dictionary=False):
+        self.path = path
+        self.use_dictionary = use_dictionary
+        self.dictionary = SharedDictionary("%s.zdict" % path)
+        self._lock = threading.RLock()
+        self._prefix_index = None
+        self._fuzzy_index = None
+        self._alias_index = None
+        self.hidden_suffixes = ()
+        _fork_aware.add(self)
+
+    def _after_fork(self):
+        # Called in a child process right after a fork. Subclasses set aside the handles they inherited here.
+        self._lock = threading.RLock()
+
+    def _pack(self, content):
+        # Returns the content compressed against the dictionary, or None if it should be stored as usual
+        if self.use_dictionary and self.dictionary.current is not None:
+            return self.dictionary.compress(content)
+        return None
+
+    def _unpack(self, content):
+        if content is not None and SharedDictionary.is_compressed(content):
+            return self.dictionary.decompress(content)
+        return content
+
+    def train_dictionary(self, samples=2000, size=DICTIONARY_SIZE, source=None):
+        '''Trains a new compression dictionary from a random sample of the stored entries, which becomes the one new
+        entries are compressed against. Entries that are already stored aren't recompressed.
+
+        :param samples: How many entries to sample
+        :type samples: int
+        :param size: The largest size of the dictionary, in bytes
+        :type size: int
+        :param source: The backend to sample entries from instead, e.g. when migrating from it
+        :type source: StorageBackend
+        :return: The new dictionary's id
+        :rtype: int
+        '''
+        source = self if source is None else source
+        names = source.names()
+        names = random.sample(names, min(samples, len(names)))
+        dictionary = train_dictionary(filter(None, map(source.read, names)), size)
+        if not dictionary:
+            raise ValueError("Not enough pages in %s to train a compression dictionary" % source.path)
+        return self.dictionary.add(dictionary)
+
+    def compact(self, compression=None, progress=None):
+        '''Rewrites the backend's file to reclaim the space left behind by entries that have since been overwritten,
+        keeping only the latest copy of each entry, and optionally recompresses the entries on the way. The new file
+        replaces the old one in a single step, so the cache is never left half compacted. Writers in other processes
+        wait until compaction is done.
+
+        :param compression: The zip compression method (see :py:data:`compression_levels`) to recompress entries with,
+                            or None to leave each entry compressed as it is. Entries compressed against a dictionary
+                            are never recompressed.
+        :type compression: int
+        :param progress: Called with the name of each entry as it is kept
+        :type progress: callable
+        :return: The number of bytes reclaimed
+        :rtype: int
+        '''
+        raise NotImplementedError()
+
+    def read(self, name):
+        '''Reads the content of an entry.
+
+        :param name: The name of the entry to read
+        :type name: str
+        :return: The entry's content, or None if it doesn't exist
+        :rtype: bytes
+        '''
+        raise NotImplementedError()
+
+    def read_view(self, name):
+        '''Reads the content of an entry without copying it, where the backend allows. The result supports the buffer
+        protocol (so it can be passed to :py:func:`str`, :py:mod:`zlib`, :py:mod:`re`, etc.) but may be a
+        :py:class:`memoryview` into the backend's storage rather than a :py:class:`bytes` object, and so may only be
+        valid until the backend is written to or closed. Use :py:meth:`read` for a copy that stays valid.
+
+        :param name: The name of the entry to read
+        :type name: str
+        :return: The entry's content, or None if it doesn't exist
+        :rtype: bytes or memoryview
+        '''
+        return self.read(name)
+
+    def checksum(self, name):
+        '''Gets the CRC-32 of an entry's content, which backends may be able to find without reading the entry.
+
+        :param name: The name of the entry
+        :type name: str
+        :return: The checksum, or None if the entry doesn't exist
+        :rtype: int
+        '''
+        content = self.read_view(name)
+        return None if content is None else zlib.crc32(content)
+
+    def scan(self, names=None):
+        '''Reads many entries in a row with :py:meth:`read_view`. By default, this reads every entry in the order they
+        were added, which is about as close to the order they are stored in as possible.
+
+        :param names: The names of the entries to read, or None to read every entry
+        :type names: iterable of str
+        :return: The name and content of each entry
+        :rtype: Generator of (str, bytes or memoryview)
+        '''
+        for name in self.names() if names is None else names:
+            content = self.read_view(name)
+            if content is not None:
+                yield name, content
+
+    def write(self, name, content, overwrite=False):
+        '''Writes the content of an entry.
+
+        :param name: The name of the entry to write
+        :type name: str
+        :param content: The content to store
+        :type content: bytes
+        :param overwrite: Whether or not to replace the entry if it already exists
+        :type overwrite: bool
+        :return: Whether or not the entry was written
+        :rtype: bool
+        '''
+        raise NotImplementedError()
+
+    def write_many(self, entries, overwrite=False):
+        '''Writes the content of several entries.
+
+        :param entries: The name and content of each entry to write
+        :type entries: list of (str, bytes)
+        :param overwrite: Whether or not to replace entries that already exist
+        :type overwrite: bool
+        :return: The number of entries written
+        :rtype: int
+        '''
+        return sum(1 for name, content in entries if self.write(name, content, overwrite))
+
+    def __contains__(self, name):
+        raise NotImplementedError()
+
+    @property
+    def generation(self):
+        '''A counter that increases whenever new entries are added.
+        '''
+        raise NotImplementedError()
+
+    def names(self, since=0):
+        '''Lists the names of the stored entries, in the order they were added.
+
+        :param since: Only list entries added after this :py:attr:`generation`
+        :type since: int
+        :rtype: list of str
+        '''
+        raise NotImplementedError()
+
+    def enable_writing(self):
+        '''Prepares the backend for a series of writes. Writing works without calling this first, but some backends
+        need to reopen their storage to do so.
+        '''
+        pass
+
+    def reindex(self):
+        '''Rebuilds any index the backend keeps over its entry names.
+        '''
+        pass
+
+    def flush(self):
+        '''Makes sure every write so far has been committed to disk.
+        '''
+        pass
+
+    def close(self):
+        '''Flushes and closes the backend.
+        '''
+        if self._prefix_index is not None:
+            self._prefix_index.close()
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.close()
+        if self._alias_index is not None:
+            self._alias_index.close()
+
+    def _search_index(self, index, hidden=()):
+        generation = self.generation
+        built = index.generation
+        if not 0 <= built <= generation or generation - built > INDEX_MAX_TAIL:
+            with self._lock:
+                if index.generation == built:
+                    logging.debug("Search index %s is out of date, rebuilding it" % index.path)
+                    index.rebuild([name for name in self.names() if not name.endswith(hidden)], generation)
+            built = index.generation
+        return index, [name for name in self.names(since=built) if not name.endswith(hidden)]
+
+    def prefix_search(self, prefix, ignore_case=False, ignore_spaces=False):
+        '''Lazily finds every entry name starting with the given prefix, using a
+        :py:class:`wikiparse.titleindex.PrefixIndex` kept next to the backend's file.
+
+        :param prefix: The beginning of the names to find
+        :type prefix: str
+        :param ignore_case: Whether to match the prefix case-insensitively
+        :type ignore_case: bool
+        :param ignore_spaces: Whether to treat underscores and spaces as equal
+        :type ignore_spaces: bool
+        :rtype: Generator of str
+        '''
+        with self._lock:
+            if self._prefix_index is None:
+                self._prefix_index = PrefixIndex("%s.prefix" % self.path)
+        index, tail = self._search_index(self._prefix_index, self.hidden_suffixes)
+        return index.search(prefix, ignore_case, ignore_spaces, tail)
+
+    def fuzzy_search(self, query, max_distance):
+        '''Finds every entry name whose title is within the given edit distance of the query, using a
+        :py:class:`wikiparse.titleindex.FuzzyIndex` kept next to the backend's file.
+
+        :param query: The title to approximately match
+        :type query: str
+        :param max_distance: The largest edit distance to accept
+        :type max_distance: int
+        :returns: The distance and name of each match, ordered from closest to furthest
+        :rtype: list of (int, str)
+        '''
+        with self._lock:
+            if self._fuzzy_index is None:
+                self._fuzzy_index = FuzzyIndex("%s.fuzzy" % self.path)
+        index, tail = self._search_index(self._fuzzy_index, self.hidden_suffixes)
+        return index.search(query, max_distance, tail)
+
+    def resolve_alias(self, name):
+        '''Finds an entry stored under a name other than its canonical name (see
+        :py:func:`wikiparse.titleindex.canonical_name`), using a :py:class:`wikiparse.titleindex.AliasIndex` kept next
+        to the backend's file.
+
+        :param name: The canonical entry name
+        :type name: str
+        :return: The name the entry is stored under, or None if there's no such entry
+        :rtype: str
+        '''
+        with self._lock:
+            if self._alias_index is None:
+                self._alias_index = AliasIndex("%s.aliases" % self.path)
+            generation = self.generation
+            if self._alias_index.current != generation:
+                index, tail = self._search_index(self._alias_index)
+                index.update(tail, generation)
+        return self._alias_index.resolve(name)
+
+
+class _ZipSnapshot(object):
+    # A read-only view of a zip archive as it was when opened: its central directory and a memory map of its
+    # contents. Reading from one never moves a shared file position, so it is safe to share between threads.
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path, 'r', allowZip64=True)
+        self._map = None
+        # The offset table only holds the members read so far, since finding a member's data means reading its
+        # local header, which would mean touching the whole archive when it is opened
+        self._offsets = {}
+        self._lock = threading.Lock()
+
+    def _data_range(self, info):
+        start = self._offsets.get(info.header_offset)
+        if start is None:
+            if self._map is None:
+                with self._lock:
+                    if self._map is None:
+                        with open(self.path, 'rb') as archive_file:
+                            self._map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = self._map[info.header_offset:info.header_offset + zipfile.sizeFileHeader]
+            if header[:4] != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile("Bad local header for %s in %s" % (info.filename, self.path))
+            name_length, extra_length = struct.unpack_from('<HH', header, 26)
+            start = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+            self._offsets[info.header_offset] = start
+        return start, start + info.compress_size
+
+    def read(self, name):
+        try:
+            info = self.archive.getinfo(name)
+        except KeyError:
+            return None
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            # zipfile locks around its own seeks and reads, so this is safe too, if slower
+            return self.archive.read(info)
+        start, end = self._data_range(info)
+        content = memoryview(self._map)[start:end]
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            content = zlib.decompress(content, -15, info.file_size or zlib.DEF_BUF_SIZE)
+        return content
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Views of it are still in use, so it gets unmapped once they are garbage collected instead
+                pass
+        self.archive.close()
+
+
+class ZipBackend(StorageBackend):
+    '''Stores pages as members of a single zip archive, with a :py:class:`wikiparse.titleindex.TitleIndex` of the
+    member names kept alongside it. The archive is created if it doesn't already exist.
+
+    While writing, the backend holds an exclusive lock on a ``.lock`` file next to the archive, since a zip archive
+    can only have one writer. The lock is released by :py:meth:`flush`, which also writes out the archive's central
+    directory, after which other processes may write to the archive. Other processes wait for the lock for up to
+    ``lock_timeout`` seconds, so writes should be flushed once they're done (as
+    :py:class:`wikiparse.filemanager.Archive` does once it stops writing) rather than keeping the lock for longer than
+    that.
+
+    Pages are read from a snapshot of the archive that is memory-mapped, and members are read straight out of the
+    mapping instead of through :py:class:`zipfile.ZipFile`: stored members are returned by :py:meth:`read_view` as
+    :py:class:`memoryview` slices of the mapping without being copied, and deflated ones are inflated straight from
+    it. The mapping is shared with every other process reading the same archive through the OS page cache. Members
+    read this way don't have their CRC checked.
+
+    Since reading from a snapshot never moves a shared file position, all the threads of a process share one
+    snapshot, which is only replaced once the archive has been written to. Pages written but not yet flushed can only
+    be read through the archive being written, so reading those is serialized with writes.
+
+    :param path: The zip archive's file path
+    :type path: str
+    :param compression: The zip compression method for new members
+    :type compression: int
+    :param encoding: The text encoding used for the title index
+    :type encoding: str
+    :param use_dictionary: Whether to compress new members against the archive's :py:class:`SharedDictionary`, in
+                           which case they are stored in the zip without further compression
+    :type use_dictionary: bool
+    :param lock_timeout: How long to wait for another process to finish writing, in seconds, before raising
+                         :py:class:`LockTimeout`, or None to wait for as long as it takes
+    :type lock_timeout: float
+    '''
+
+    def __init__(self, path, compression=zipfile.ZIP_DEFLATED, encoding='UTF-8', use_dictionary=False,
+                 lock_timeout=None):
+        super(ZipBackend, self).__init__(path, use_dictionary)
+        self.compression = compression
+        self.index = TitleIndex("%s.titles" % path, encoding)
+        self.lock = FileLock("%s.lock" % path, lock_timeout)
+        self._archive = None
+        self._snapshots = HandlePool(lambda: _ZipSnapshot(self.path), per_thread=False)
+        if not os.path.exists(path):
+            # Creates skeleton archive
+            zipfile.ZipFile(path, 'w', self.compression, allowZip64=True).close()
+
+    def _after_fork(self):
+        super(ZipBackend, self)._after_fork()
+        # The parent may still be writing through these, so they must be neither used nor closed here
+        _inherited.extend([self._archive, self.lock, self.index])
+        self._archive = None
+        self.lock = FileLock(self.lock.path, self.lock.timeout)
+        self.index = TitleIndex(self.index.path, self.index.encoding)
+
+    def _close_archive(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+            # The snapshots don't include anything written since they were taken
+            self._snapshots.clear()
+
+    @property
+    def archive(self):
+        '''The underlying :py:class:`zipfile.ZipFile`: the one being written if writing is enabled, and otherwise
+        the current thread's read-only snapshot.
+        '''
+        archive = self._archive
+        if archive is None:
+            archive = self._snapshots.get().archive
+        return archive
+
+    def _titles(self):
+        entry_count = len(self.archive.filelist)
+        if not self.index.is_current(entry_count):
+            with self._lock:
+                # Another process may have written to the archive, in which case it will also have updated the
+                # index, and the snapshot needs replacing to include what it wrote
+                self.index.reload()
+                if self._archive is None:
+                    self._snapshots.clear()
+                entry_count = len(self.archive.filelist)
+                if not self.index.is_current(entry_count):
+                    logging.debug("Title index is out of date, rebuilding it from the archive")
+                    self.reindex()
+        return self.index
+
+    def reindex(self):
+        '''Rebuilds the title index from the archive's central directory.
+        '''
+        with self._lock:
+            self.index.rebuild(self.archive.namelist())
+
+    def enable_writing(self):
+        with self._lock:
+            if self._archive is None:
+                self.lock.acquire()
+                self._archive = zipfile.ZipFile(self.path, 'a', self.compression, allowZip64=True)
+
+    def read(self, name):
+        content = self.read_view(name)
+        return content.tobytes() if isinstance(content, memoryview) else content
+
+    def read_view(self, name):
+        if name not in self._titles():
+            return None
+        if self._archive is not None:
+            with self._lock:
+                if self._archive is not None:
+                    try:
+                        return self._unpack(self._archive.read(name))
+                    except KeyError:
+                        return None
+        content = self._snapshots.get().read(name)
+        if content is None:
+            # Written by another process since the snapshot was taken
+            self._snapshots.clear()
+            content = self._snapshots.get().read(name)
+        return self._unpack(content)
+
+    def checksum(self, name):
+        '''Takes the checksum from the archive's central directory, which the zip format keeps for every member,
+        unless the member is stored uncompressed (in which case it may have been compressed against a dictionary
+        instead, so its checksum isn't that of its content).
+        '''
+        if name not in self._titles():
+            return None
+        if self._archive is not None:
+            with self._lock:
+                if self._archive is not None:
+                    info = self._archive.NameToInfo.get(name)
+                    return None if info is None else \
+                        info.CRC if info.compress_type != zipfile.ZIP_STORED else super(ZipBackend, self).checksum(name)
+        info = self._snapshots.get().archive.NameToInfo.get(name)
+        if info is None:
+            # Written by another process since the snapshot was taken
+            self._snapshots.clear()
+            info = self._snapshots.get().archive.NameToInfo.get(name)
+        if info is None:
+            return None
+        return info.CRC if info.compress_type != zipfile.ZIP_STORED else super(ZipBackend, self).checksum(name)
+
+    def _write_member(self, name, content):
+        ftarget = name
+        try:
+            ftarget = self._archive.getinfo(name)
+        except KeyError:
+            pass
+        packed = self._pack(content)
+        if packed is None:
+            self._archive.writestr(ftarget, content, self.compression)
+        else:
+            self._archive.writestr(ftarget, packed, zipfile.ZIP_STORED)
+
+    def _copy_member(self, source, target, info, compression):
+        start, end = source._data_range(info)
+        data = memoryview(source._map)[start:end]
+        if compression is None or info.compress_type == compression or \
+                (info.compress_type == zipfile.ZIP_STORED and SharedDictionary.is_compressed(data)):
+            # Copies the compressed bytes as they are, with a fresh local header (dropping any data descriptor)
+            copy = zipfile.ZipInfo(info.filename, info.date_time)
+            copy.compress_type = info.compress_type
+            copy.external_attr = info.external_attr
+            copy.CRC = info.CRC
+            copy.compress_size = info.compress_size
+            copy.file_size = info.file_size
+            copy.header_offset = target.fp.tell()
+            target.fp.write(copy.FileHeader())
+            for offset in range(0, len(data), COPY_CHUNK_SIZE):
+                target.fp.write(data[offset:offset + COPY_CHUNK_SIZE])
+            target.filelist.append(copy)
+            target.NameToInfo[copy.filename] = copy
+            target.start_dir = target.fp.tell()
+        else:
+            copy = zipfile.ZipInfo(info.filename, info.date_time)
+            copy.compress_type = compression
+            copy.external_attr = info.external_attr
+            with source.archive.open(info) as member, \
+                    target.open(copy, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as copied:
+                shutil.copyfileobj(member, copied, COPY_CHUNK_SIZE)
+        data.release()
+
+    def compact(self, compression=None, progress=None):
+        '''Copies the latest copy of each member into a new archive, which then replaces the old one. Members are
+        streamed from the memory-mapped archive, so memory use doesn't grow with the size of the archive, and members
+        that don't need recompressing are copied without being decompressed at all. Since the new archive holds fewer
+        members, the :py:attr:`generation` starts again from there.
+        '''
+        with self._lock:
+            self._close_archive()
+            self.lock.acquire()
+            temporary = "%s.compacting" % self.path
+            try:
+                before = os.path.getsize(self.path)
+                source = _ZipSnapshot(self.path)
+                names = []
+                try:
+                    with zipfile.ZipFile(temporary, 'w', allowZip64=True) as target:
+                        for name in self.index.names() if self.index.is_current(len(source.archive.filelist)) \
+                                else dict.fromkeys(source.archive.namelist()):
+                            # The central directory maps each name to its latest copy
+                            self._copy_member(source, target, source.archive.getinfo(name), compression)
+                            names.append(name)
+                            if progress is not None:
+                                progress(name)
+                    with open(temporary, 'rb+') as compacted:
+                        os.fsync(compacted.fileno())
+                finally:
+                    source.close()
+                os.replace(temporary, self.path)
+                self._snapshots.clear()
+                self.index.rebuild(names)
+                self.index.close()
+                return before - os.path.getsize(self.path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+            finally:
+                self.lock.release()
+
+    def write(self, name, content, overwrite=False):
+        with self._lock:
+            self.enable_writing()
+            titles = self._titles()
+            if not overwrite and name in titles:
+                return False
+            self._write_member(name, content)
+            titles.add(name)
+            return True
+
+    def write_many(self, entries, overwrite=False):
+        with self._lock:
+            self.enable_writing()
+            titles = self._titles()
+            written = 0
+            for name, content in entries:
+                if not overwrite and name in titles:
+                    continue
+                self._write_member(name, content)
+                titles.add(name, flush=False)
+                written += 1
+            titles.flush()
+            return written
+
+    def __contains__(self, name):
+        return name in self._titles()
+
+    @property
+    def generation(self):
+        return self._titles().generation
+
+    def names(self, since=0):
+        return self._titles().names(since)
+
+    def flush(self):
+        with self._lock:
+            self._close_archive()
+            self.index.close()
+            self.lock.release()
+
+    def close(self):
+        self.flush()
+        self._snapshots.close()
+        super(ZipBackend, self).close()
+
+
+class SqliteBackend(StorageBackend):
+    '''Stores pages in an SQLite database, in a single table indexed by entry name. The database uses write-ahead
+    logging, so readers in other processes aren't blocked by a writer, and writes are grouped into transactions of
+    ``batch_size`` writes each (call :py:meth:`flush` to commit early).
+
+    Each thread reads through its own connection, so threads don't block each other, while writes all go through one
+    connection and are serialized. Pages written but not yet committed can only be read through the writing
+    connection, so while a transaction is open, reads are serialized with writes too.
+
+    :param path: The database's file path
+    :type path: str
+    :param compression: The zip compression method (see :py:data:`compression_levels`) to compress new entries with
+    :type compression: int
+    :param batch_size: The number of writes to group into each transaction
+    :type batch_size: int
+    :param use_dictionary: Whether to compress new entries against the database's :py:class:`SharedDictionary`, in
+                           which case they are stored with the ``ZIP_STORED`` method
+    :type use_dictionary: bool
+    '''
+
+    _compressors = {
+        zipfile.ZIP_STORED: (bytes, bytes),
+        zipfile.ZIP_DEFLATED: (zlib.compress, zlib.decompress),
+        zipfile.ZIP_BZIP2: (bz2.compress, bz2.decompress),
+        zipfile.ZIP_LZMA: (lzma.compress, lzma.decompress),
+    }
+
+    def __init__(self, path, compression=zipfile.ZIP_DEFLATED, batch_size=1000, use_dictionary=False):
+        super(SqliteBackend, self).__init__(path, use_dictionary)
+        self.compression = compression
+        self.batch_size = batch_size
+        self._pending = 0
+        self._db = self._connect()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pages ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "name TEXT NOT NULL UNIQUE, "
+                         "compression INTEGER NOT NULL, "
+                         "content BLOB NOT NULL)")
+        self._readers = HandlePool(self._connect)
+
+    def _connect(self):
+        # Connections may be closed from a thread other than the one using them, when the backend is closed
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _after_fork(self):
+        super(SqliteBackend, self)._after_fork()
+        # SQLite connections must not be used across a fork, so the child needs a connection of its own
+        _inherited.append(self._db)
+        self._db = self._connect()
+        self._pending = 0
+
+    @contextmanager
+    def _reading(self):
+        if self._db.in_transaction:
+            with self._lock:
+                yield self._db
+        else:
+            yield self._readers.get()
+
+    def read(self, name):
+        with self._reading() as db:
+            row = db.execute("SELECT compression, content FROM pages WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        compression, content = row
+        return self._unpack(self._compressors[compression][1](content))
+
+    def _row(self, name, content):
+        packed = self._pack(content)
+        if packed is None:
+            return name, self.compression, self._compressors[self.compression][0](content)
+        return name, zipfile.ZIP_STORED, packed
+
+    def write(self, name, content, overwrite=False):
+        row = self._row(name, content)
+        with self._lock:
+            if not self._db.in_transaction:
+                self._db.execute("BEGIN")
+            if overwrite:
+                cursor = self._db.execute("INSERT INTO pages (name, compression, content) VALUES (?, ?, ?) "
+                                          "ON CONFLICT (name) DO UPDATE SET "
+                                          "compression = excluded.compression, content = excluded.content", row)
+            else:
+                cursor = self._db.execute("INSERT OR IGNORE INTO pages (name, compression, content) VALUES (?, ?, ?)",
+                                          row)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.flush()
+            return cursor.rowcount > 0
+
+    def write_many(self, entries, overwrite=False):
+        rows = [self._row(name, content) for name, content in entries]
+        with self._lock:
+            if not self._db.in_transaction:
+                self._db.execute("BEGIN")
+            before = self._db.total_changes
+            if overwrite:
+                self._db.executemany("INSERT INTO pages (name, compression, content) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (name) DO UPDATE SET "
+                                     "compression = excluded.compression, content = excluded.content", rows)
+            else:
+                self._db.executemany("INSERT OR IGNORE INTO pages (name, compression, content) VALUES (?, ?, ?)",
+                                     rows)
+            self._pending += len(rows)
+            written = self._db.total_changes - before
+            if self._pending >= self.batch_size:
+                self.flush()
+            return written
+
+    def compact(self, compression=None, progress=None):
+        '''Recompresses every entry that isn't already compressed with ``compression`` (a batch of rows at a time),
+        then vacuums the database to return the space freed by overwritten and recompressed entries to the file
+        system. Rows are updated in place, so the :py:attr:`generation` is unchanged.
+        '''
+        with self._lock:
+            self.flush()
+            before = self._size()
+            if compression is not None:
+                last = 0
+                while True:
+                    rows = self._db.execute("SELECT id, name, compression, content FROM pages WHERE id > ? "
+                                            "ORDER BY id LIMIT ?", (last, self.batch_size)).fetchall()
+                    if not rows:
+                        break
+                    updates = []
+                    for row_id, name, row_compression, content in rows:
+                        last = row_id
+                        if row_compression != compression and not \
+                                (row_compression == zipfile.ZIP_STORED and SharedDictionary.is_compressed(content)):
+                            content = self._compressors[row_compression][1](content)
+                            updates.append((compression, self._compressors[compression][0](content), row_id))
+                        if progress is not None:
+                            progress(name)
+                    with DelayedKeyboardInterrupt():
+                        self._db.execute("BEGIN")
+                        self._db.executemany("UPDATE pages SET compression = ?, content = ? WHERE id = ?", updates)
+                        self._db.execute("COMMIT")
+            elif progress is not None:
+                for name in self.names():
+                    progress(name)
+            self._db.execute("VACUUM")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return before - self._size()
+
+    def _size(self):
+        # Recent writes may still be in the write-ahead log rather than the database itself
+        wal = "%s-wal" % self.path
+        return os.path.getsize(self.path) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+    def __contains__(self, name):
+        with self._reading() as db:
+            return db.execute("SELECT 1 FROM pages WHERE name = ?", (name,)).fetchone() is not None
+
+    @property
+    def generation(self):
+        with self._reading() as db:
+            row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'pages'").fetchone()
+        return 0 if row is None else row[0]
+
+    def names(self, since=0):
+        with self._reading() as db:
+            return [name for name, in db.execute("SELECT name FROM pages WHERE id > ? ORDER BY id", (since,))]
+
+    def flush(self):
+        with self._lock:
+            if self._db.in_transaction:
+                self._db.execute("COMMIT")
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._readers.close()
+        self._db.close()
+        super(SqliteBackend, self).close()
+
+
+class ShardedBackend(StorageBackend):
+    '''Splits pages across several backends, choosing the shard for each page from a stable hash of its title. All
+    the entries for one page (its wikitext, JSON, etc.) therefore live in the same shard. Shards are only opened once
+    they are used, and each one is locked and flushed independently, so separate processes can write to different
+    shards concurrently.
+
+    The shard for a page must never change, so the number of shards can't be changed after pages have been written.
+    To change it, create a new sharded cache and use :py:func:`copy_pages` to fill it.
+
+    Since each shard counts its own generation, the :py:attr:`generation` of a sharded backend is a tuple of the
+    shards' generations, and :py:meth:`names` accepts such a tuple.
+
+    :param path: The base file path, from which each shard's path is derived (see :py:func:`shard_path`)
+    :type path: str
+    :param shards: The number of shards
+    :type shards: int
+    :param opener: Opens the backend for a single shard, given its path
+    :type opener: callable
+    '''
+
+    def __init__(self, path, shards, opener):
+        super(ShardedBackend, self).__init__(path)
+        self.shard_count = shards
+        self._opener = opener
+        self._shards = [None] * shards
+
+    @staticmethod
+    def shard_of(name, shards):
+        '''Picks the shard index for an entry name.
+
+        :param name: The entry name, such as ``Python.wtxt``
+        :type name: str
+        :param shards: The number of shards
+        :type shards: int
+        :rtype: int
+        '''
+        return zlib.crc32(name.rpartition('.')[0].encode('utf-8')) % shards
+
+    def shard(self, i):
+        '''Gets the backend for a single shard, opening it if necessary.
+
+        :param i: The shard index
+        :type i: int
+        :rtype: StorageBackend
+        '''
+        if self._shards[i] is None:
+            with self._lock:
+                if self._shards[i] is None:
+                    self._shards[i] = self._opener(shard_path(self.path, i, self.shard_count))
+        return self._shards[i]
+
+    def _open_shards(self):
+        return [self.shard(i) for i in range(self.shard_count)]
+
+    def _route(self, name):
+        return self.shard(self.shard_of(name, self.shard_count))
+
+    def read(self, name):
+        return self._route(name).read(name)
+
+    def read_view(self, name):
+        return self._route(name).read_view(name)
+
+    def checksum(self, name):
+        return self._route(name).checksum(name)
+
+    def write(self, name, content, overwrite=False):
+        return self._route(name).write(name, content, overwrite)
+
+    def write_many(self, entries, overwrite=False):
+        by_shard = {}
+        for name, content in entries:
+            by_shard.setdefault(self.shard_of(name, self.shard_count), []).append((name, content))
+        return sum(self.shard(i).write_many(shard_entries, overwrite) for i, shard_entries in by_shard.items())
+
+    def train_dictionary(self, samples=2000, size=DICTIONARY_SIZE, source=None):
+        '''Trains a separate dictionary for each shard, from a sample of that shard's entries (or of ``source``'s).
+
+        :return: The new dictionary's id in each shard
+        :rtype: list of int
+        '''
+        return [shard.train_dictionary(samples, size, source) for shard in self._open_shards()]
+
+    def compact(self, compression=None, progress=None):
+        '''Compacts each shard in turn.
+        '''
+        return sum(shard.compact(compression, progress) for shard in self._open_shards())
+
+    def __contains__(self, name):
+        return name in self._route(name)
+
+    @property
+    def generation(self):
+        return tuple(shard.generation for shard in self._open_shards())
+
+    def names(self, since=None):
+        since = since or (0,) * self.shard_count
+        return list(chain.from_iterable(shard.names(since[i]) for i, shard in enumerate(self._open_shards())))
+
+    def reindex(self):
+        for shard in self._open_shards():
+            shard.reindex()
+
+    def flush(self):
+        for shard in self._shards:
+            if shard is not None:
+                shard.flush()
+
+    def close(self):
+        for shard in self._shards:
+            if shard is not None:
+                shard.close()
+        super(ShardedBackend, self).close()
+
+    def prefix_search(self, prefix, ignore_case=False, ignore_spaces=False):
+        return heapq.merge(*[shard.prefix_search(prefix, ignore_case, ignore_spaces) for shard in self._open_shards()],
+                           key=fold_title)
+
+    def fuzzy_search(self, query, max_distance):
+        return list(heapq.merge(*[shard.fuzzy_search(query, max_distance) for shard in self._open_shards()]))
+
+    def resolve_alias(self, name):
+        # An entry's shard depends on the name it was stored under, which could be any of them
+        for shard in self._open_shards():
+            alias = shard.resolve_alias(name)
+            if alias is not None:
+                return alias
+        return None
+
+
+def shard_path(path, i, shards):
+    '''Derives the file path of one shard of a sharded cache. Shard indexes are zero-padded to the width of the
+    largest one, e.g. shard 3 of ``wikipedia.zip`` split into 16 shards is ``wikipedia.03.zip``.
+
+    :param path: The base file path of the sharded cache
+    :type path: str
+    :param i: The shard index
+    :type i: int
+    :param shards: The number of shards
+    :type shards: int
+    :rtype: str
+    '''
+    root, ext = os.path.splitext(path)
+    return "%s.%0*d%s" % (root, len(str(shards - 1)), i, ext)
+
+
+def open_backend(path, compression=zipfile.ZIP_DEFLATED, encoding='UTF-8', batch_size=1000, shards=1,
+                 use_dictionary=False, lock_timeout=None):
+    '''Opens the storage backend matching a file's extension: ``.sqlite``, ``.sqlite3`` and ``.db`` files are opened
+    with :py:class:`SqliteBackend`, and anything else with :py:class:`ZipBackend`. If more than one shard is
+    requested, these are wrapped in a :py:class:`ShardedBackend`.
+
+    :param path: The file in which the pages are stored
+    :type path: str
+    :param compression: The zip compression method for new entries
+    :type compression: int
+    :param encoding: The text encoding used for the zip backend's title index
+    :type encoding: str
+    :param batch_size: The number of writes per transaction for the SQLite backend
+    :type batch_size: int
+    :param shards: The number of shards the cache is split into
+    :type shards: int
+    :param use_dictionary: Whether to compress new entries against the cache's trained dictionary, if it has one
+    :type use_dictionary: bool
+    :param lock_timeout: How long the zip backend waits for another process to finish writing, in seconds, or None to
+                         wait for as long as it takes
+    :type lock_timeout: float
+    :rtype: StorageBackend
+    '''
+    if shards > 1:
+        return ShardedBackend(path, shards, lambda shard: open_backend(shard, compression, encoding, batch_size,
+                                                                       use_dictionary=use_dictionary,
+                                                                       lock_timeout=lock_timeout))
+    if os.path.splitext(path)[1].lower() in ('.sqlite', '.sqlite3', '.db'):
+        return SqliteBackend(path, compression, batch_size, use_dictionary)
+    return ZipBackend(path, compression, encoding, use_dictionary, lock_timeout)
+
+
+def copy_pages(source, target, overwrite=False, progress=None, batch_size=COPY_BATCH_SIZE):
+    '''Copies every entry from one storage backend into another. Entries are read in batches, each of which is
+    written with a single :py:meth:`StorageBackend.write_many` call.
+
+    :param source: The backend to copy from
+    :type source: StorageBackend
+    :param target: The backend to copy into
+    :type target: StorageBackend
+    :param overwrite: Whether or not to replace entries that already exist in the target
+    :type overwrite: bool
+    :param progress: Called with the name of each entry once it has been copied
+    :type progress: callable
+    :param batch_size: The number of entries to write at once
+    :type batch_size: int
+    :return: The number of entries written
+    :rtype: int
+    '''
+    written = 0
+    target.enable_writing()
+    names = iter(source.names())
+    while True:
+        batch_names = list(islice(names, batch_size))
+        if not batch_names:
+            break
+        batch = [(name, content) for name, content in zip(batch_names, map(source.read, batch_names))
+                 if content is not None]
+        with DelayedKeyboardInterrupt():
+            written += target.write_many(batch, overwrite)
+        if progress is not None:
+            for name, _ in batch:
+                progress(name)
+    target.flush()
+    return written
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+from wikiparse import fetcher, filemanager
+
+
+class Server(object):
+    '''A keep-alive HTTP server in a background thread, answering each request with ``respond(params)``, which returns
+    the status, any extra headers and the body.'''
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.connections = 0
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        async def serve():
+            self._server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+            self.url = "http://127.0.0.1:%d/w/api.php" % self._server.sockets[0].getsockname()[1]
+            started.set()
+
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop)
+        started.wait(5)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                params = dict(urllib.parse.parse_qsl(body.decode('ascii')))
+                self.requests.append(params)
+                result = self.respond(params)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                status, extra, content = result
+                writer.write(("HTTP/1.1 %d Status\r\nContent-Length: %d\r\n%s\r\n"
+                              % (status, len(content), "".join("%s: %s\r\n" % item for item in extra.items()))
+                              ).encode('latin-1') + content)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._server.close)
+
+
+WIKI = {"Apple": "An apple is a fruit.", "Banana": "A banana is a fruit too.", "Cherry": "Cherries are red."}
+
+
+def query(params, pages_per_response=2):
+    '''Answers like the MediaWiki query API, splitting page contents over several responses.'''
+    titles = params['titles'].split('|')
+    normalized = [{'from': title, 'to': title.capitalize()} for title in titles if title.capitalize() != title]
+    pages = [{'title': title, 'revisions': [{'slots': {'main': {'content': WIKI[title]}}}]} if title in WIKI
+             else {'title': title, 'missing': True} for title in (title.capitalize() for title in titles)]
+    skip = int(params.get('rvcontinue', 0))
+    with_content = [page for page in pages if 'revisions' in page]
+    for page in with_content[:skip] + with_content[skip + pages_per_response:]:
+        del page['revisions']
+    response = {'query': {'normalized': normalized, 'pages': pages}}
+    if skip + pages_per_response < len(with_content):
+        response['continue'] = {'rvcontinue': str(skip + pages_per_response), 'continue': '||'}
+    return 200, {}, json.dumps(response).encode('utf-8')
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(respond=query):
+        servers.append(Server(respond))
+        return servers[-1]
+    yield start
+    for running in servers:
+        running.close()
+
+
+def test_fetch_follows_normalization_and_continuation(server):
+    wiki = server()
+    pages = asyncio.run(fetcher.Fetcher(wiki.url, concurrency=2, batch_size=5).fetch(
+        ["apple", "Banana", "cherry", "Durian"]))
+
+    assert pages == {"apple": WIKI["Apple"], "Banana": WIKI["Banana"], "cherry": WIKI["Cherry"], "Durian": None}
+    assert len(wiki.requests) == 2
+    assert wiki.connections == 1
+
+
+def test_fetch_retries_when_told_to_wait(server):
+    def throttled(params):
+        if len(wiki.requests) == 1:
+            return 429, {"Retry-After": "0"}, b"slow down"
+        return query(params)
+    wiki = server(throttled)
+
+    assert asyncio.run(fetcher.Fetcher(wiki.url).fetch(["Apple"])) == {"Apple": WIKI["Apple"]}
+    assert len(wiki.requests) == 2
+
+
+def test_fetch_gives_up_on_a_stalled_server(server):
+    async def stalled(params):
+        await asyncio.sleep(5)
+        return query(params)
+    wiki = server(stalled)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetcher.Fetcher(wiki.url, timeout=0.2).fetch(["Apple"]))
+
+
+def test_fetch_pages_caches_pages_and_remembers_missing_ones(server, tmp_path):
+    wiki = server()
+    archive = filemanager.Archive(str(tmp_path / "cache.zip"), try_pulls=False)
+    previous = filemanager.use_archive(archive)
+    try:
+        assert fetcher.fetch_pages(["apple", "Banana", "Durian"], api_url=wiki.url) == 2
+        assert archive.read_wikitext("Apple") == WIKI["Apple"]
+        assert archive.is_known_missing("Durian")
+
+        requests = len(wiki.requests)
+        assert fetcher.fetch_pages(["Apple", "durian"], api_url=wiki.url) == 0
+        assert len(wiki.requests) == requests
+    finally:
+        filemanager.use_archive(previous)
+        archive.close()
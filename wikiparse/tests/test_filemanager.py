@@ -0,0 +1,104 @@
+import pytest
+
+from wikiparse import filemanager
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = filemanager.Archive(str(tmp_path / "cache.zip"), try_pulls=False, check_json_sources=True)
+    yield archive
+    archive.close()
+
+
+def test_missing_pages_are_remembered_apart_from_the_pages(archive):
+    archive.write_wikitext("Nope real", "text")
+    for _ in range(3):
+        archive.mark_missing("Nope")
+        archive.forget_missing("nope")
+    archive.mark_missing("Nope")
+
+    assert archive.is_known_missing("nope")
+    assert list(archive.missing_titles()) == ["Nope"]
+    assert sorted(archive.possible_titles("No")) == ["Nope real.wtxt"]
+    assert sorted(archive.backend.names()) == ["Nope real.wtxt"]
+
+
+def test_records_about_pages_are_not_found_by_title(archive):
+    archive.write_wikitext("Page", "text")
+    archive.write_json("Page", '{}', wikitext="text")
+
+    assert sorted(archive.possible_titles("Pa")) == ["Page.json", "Page.wtxt"]
+    assert sorted(title for title in archive.possible_titles("Pag", 1)) == ["Page.json", "Page.wtxt"]
+    assert sorted(archive.possible_titles()) == ["Page.json", "Page.wtxt"]
+
+
+def test_skipped_json_write_keeps_its_source(archive):
+    archive.write_wikitext("Page", "old text")
+    archive.write_json("Page", '{"v": 1}', wikitext="old text")
+
+    archive.write_json("Page", '{"v": 2}', overwrite=False, wikitext="new text")
+    assert archive.read_json("Page") == '{"v": 1}'
+    assert not archive.is_json_stale("Page")
+
+
+def test_skipped_batch_json_write_keeps_its_source(archive):
+    archive.write_wikitext("Page", "old text")
+    archive.write_json("Page", '{"v": 1}', wikitext="old text")
+
+    with archive.batch_writer() as writer:
+        writer.write_json("Page", '{"v": 2}', wikitext="new text")
+    assert archive.read_json("Page") == '{"v": 1}'
+    assert not archive.is_json_stale("Page")
+
+
+def test_cached_json_is_not_checked_again(archive, monkeypatch):
+    archive.write_wikitext("Page", "text")
+    archive.write_json("Page", '{"v": 1}', wikitext="text")
+    assert archive.read_json("Page") == '{"v": 1}'
+
+    def unexpected(title):
+        raise AssertionError("checked the source of %s again" % title)
+    monkeypatch.setattr(archive, 'is_json_stale', unexpected)
+    for _ in range(3):
+        assert archive.read_json("Page") == '{"v": 1}'
+
+
+def test_new_wikitext_makes_cached_json_stale(archive, monkeypatch):
+    archive.write_wikitext("Page", "old text")
+    archive.write_json("Page", '{"v": 1}', wikitext="old text")
+    assert archive.read_json("Page") == '{"v": 1}'
+
+    archive.write_wikitext("Page", "new text", overwrite=True)
+    monkeypatch.setattr(archive, '_parse_wikitext_to_json', lambda wikitext: '{"v": 2}')
+    assert archive.read_json("Page") == '{"v": 2}'
+    assert not archive.is_json_stale("Page")
+
+
+def test_read_tree_decodes_the_cached_json(archive):
+    archive.write_json("Page", '{"root": {"id": 1, "type": "context", "children": []}}')
+
+    assert archive.read_tree("Page") == {"root": {"id": 1, "type": "context", "children": []}}
+    assert archive.read_tree("Absent") is None
+
+
+def test_batch_writer_refuses_pages_it_cannot_encode(archive):
+    with archive.batch_writer() as writer:
+        writer.write_wikitext("Good", "text")
+        with pytest.raises(TypeError, match="Bad.wtxt"):
+            writer.write_wikitext("Bad", 42)
+        writer.write_wikitext("Also good", "more text")
+
+    assert archive.read_wikitext("Good") == "text"
+    assert archive.read_wikitext("Also good") == "more text"
+    assert not archive.is_cached("Bad")
+
+
+def test_pages_are_found_by_any_way_of_writing_their_title(archive):
+    archive.write_wikitext("python_(programming language)", "text")
+    # Written under a title that isn't canonical, the way older versions of wikiparse did
+    archive.backend.write("monty_python.wtxt", b"legacy text")
+
+    assert archive.backend.names() == ["Python (programming language).wtxt", "monty_python.wtxt"]
+    assert archive.read_wikitext("Python_(programming_language)") == "text"
+    assert archive.read_wikitext("Monty python") == "legacy text"
+    assert archive.is_cached("monty python")
@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import time
+import zipfile
+
+import pytest
+
+from wikiparse import filemanager, storage
+
+_archive = None
+
+
+def _write_page(i):
+    # Run in a forked worker, on the archive it inherited
+    _archive.write_wikitext("Child %d" % i, "text %d" % i)
+    return _archive.read_wikitext("Child %d" % i)
+
+
+def _hold_lock(path, ready, release):
+    archive = filemanager.Archive(path, try_pulls=False)
+    archive.enable_writing()
+    archive.write_wikitext("Held", "held text")
+    ready.set()
+    release.wait(10)
+    archive.close()
+
+
+def test_forked_workers_share_the_write_lock(tmp_path):
+    global _archive
+    path = str(tmp_path / "cache.zip")
+    _archive = filemanager.Archive(path, try_pulls=False, write_lock_timeout=5)
+    try:
+        _archive.write_wikitext("Parent", "parent text")
+        with multiprocessing.get_context('fork').Pool(2) as pool:
+            assert pool.map(_write_page, range(6)) == ["text %d" % i for i in range(6)]
+            # Workers commit what they wrote as they exit
+            pool.close()
+            pool.join()
+    finally:
+        _archive.close()
+        _archive = None
+
+    archive = filemanager.Archive(path, try_pulls=False)
+    try:
+        assert archive.read_wikitext("Parent") == "parent text"
+        assert all(archive.read_wikitext("Child %d" % i) == "text %d" % i for i in range(6))
+    finally:
+        archive.close()
+
+
+def test_write_times_out_while_another_process_writes(tmp_path):
+    path = str(tmp_path / "cache.zip")
+    context = multiprocessing.get_context('fork')
+    ready, release = context.Event(), context.Event()
+    holder = context.Process(target=_hold_lock, args=(path, ready, release))
+    holder.start()
+    archive = filemanager.Archive(path, try_pulls=False, write_lock_timeout=0.2)
+    try:
+        assert ready.wait(10)
+        start = time.time()
+        with pytest.raises(storage.LockTimeout):
+            archive.write_wikitext("Mine", "my text")
+        assert time.time() - start < 5
+
+        release.set()
+        holder.join(10)
+        archive.write_wikitext("Mine", "my text")
+        assert archive.read_wikitext("Mine") == "my text"
+        assert archive.read_wikitext("Held") == "held text"
+    finally:
+        release.set()
+        holder.join(10)
+        archive.close()
+
+
+def test_single_writes_are_committed_once_idle(tmp_path):
+    path = str(tmp_path / "cache.zip")
+    writer = filemanager.Archive(path, try_pulls=False, write_idle_timeout=0.5)
+    other = filemanager.Archive(path, try_pulls=False, write_lock_timeout=0.1)
+    try:
+        writer.write_wikitext("First", "first text")
+        writer.write_wikitext("Second", "second text")
+        # The writer still holds the lock right after writing, and lets go once it has stopped writing for a while
+        with pytest.raises(storage.LockTimeout):
+            other.write_wikitext("Other", "other text")
+        time.sleep(1)
+        other.write_wikitext("Other", "other text")
+        assert other.read_wikitext("First") == "first text"
+        assert other.read_wikitext("Second") == "second text"
+    finally:
+        writer.close()
+        other.close()
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    backend = storage.SqliteBackend(str(tmp_path / "cache.sqlite"), batch_size=2)
+    yield backend
+    backend.close()
+
+
+def test_sqlite_backend_writes_and_overwrites_entries(sqlite_backend):
+    assert sqlite_backend.write("A.wtxt", b"first")
+    assert not sqlite_backend.write("A.wtxt", b"second")
+    assert sqlite_backend.read("A.wtxt") == b"first"
+    assert sqlite_backend.write("A.wtxt", b"second", overwrite=True)
+    assert sqlite_backend.write_many([("B.wtxt", b"b"), ("A.wtxt", b"third"), ("C.wtxt", b"c")]) == 2
+
+    assert sqlite_backend.read("A.wtxt") == b"second"
+    assert sqlite_backend.names() == ["A.wtxt", "B.wtxt", "C.wtxt"]
+    assert "C.wtxt" in sqlite_backend and "D.wtxt" not in sqlite_backend
+    assert sqlite_backend.read("D.wtxt") is None
+
+
+def test_sqlite_backend_commits_in_batches(sqlite_backend):
+    other = storage.SqliteBackend(sqlite_backend.path)
+    try:
+        sqlite_backend.write("A.wtxt", b"a")
+        assert sqlite_backend.read("A.wtxt") == b"a"
+        assert other.read("A.wtxt") is None
+        sqlite_backend.write("B.wtxt", b"b")
+        assert other.read("A.wtxt") == b"a"
+        sqlite_backend.write("C.wtxt", b"c")
+        sqlite_backend.flush()
+        assert other.names() == ["A.wtxt", "B.wtxt", "C.wtxt"]
+    finally:
+        other.close()
+
+
+def test_sqlite_backend_recompresses_entries(sqlite_backend):
+    sqlite_backend.write_many([("Page %d.wtxt" % i, b"text " * 200) for i in range(5)])
+    sqlite_backend.compact(zipfile.ZIP_LZMA)
+
+    assert [sqlite_backend.read("Page %d.wtxt" % i) for i in range(5)] == [b"text " * 200] * 5
+
+
+def test_copy_pages_copies_between_backends_in_batches(tmp_path, sqlite_backend):
+    source = storage.ZipBackend(str(tmp_path / "cache.zip"))
+    try:
+        source.write_many([("Page %d.wtxt" % i, b"text %d" % i) for i in range(7)])
+        source.flush()
+        sqlite_backend.write("Page 3.wtxt", b"kept")
+        copied = []
+
+        assert storage.copy_pages(source, sqlite_backend, progress=copied.append, batch_size=3) == 6
+        assert copied == source.names()
+        assert sqlite_backend.read("Page 3.wtxt") == b"kept"
+        assert sqlite_backend.read("Page 6.wtxt") == b"text 6"
+        assert storage.copy_pages(source, sqlite_backend, overwrite=True, batch_size=3) == 7
+        assert sqlite_backend.read("Page 3.wtxt") == b"text 3"
+    finally:
+        source.close()
+
+
+def test_sharded_backend_keeps_each_page_in_one_shard(tmp_path):
+    path = str(tmp_path / "wikipedia.zip")
+    backend = storage.open_backend(path, shards=16)
+    try:
+        entries = [("Page %d.%s" % (i, page_type), b"%d" % i) for i in range(40) for page_type in ("wtxt", "json")]
+        assert backend.write_many(entries) == 80
+        backend.write("Page 0.jsrc", b"source")
+        backend.flush()
+
+        for name, content in entries:
+            assert backend.read(name) == content
+            assert name in backend.shard(storage.ShardedBackend.shard_of(name, 16)).names()
+        assert storage.ShardedBackend.shard_of("Page 0.jsrc", 16) == storage.ShardedBackend.shard_of("Page 0.wtxt", 16)
+        assert sorted(backend.names()) == sorted([name for name, _ in entries] + ["Page 0.jsrc"])
+        assert list(backend.prefix_search("Page 3.")) == ["Page 3.json", "Page 3.wtxt"]
+    finally:
+        backend.close()
+    assert os.path.exists(storage.shard_path(path, 3, 16))
+    assert storage.shard_path(path, 3, 16).endswith("wikipedia.03.zip")
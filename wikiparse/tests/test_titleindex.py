@@ -0,0 +1,92 @@
+from wikiparse import titleindex
+
+NAMES = ["Python.wtxt", "Python (programming language).wtxt", "Python (programming language).json",
+         "Pythonidae.wtxt", "Monty Python.wtxt", "PyPy.wtxt", "python_lore.wtxt"]
+
+
+def test_prefix_search_finds_names_in_each_mode(tmp_path):
+    index = titleindex.PrefixIndex(str(tmp_path / "cache.zip.prefix"))
+    index.rebuild(NAMES, 7)
+
+    assert index.generation == 7
+    assert sorted(index.search("Python (")) == ["Python (programming language).json",
+                                                "Python (programming language).wtxt"]
+    assert sorted(index.search("Pyth")) == ["Python (programming language).json", "Python (programming language).wtxt",
+                                            "Python.wtxt", "Pythonidae.wtxt"]
+    assert sorted(index.search("python", ignore_case=True)) == sorted(
+        name for name in NAMES if name.lower().startswith("python"))
+    assert list(index.search("Python l", ignore_case=True, ignore_spaces=True)) == ["python_lore.wtxt"]
+    assert list(index.search("Nothing")) == []
+    index.close()
+
+
+def test_prefix_search_includes_names_written_since_it_was_built(tmp_path):
+    index = titleindex.PrefixIndex(str(tmp_path / "cache.zip.prefix"))
+    index.rebuild(NAMES, 7)
+
+    assert list(index.search("PyP", tail=["PyPI.wtxt", "PyPy.wtxt", "Ruby.wtxt"])) == ["PyPy.wtxt", "PyPI.wtxt"]
+    index.close()
+
+
+def test_prefix_search_survives_the_index_being_rebuilt_mid_search(tmp_path):
+    index = titleindex.PrefixIndex(str(tmp_path / "cache.zip.prefix"))
+    index.rebuild(NAMES, 7)
+
+    search = index.search("Py")
+    first = next(search)
+    index.rebuild(NAMES + ["Pyramid.wtxt"], 8)
+    assert [first] + list(search) == sorted([name for name in NAMES if name.startswith("Py")],
+                                            key=titleindex.fold_title)
+    assert "Pyramid.wtxt" in index.search("Pyr")
+    index.close()
+
+
+def test_fuzzy_search_finds_titles_within_the_edit_distance(tmp_path):
+    index = titleindex.FuzzyIndex(str(tmp_path / "cache.zip.fuzzy"))
+    index.rebuild(NAMES, 7)
+
+    assert index.search("pyhton", 2) == [(2, "Python.wtxt")]
+    assert index.search("PYPY", 0) == [(0, "PyPy.wtxt")]
+    assert index.search("Python (programing language)", 1) == [(1, "Python (programming language).json"),
+                                                               (1, "Python (programming language).wtxt")]
+    assert index.search("Haskell", 2) == []
+
+
+def test_fuzzy_search_matches_short_queries_by_length(tmp_path):
+    # Short queries have too few trigrams to rule titles out with, so only their length is filtered on
+    index = titleindex.FuzzyIndex(str(tmp_path / "cache.zip.fuzzy"))
+    index.rebuild(["Go.wtxt", "C.wtxt", "Rust.wtxt"], 3)
+
+    assert index.search("Ga", 1) == [(1, "Go.wtxt")]
+    assert index.search("D", 1) == [(1, "C.wtxt")]
+
+
+def test_fuzzy_search_checks_names_written_since_it_was_built(tmp_path):
+    index = titleindex.FuzzyIndex(str(tmp_path / "cache.zip.fuzzy"))
+    index.rebuild(NAMES, 7)
+
+    assert index.search("pythn", 1, tail=["Pythn.json", "Ruby.wtxt"]) == [(0, "Pythn.json"), (1, "Python.wtxt")]
+    index.close()
+    assert titleindex.FuzzyIndex(index.path).generation == 7
+
+
+def test_canonical_titles_are_written_the_way_mediawiki_writes_them():
+    assert titleindex.canonical_title("python_(programming  language) ") == "Python (programming language)"
+    assert titleindex.canonical_title("category:_living people") == "Category:Living people"
+    assert titleindex.canonical_title("notanamespace:thing") == "Notanamespace:thing"
+    assert titleindex.canonical_title("ßig") == "ßig"
+    assert titleindex.canonical_title("Café") == "Café"
+    assert titleindex.canonical_name("monty_python.wtxt") == "Monty python.wtxt"
+
+
+def test_alias_index_finds_pages_stored_under_other_titles(tmp_path):
+    index = titleindex.AliasIndex(str(tmp_path / "cache.zip.aliases"))
+    index.rebuild(NAMES, 7)
+
+    assert index.resolve("Python lore.wtxt") == "python_lore.wtxt"
+    assert index.resolve("Python.wtxt") is None
+    index.update(["monty_python.json"], 8)
+    assert index.current == 8
+    assert index.resolve("Monty python.json") == "monty_python.json"
+    index.close()
+    assert titleindex.AliasIndex(index.path).resolve("Python lore.wtxt") == "python_lore.wtxt"
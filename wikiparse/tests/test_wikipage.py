@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from wikiparse import filemanager, metrics, wikipage
+
+
+def page_tree(text):
+    return {"root": {"id": 1, "type": "context", "label": "", "children": [
+                {"id": 2, "type": "context", "label": "", "children": [
+                    {"id": 3, "type": "text", "text": text, "properties": []}]}]},
+            "refs": {"id": 4, "type": "context", "label": "", "children": []},
+            "internal_links": [], "external_links": [], "sections": []}
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = filemanager.Archive(str(tmp_path / "cache.zip"), try_pulls=False)
+    yield archive
+    archive.close()
+
+
+def test_building_a_page_is_timed(archive):
+    archive.write_json("Page", json.dumps(page_tree("Hello")))
+    metrics.reset()
+    metrics.enable()
+    try:
+        page = wikipage.WikiPage("Page", archive=archive)
+        stages = metrics.snapshot()['stages']
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+    assert str(page.content) == "Hello"
+    assert stages['page.build']['count'] == 1
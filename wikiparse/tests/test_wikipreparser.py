@@ -0,0 +1,58 @@
+from concurrent.futures import Future
+
+import pytest
+
+from wikiparse import filemanager, wikipreparser
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = filemanager.Archive(str(tmp_path / "cache.zip"), try_pulls=False)
+    previous = filemanager.use_archive(archive)
+    yield archive
+    filemanager.use_archive(previous)
+    archive.close()
+
+
+class UpperPool(object):
+    '''Stands in for a parser pool, "parsing" each page into its upper-cased wikitext.'''
+
+    def submit_many(self, wikitexts):
+        futures = []
+        for wikitext in wikitexts:
+            future = Future()
+            if "broken" in wikitext:
+                future.set_exception(ValueError(wikitext))
+            else:
+                future.set_result('"%s"' % wikitext.upper())
+            futures.append(future)
+        return futures
+
+
+def test_pending_titles_skip_parsed_and_failed_pages(archive, tmp_path):
+    for title in ("Apple", "Broken", "Cached", "Zebra"):
+        archive.write_wikitext(title, "text of %s" % title)
+    archive.write_json("Cached", '{}', wikitext="text of Cached")
+    checkpoint = str(tmp_path / "cache.zip.preparse")
+    wikipreparser.save_checkpoint(checkpoint, {"Broken"})
+
+    failed = wikipreparser.load_checkpoint(checkpoint)
+    assert failed == {"Broken"}
+    assert wikipreparser.pending_titles(failed) == ["Apple", "Zebra"]
+    assert wikipreparser.pending_titles(failed, retry_failed=True) == ["Apple", "Broken", "Zebra"]
+
+
+def test_preparse_caches_json_and_records_failures(archive, tmp_path):
+    titles = ["Page %d" % i for i in range(25)] + ["Spoiled"]
+    for title in titles:
+        archive.write_wikitext(title, "broken text" if title == "Spoiled" else "text of %s" % title)
+    archive.flush()
+    checkpoint = str(tmp_path / "cache.zip.preparse")
+
+    failed = wikipreparser.preparse(UpperPool(), wikipreparser.pending_titles(), batch_size=10,
+                                    checkpoint=checkpoint, commit_interval=0)
+
+    assert failed == ["Spoiled"]
+    assert wikipreparser.load_checkpoint(checkpoint) == {"Spoiled"}
+    assert archive.read_json("Page 7") == '"TEXT OF PAGE 7"'
+    assert wikipreparser.pending_titles(wikipreparser.load_checkpoint(checkpoint)) == []
@@ -0,0 +1,112 @@
+import bz2
+import io
+
+from wikiparse import wikisplitter
+
+
+def dump(pages):
+    '''Builds an xml dump of the given pages, each a (title, ns, id, redirect target or None, text) tuple.'''
+    xml = ['<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">',
+           '<siteinfo><sitename>Wikipedia</sitename></siteinfo>']
+    for title, ns, page_id, redirect, text in pages:
+        xml.append('<page><title>%s</title><ns>%d</ns><id>%d</id>' % (title, ns, page_id))
+        if redirect is not None:
+            xml.append('<redirect title="%s" />' % redirect)
+        xml.append('<revision><id>%d</id><text bytes="%d" xml:space="preserve">%s</text></revision></page>'
+                   % (page_id + 1000, len(text.encode('utf-8')), text))
+    xml.append('</mediawiki>')
+    return "".join(xml).encode('utf-8')
+
+
+PAGES = [("Apple", 0, 1, None, "An apple is a fruit."),
+         ("Talk:Apple", 1, 2, None, "Is it, though?"),
+         ("Apples", 0, 3, "Apple", "#REDIRECT [[Apple]]"),
+         ("Banana", 0, 4, None, "A banana is a longer fruit, with more words about it.")]
+
+
+def test_dump_pages_are_read_in_order():
+    assert list(wikisplitter.iter_dump_pages(io.BytesIO(dump(PAGES)))) == PAGES
+
+
+def test_dump_pages_can_be_read_as_text():
+    stream = io.TextIOWrapper(io.BytesIO(dump(PAGES)), encoding='utf-8')
+    assert list(wikisplitter.iter_dump_pages(stream)) == PAGES
+
+
+def filtered_titles(**options):
+    page_filter = wikisplitter.PageFilter(**options)
+    return [title for title, _, _, _, _ in wikisplitter.iter_dump_pages(io.BytesIO(dump(PAGES)), page_filter)]
+
+
+def test_filters_leave_out_pages_that_do_not_match():
+    assert filtered_titles() == ["Apple", "Talk:Apple", "Apples", "Banana"]
+    assert filtered_titles(namespaces=[0]) == ["Apple", "Apples", "Banana"]
+    assert filtered_titles(title_pattern="^App") == ["Apple", "Apples"]
+    assert filtered_titles(titles=["apple", "banana"]) == ["Apple", "Banana"]
+    assert filtered_titles(min_id=2, max_id=3) == ["Talk:Apple", "Apples"]
+    assert filtered_titles(min_length=20) == ["Apple", "Banana"]
+    assert filtered_titles(max_length=19) == ["Talk:Apple", "Apples"]
+    assert filtered_titles(namespaces=[0], no_redirects=True) == ["Apple", "Banana"]
+
+
+def test_length_is_taken_from_the_size_the_dump_gives():
+    # A dump that claims a size is believed, which is what saves encoding every page's text to measure it
+    xml = dump([("Small", 0, 1, None, "tiny")]).replace(b'bytes="4"', b'bytes="5000"')
+    page_filter = wikisplitter.PageFilter(min_length=1000)
+    assert [page[0] for page in wikisplitter.iter_dump_pages(io.BytesIO(xml), page_filter)] == ["Small"]
+
+
+def test_filters_tell_which_id_ranges_and_indexes_matter():
+    page_filter = wikisplitter.PageFilter(min_id=100, max_id=200)
+    assert page_filter.checks_index
+    assert not page_filter.wants_ids(1, 99)
+    assert page_filter.wants_ids(150, 400)
+    assert not wikisplitter.PageFilter(namespaces=[0], min_length=10).checks_index
+
+
+def multistream_dump(tmp_path, pages, per_stream=2):
+    '''Writes a multistream dump of the given pages, with its bz2 index, the way Wikipedia publishes them.'''
+    header, footer = dump([]).split(b'</siteinfo>')
+    streams = [bz2.compress(header + b'</siteinfo>')]
+    index = []
+    offset = len(streams[0])
+    for start in range(0, len(pages), per_stream):
+        stream_pages = pages[start:start + per_stream]
+        # Each stream holds just the pages, without the dump's enclosing element
+        xml = dump(stream_pages).split(b'</siteinfo>')[1][:-len(b'</mediawiki>')]
+        index.extend("%d:%d:%s\n" % (offset, page_id, title) for title, _, page_id, _, _ in stream_pages)
+        streams.append(bz2.compress(xml))
+        offset += len(streams[-1])
+    streams.append(bz2.compress(footer))
+    dump_path, index_path = str(tmp_path / "multistream.xml.bz2"), str(tmp_path / "multistream-index.txt.bz2")
+    with open(dump_path, 'wb') as dump_file:
+        dump_file.write(b''.join(streams))
+    with bz2.open(index_path, 'wt', encoding='utf-8') as index_file:
+        index_file.write("".join(index))
+    return dump_path, index_path
+
+
+MANY_PAGES = [("Page %d" % i, 0, i, None, "Text of page %d" % i) for i in range(1, 12)]
+
+
+def test_multistream_pages_come_out_in_dump_order(tmp_path):
+    dump_path, index_path = multistream_dump(tmp_path, MANY_PAGES)
+
+    pages = list(wikisplitter.find_multistream_pages(dump_path, index_path, workers=2))
+    assert pages == [(title, text) for title, _, _, _, text in MANY_PAGES]
+
+
+def test_multistream_streams_without_wanted_pages_are_not_read(tmp_path):
+    dump_path, index_path = multistream_dump(tmp_path, MANY_PAGES)
+    page_filter = wikisplitter.PageFilter(min_id=4, max_id=6)
+
+    blocks, num_pages = wikisplitter.read_multistream_index(index_path, page_filter)
+    assert len(blocks) == 2 and num_pages == 3
+    assert [title for title, _ in wikisplitter.find_multistream_pages(dump_path, index_path, 2, page_filter)] == \
+        ["Page 4", "Page 5", "Page 6"]
+    # The last stream is read to the end of the dump, past the stream that closes it
+    last_block = wikisplitter.read_multistream_index(index_path)[0][-1]
+    assert last_block[1] is None
+    assert wikisplitter.read_multistream_index(index_path, wikisplitter.PageFilter(titles=["page 11"])) == \
+        ([last_block], 1)
+    assert list(wikisplitter.split_stream_block(dump_path, *last_block)) == [("Page 11", "Text of page 11")]
@@ -0,0 +1,597 @@
+'''
+Keeps on-disk indexes of the entry names stored in the page archive, so that
+membership tests and title searches don't need to scan the archive itself.
+This module is used internally by :py:mod:`wikiparse.filemanager` and
+:py:mod:`wikiparse.storage`.
+
+The primary index, :py:class:`TitleIndex`, is a plain append-only text file
+living next to the archive, with one entry name per line in the order the
+entries were written. Because a zip archive gains one member for every write
+(even when overwriting), the number of lines in the index always matches the
+number of members in the archive. That count is used to detect an index that
+has fallen out of sync (e.g. after a crash, or if the archive was modified by
+another tool), in which case it can be rebuilt from the archive's central
+directory.
+
+The search indexes, :py:class:`PrefixIndex` and :py:class:`FuzzyIndex`, are
+built from the title index and support prefix and edit distance searches.
+
+Pages are stored under their canonical titles (see :py:func:`canonical_title`),
+so that every way of writing a title finds the same page. Pages stored under
+other titles, e.g. by older versions of wikiparse, are found through the
+:py:class:`AliasIndex`.
+'''
+
+import array
+import collections
+import functools
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+import unicodedata
+
+
+class TitleIndex(object):
+    '''A lazily loaded, persistent set of archive entry names.
+
+    :param path: The file in which the index is stored
+    :type path: str
+    :param encoding: The text encoding of the index file
+    :type encoding: str
+    '''
+
+    def __init__(self, path, encoding='UTF-8'):
+        self.path = path
+        self.encoding = encoding
+        self._names = None
+        self._known = None
+        self._log = None
+
+    def _load(self):
+        if self._names is None:
+            names = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding=self.encoding, newline='\n') as index_file:
+                    names = index_file.read().split('\n')
+                names.pop()  # Every line is newline-terminated, so the last split is always empty
+            self._names = names
+            self._known = set(names)
+
+    def reload(self):
+        '''Discards the in-memory copy of the index, so that it is reloaded from disk when next used. This picks up
+        entries recorded by other processes writing to the same archive.
+        '''
+        self._close_log()
+        self._names = None
+        self._known = None
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    @property
+    def generation(self):
+        '''The number of writes recorded by this index, including repeated writes of the same entry.
+        '''
+        self._load()
+        return len(self._names)
+
+    def is_current(self, entry_count):
+        '''Checks whether this index agrees with an archive containing the given number of members.
+
+        :param entry_count: The number of members in the archive, including duplicates
+        :type entry_count: int
+        :rtype: bool
+        '''
+        return self.generation == entry_count
+
+    def rebuild(self, names):
+        '''Replaces the contents of this index with the given entry names.
+
+        :param names: Every entry name in the archive, in archive order
+        :type names: Iterable of str
+        '''
+        self._close_log()
+        names = list(names)
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'w', encoding=self.encoding, newline='\n') as index_file:
+            for name in names:
+                index_file.write(name)
+                index_file.write('\n')
+        os.replace(tmp_path, self.path)
+        self._names = names
+        self._known = set(names)
+
+    def add(self, name, flush=True):
+        '''Records that an entry has been written to the archive.
+
+        :param name: The entry name that was written
+        :type name: str
+        :param flush: Whether to write the change to disk immediately, rather than at the next :py:meth:`flush`
+        :type flush: bool
+        '''
+        self._load()
+        if self._log is None:
+            self._log = open(self.path, 'a', encoding=self.encoding, newline='\n')
+        self._log.write(name)
+        self._log.write('\n')
+        if flush:
+            self._log.flush()
+        self._names.append(name)
+        self._known.add(name)
+
+    def flush(self):
+        '''Writes any recorded entries to disk.
+        '''
+        if self._log is not None:
+            self._log.flush()
+
+    def names(self, since=0):
+        '''Lists the distinct entry names in the order they were first written.
+
+        :param since: Only list names written after this many writes (see :py:attr:`generation`). Such a tail may
+                      repeat names that were also written before it.
+        :type since: int
+        :rtype: list of str
+        '''
+        self._load()
+        names = self._names[since:]
+        if since == 0 and len(self._known) == len(self._names):
+            return names
+        seen = set()
+        return [name for name in names if not (name in seen or seen.add(name))]
+
+    def close(self):
+        '''Closes the index file, if it is open for appending.
+        '''
+        self._close_log()
+
+    def __contains__(self, name):
+        self._load()
+        return name in self._known
+
+    def __len__(self):
+        self._load()
+        return len(self._known)
+
+    def __iter__(self):
+        return iter(self.names())
+
+
+def fold_title(title, ignore_case=True, ignore_spaces=True):
+    '''Normalizes a title (or title prefix) for comparison in the looser prefix-search modes.
+
+    :param title: The title to normalize
+    :type title: str
+    :param ignore_case: Whether to lower-case the title
+    :type ignore_case: bool
+    :param ignore_spaces: Whether to treat underscores as spaces
+    :type ignore_spaces: bool
+    :rtype: str
+    '''
+    if ignore_case:
+        title = title.lower()
+    if ignore_spaces:
+        title = title.replace('_', ' ')
+    return title
+
+
+# The namespaces of a default MediaWiki installation, whose names are written like this in canonical titles
+NAMESPACES = {name.lower(): name for name in [
+    "Talk", "User", "User talk", "Wikipedia", "Wikipedia talk", "File", "File talk", "Image", "Image talk",
+    "MediaWiki", "MediaWiki talk", "Template", "Template talk", "Help", "Help talk", "Category", "Category talk",
+    "Portal", "Portal talk", "Draft", "Draft talk", "Module", "Module talk", "Special", "Media",
+]}
+
+# Runs of whitespace and underscores, which MediaWiki reads as a single space
+_SPACES = re.compile(r'[\s_\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+')
+# Direction marks, which MediaWiki strips from titles
+_DIRECTION_MARKS = re.compile('[\u200e\u200f\u202a-\u202e]')
+
+
+def _upper_first(text):
+    first = text[:1].upper()
+    # Some letters have no single-letter capital (e.g. 'ß' becomes 'SS'), and MediaWiki leaves those alone
+    return first + text[1:] if len(first) == 1 else text
+
+
+@functools.lru_cache(maxsize=65536)
+def canonical_title(title):
+    '''Writes a title the way MediaWiki does, so that the different ways of writing a page's title (e.g.
+    ``python_(programming language)`` and ``Python (programming language)``) all come out the same: in Unicode NFC form,
+    without direction marks, with runs of spaces and underscores as single spaces and no leading or trailing spaces,
+    and with the first letter (and that of the standard namespace, if there is one) in upper case.
+
+    :param title: The title to normalize
+    :type title: str
+    :rtype: str
+    '''
+    if not unicodedata.is_normalized('NFC', title):
+        title = unicodedata.normalize('NFC', title)
+    title = _SPACES.sub(' ', _DIRECTION_MARKS.sub('', title)).strip(' ')
+    namespace, colon, rest = title.partition(':')
+    if colon:
+        canonical_namespace = NAMESPACES.get(namespace.rstrip(' ').lower())
+        if canonical_namespace is not None:
+            return "%s:%s" % (canonical_namespace, _upper_first(rest.lstrip(' ')))
+    return _upper_first(title)
+
+
+def canonical_name(name):
+    '''Puts the title in an archive entry name (a title and an extension, e.g. ``python.wtxt``) in canonical form (see
+    :py:func:`canonical_title`).
+
+    :param name: The entry name
+    :type name: str
+    :rtype: str
+    '''
+    title, dot, ext = name.rpartition('.')
+    return "%s.%s" % (canonical_title(title), ext) if dot else canonical_title(name)
+
+
+class PrefixIndex(object):
+    '''A sorted, memory-mapped table of archive entry names that answers prefix queries by binary search.
+
+    The table is sorted on each name's fully folded form (see :py:func:`fold_title`), so exact, case-insensitive and
+    space/underscore-insensitive searches can all be answered from the same table: every match in any mode shares the
+    folded prefix, and the stricter modes just filter the candidates in that range.
+
+    The table is a snapshot of the archive's entry names at a given storage generation (see
+    :py:attr:`wikiparse.storage.StorageBackend.generation`). Names written since then are searched linearly, so the
+    table only needs rebuilding once that tail grows large.
+
+    The file layout is a header (magic, generation, record count), followed by a little-endian 64-bit offset for every
+    record, followed by the records themselves, each being ``folded name \\t name \\n`` in UTF-8.
+
+    :param path: The file in which the table is stored
+    :type path: str
+    '''
+
+    _MAGIC = b'WPX1'
+    _HEADER = struct.Struct('<4sQQ')
+    _OFFSET = struct.Struct('<Q')
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._generation = -1
+        self._count = 0
+
+    def _load(self):
+        if self._map is None and self._generation < 0 and os.path.exists(self.path):
+            with open(self.path, 'rb') as table_file:
+                table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, generation, count = self._HEADER.unpack_from(table, 0)
+            if magic != self._MAGIC:
+                table.close()
+                return
+            self._map = table
+            self._generation = generation
+            self._count = count
+
+    @property
+    def generation(self):
+        '''The storage generation this table was built from, or -1 if it hasn't been built.
+        '''
+        self._load()
+        return self._generation
+
+    def close(self):
+        '''Unmaps the table file. Searches that are still under way keep the table they started with, which is
+        unmapped once they're done instead.
+        '''
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A suspended search still holds a view of it, and it gets unmapped once that view is released
+                pass
+            self._map = None
+        self._generation = -1
+        self._count = 0
+
+    def rebuild(self, names, generation):
+        '''Rebuilds the sorted table.
+
+        :param names: The distinct entry names to include
+        :type names: Iterable of str
+        :param generation: The storage generation that ``names`` reflects
+        :type generation: int
+        '''
+        records = sorted((fold_title(name).encode('utf-8'), name.encode('utf-8')) for name in names)
+        offsets = array.array('Q')
+        position = self._HEADER.size + self._OFFSET.size * len(records)
+        for key, name in records:
+            offsets.append(position)
+            position += len(key) + len(name) + 2
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+
+        self.close()
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'wb') as table_file:
+            table_file.write(self._HEADER.pack(self._MAGIC, generation, len(records)))
+            table_file.write(offsets.tobytes())
+            for key, name in records:
+                table_file.write(b'%s\t%s\n' % (key, name))
+        os.replace(tmp_path, self.path)
+
+    def _record(self, table, i):
+        start = self._OFFSET.unpack_from(table, self._HEADER.size + self._OFFSET.size * i)[0]
+        end = table.find(b'\n', start)
+        key, _, name = table[start:end].partition(b'\t')
+        return key, name
+
+    def _lower_bound(self, table, count, key):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(table, mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __contains__(self, name):
+        self._load()
+        if self._map is None:
+            return False
+        key, name = fold_title(name).encode('utf-8'), name.encode('utf-8')
+        for i in range(self._lower_bound(self._map, self._count, key), self._count):
+            record_key, record_name = self._record(self._map, i)
+            if record_key != key:
+                return False
+            if record_name == name:
+                return True
+        return False
+
+    def search(self, prefix, ignore_case=False, ignore_spaces=False, tail=()):
+        '''Lazily finds every name starting with the given prefix.
+
+        :param prefix: The beginning of the names to find
+        :type prefix: str
+        :param ignore_case: Whether to match the prefix case-insensitively
+        :type ignore_case: bool
+        :param ignore_spaces: Whether to treat underscores and spaces in the prefix and names as equal
+        :type ignore_spaces: bool
+        :param tail: Names written since this table was built, which are searched linearly
+        :type tail: Iterable of str
+        :returns: The matching names, those in the table first (in folded order), followed by those from the tail
+        :rtype: Generator of str
+        '''
+        self._load()
+        target = fold_title(prefix, ignore_case, ignore_spaces)
+        table, count = self._map, self._count
+        if table is not None:
+            # The view keeps the table mapped while this is suspended, even if the index is closed or rebuilt meanwhile
+            with memoryview(table):
+                key = fold_title(prefix).encode('utf-8')
+                for i in range(self._lower_bound(table, count, key), count):
+                    record_key, record_name = self._record(table, i)
+                    if not record_key.startswith(key):
+                        break
+                    name = record_name.decode('utf-8')
+                    if fold_title(name, ignore_case, ignore_spaces).startswith(target):
+                        yield name
+        for name in tail:
+            if fold_title(name, ignore_case, ignore_spaces).startswith(target) and name not in self:
+                yield name
+
+
+def _trigrams(text):
+    padded = "  %s  " % text
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class FuzzyIndex(object):
+    '''A trigram inverted index over archive titles for approximate (edit distance) title searches.
+
+    Titles are compared without their entry extension and in lower case, and every title is indexed under each of
+    the distinct trigrams of its space-padded form. Since a single edit can remove at most three distinct trigrams
+    from a string, any title within ``k`` edits of a query must share at least ``len(trigrams(query)) - 3k`` of the
+    query's trigrams and must be within ``k`` characters of its length. Only the titles passing both filters have
+    their actual edit distance computed.
+
+    Like :py:class:`PrefixIndex`, the index is a snapshot of the archive's entry names at some storage generation,
+    with any names written since then checked directly.
+
+    :param path: The file in which the index is stored
+    :type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+
+    @staticmethod
+    def _base(name):
+        return name.rpartition('.')[0].lower()
+
+    def _load(self):
+        if self._index is None and os.path.exists(self.path):
+            with open(self.path, 'rb') as index_file:
+                self._index = pickle.load(index_file)
+
+    @property
+    def generation(self):
+        '''The storage generation this index was built from, or -1 if it hasn't been built.
+        '''
+        self._load()
+        return -1 if self._index is None else self._index['generation']
+
+    def close(self):
+        '''Releases the in-memory copy of the index.
+        '''
+        self._index = None
+
+    def rebuild(self, names, generation):
+        '''Rebuilds the index.
+
+        :param names: The distinct entry names to include
+        :type names: Iterable of str
+        :param generation: The storage generation that ``names`` reflects
+        :type generation: int
+        '''
+        groups = {}
+        for name in names:
+            groups.setdefault(self._base(name), []).append(name)
+        bases = sorted(groups)
+        postings = {}
+        lengths = {}
+        for i, base in enumerate(bases):
+            for gram in _trigrams(base):
+                postings.setdefault(gram, array.array('I')).append(i)
+            lengths.setdefault(len(base), array.array('I')).append(i)
+        index = {
+            'generation': generation,
+            'bases': bases,
+            'names': [groups[base] for base in bases],
+            'postings': postings,
+            'lengths': lengths,
+        }
+
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'wb') as index_file:
+            pickle.dump(index, index_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._index = index
+
+    def _candidates(self, query, max_distance):
+        index = self._index
+        grams = _trigrams(query)
+        required = len(grams) - 3 * max_distance
+        near_lengths = range(max(0, len(query) - max_distance), len(query) + max_distance + 1)
+        if required <= 0:
+            # The trigram filter can't rule anything out, so fall back to the length filter alone
+            for length in near_lengths:
+                yield from index['lengths'].get(length, ())
+        else:
+            counts = collections.Counter()
+            for gram in grams:
+                counts.update(index['postings'].get(gram, ()))
+            bases = index['bases']
+            for i, count in counts.items():
+                if count >= required and len(bases[i]) in near_lengths:
+                    yield i
+
+    def search(self, query, max_distance, tail=()):
+        '''Finds every name whose title is within the given edit distance of the query, ignoring case.
+
+        :param query: The title to approximately match
+        :type query: str
+        :param max_distance: The largest edit distance to accept
+        :type max_distance: int
+        :param tail: Names written since this index was built, which are checked directly
+        :type tail: Iterable of str
+        :returns: The distance and name of each match, ordered from closest to furthest
+        :rtype: list of (int, str)
+        '''
+        from editdistance import eval as distance
+        self._load()
+        query = query.lower()
+        matches = []
+        tail = list(tail)
+        if self._index is not None:
+            tail_names = set(tail)
+            bases, names = self._index['bases'], self._index['names']
+            for i in self._candidates(query, max_distance):
+                dist = distance(bases[i], query)
+                if dist <= max_distance:
+                    matches.extend((dist, name) for name in names[i] if name not in tail_names)
+        for name in tail:
+            dist = distance(self._base(name), query)
+            if dist <= max_distance:
+                matches.append((dist, name))
+        matches.sort()
+        return matches
+
+
+class AliasIndex(object):
+    '''Finds the entries stored under a title other than their canonical title (see :py:func:`canonical_name`), e.g. by
+    older versions of wikiparse, from their canonical names. Only those entries are indexed, so the index is empty for
+    archives written entirely under canonical titles.
+
+    Like :py:class:`FuzzyIndex`, the index is a snapshot of the archive's entry names at some storage generation, but
+    names written since then are added to the in-memory copy of the index as they're found, so each lookup is a single
+    dictionary lookup.
+
+    :param path: The file in which the index is stored
+    :type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        #: The storage generation the in-memory copy of the index reflects, including names added since it was built
+        self.current = None
+
+    def _load(self):
+        if self._index is None and os.path.exists(self.path):
+            with open(self.path, 'rb') as index_file:
+                self._index = pickle.load(index_file)
+
+    @property
+    def generation(self):
+        '''The storage generation this index was built from, or -1 if it hasn't been built.
+        '''
+        self._load()
+        return -1 if self._index is None else self._index['generation']
+
+    def close(self):
+        '''Releases the in-memory copy of the index.
+        '''
+        self._index = None
+        self.current = None
+
+    @staticmethod
+    def _aliases(names):
+        aliases = {}
+        for name in names:
+            canonical = canonical_name(name)
+            if canonical != name:
+                aliases[canonical] = name
+        return aliases
+
+    def rebuild(self, names, generation):
+        '''Rebuilds the index.
+
+        :param names: The distinct entry names to include
+        :type names: Iterable of str
+        :param generation: The storage generation that ``names`` reflects
+        :type generation: int
+        '''
+        index = {'generation': generation, 'aliases': self._aliases(names)}
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'wb') as index_file:
+            pickle.dump(index, index_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._index = index
+        self.current = generation
+
+    def update(self, tail, generation):
+        '''Adds the names written since the index was built to its in-memory copy.
+
+        :param tail: Names written since this index was built
+        :type tail: Iterable of str
+        :param generation: The storage generation that the index and ``tail`` reflect together
+        :type generation: int
+        '''
+        self._load()
+        if self._index is not None:
+            self._index['aliases'].update(self._aliases(tail))
+            self.current = generation
+
+    def resolve(self, name):
+        '''Finds the entry stored for a canonical entry name under another name.
+
+        :param name: The canonical entry name
+        :type name: str
+        :return: The name the entry is stored under, or None if there's no such entry
+        :rtype: str
+        '''
+        self._load()
+        return None if self._index is None else self._index['aliases'].get(name)
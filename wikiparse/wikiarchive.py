@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+'''
+A runnable script for maintaining the page cache used by the filemanager
+module. Each maintenance task is its own subcommand.
+
+The ``migrate`` subcommand copies every page from one cache file into another,
+converting between storage backends on the way. The backend of each file is
+chosen from its extension: ``.sqlite``, ``.sqlite3`` and ``.db`` files are
+SQLite databases, and anything else is a zip archive. For example, to move the
+default zip cache into an SQLite database::
+
+    python3 wikiarchive.py migrate ~/wikipedia.zip ~/wikipedia.sqlite
+
+Afterwards, set ``storage_backend`` to ``sqlite`` in ``config.json`` (and
+``cache_sqlite`` to the new file) to start using it. Migrating is also how to
+split a cache into shards (or change its number of shards), using the
+``source_shards`` (``s``) and ``target_shards`` (``t``) options::
+
+    python3 wikiarchive.py migrate -s 1 -t 16 ~/wikipedia.zip ~/sharded/wikipedia.zip
+
+The ``train`` subcommand trains a compression dictionary from a sample of a
+cache's pages. Once ``compression_dictionary`` is enabled in ``config.json``,
+new pages are compressed against it. Pages that are already cached keep their
+old compression, so to compress a whole cache against a dictionary, migrate it
+with the ``dictionary`` (``d``) option instead, which trains one for the target
+from a sample of the source::
+
+    python3 wikiarchive.py migrate -d ~/wikipedia.zip ~/wikipedia-small.zip
+
+Overwriting a page in a zip archive (e.g. with ``wikisplitter.py -u``) adds a
+new copy of it without removing the old one, so archives that are updated keep
+growing. The ``compact`` subcommand rewrites a cache keeping only the latest
+copy of each page, and swaps the result in once it's complete. Given a
+``compression_level`` (``c``), it also recompresses every page at that level
+(set the same level in ``config.json`` for pages cached afterwards)::
+
+    python3 wikiarchive.py compact -c 2 ~/wikipedia.zip
+
+::
+
+    usage: wikiarchive.py [-h] {migrate,train,compact} ...
+
+    Maintain the wikiparse page cache
+
+    positional arguments:
+      {migrate,train,compact}
+        migrate             Copy every page from one cache file into another
+        train               Train a compression dictionary for a cache
+        compact             Reclaim the space taken by overwritten pages
+
+    optional arguments:
+      -h, --help  show this help message and exit
+
+    usage: wikiarchive.py migrate [-h] [-u] [-v] [-d] [-s SOURCE_SHARDS]
+                                  [-t TARGET_SHARDS]
+                                  source target
+
+    positional arguments:
+      source                The cache file to copy pages from
+      target                The cache file to copy pages into
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -u, --update          Overwrites pages that already exist in the target
+      -v, --verbose         Prints page titles as they get copied
+      -d, --dictionary      Compresses the copied pages against a dictionary
+                            trained from a sample of the source
+      -s SOURCE_SHARDS, --source_shards SOURCE_SHARDS
+                            The number of shards the source is split into
+                            (defaults to the configured number)
+      -t TARGET_SHARDS, --target_shards TARGET_SHARDS
+                            The number of shards to split the target into
+                            (defaults to the configured number)
+
+    usage: wikiarchive.py train [-h] [-n SAMPLES] [-s SHARDS] cache
+
+    positional arguments:
+      cache                 The cache file to train a dictionary for
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -n SAMPLES, --samples SAMPLES
+                            The number of pages to train from
+      -s SHARDS, --shards SHARDS
+                            The number of shards the cache is split into
+                            (defaults to the configured number)
+
+    usage: wikiarchive.py compact [-h] [-v] [-c COMPRESSION_LEVEL] [-s SHARDS]
+                                  cache
+
+    positional arguments:
+      cache                 The cache file to compact
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -v, --verbose         Prints page titles as they get copied
+      -c COMPRESSION_LEVEL, --compression_level COMPRESSION_LEVEL
+                            Recompresses every page at this level (0 to 3, as
+                            in config.json)
+      -s SHARDS, --shards SHARDS
+                            The number of shards the cache is split into
+                            (defaults to the configured number)
+'''
+
+import argparse
+import json
+import os
+import sys
+
+from wikiparse import storage
+
+WIKIPARSE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_config():
+    with open(os.path.join(WIKIPARSE_DIR, "config.json")) as config_file:
+        return json.load(config_file)
+
+
+def open_cache(path, config, shards=None, use_dictionary=None):
+    '''Opens a cache file with the backend matching its extension, using the settings from ``config.json``.
+
+    :param path: The cache file to open
+    :type path: str
+    :param config: The parsed ``config.json``
+    :type config: dict
+    :param shards: The number of shards the cache is split into, or None to use the configured number
+    :type shards: int
+    :param use_dictionary: Whether to compress new pages against the cache's dictionary, or None to use the
+                           configured setting
+    :type use_dictionary: bool
+    :rtype: wikiparse.storage.StorageBackend
+    '''
+    return storage.open_backend(os.path.abspath(os.path.expanduser(path)),
+                                storage.compression_levels[config['compression_level']],
+                                config['encoding'], config['sqlite_batch_size'],
+                                config['shards'] if shards is None else shards,
+                                config['compression_dictionary'] if use_dictionary is None else use_dictionary,
+                                config['write_lock_timeout'])
+
+
+def migrate(args, config):
+    source = open_cache(args.source, config, args.source_shards)
+    target = open_cache(args.target, config, args.target_shards, args.dictionary or None)
+    if args.dictionary:
+        target.train_dictionary(source=source)
+    count = 0
+
+    def progress(name):
+        nonlocal count
+        count += 1
+        if args.verbose:
+            sys.stdout.write("%d - % -79s\r" % (count, name[:79]))
+            sys.stdout.flush()
+
+    try:
+        written = storage.copy_pages(source, target, overwrite=args.update, progress=progress)
+    finally:
+        target.close()
+        source.close()
+    print("Copied %d of %d pages" % (written, count))
+
+
+def train(args, config):
+    cache = open_cache(args.cache, config, args.shards)
+    try:
+        count = min(args.samples, len(cache.names()))
+        cache.train_dictionary(args.samples)
+    finally:
+        cache.close()
+    print("Trained a compression dictionary from %d pages" % count)
+
+
+def compact(args, config):
+    cache = open_cache(args.cache, config, args.shards)
+    compression = None if args.compression_level is None else storage.compression_levels[args.compression_level]
+    count = 0
+
+    def progress(name):
+        nonlocal count
+        count += 1
+        if args.verbose:
+            sys.stdout.write("%d - % -79s\r" % (count, name[:79]))
+            sys.stdout.flush()
+
+    try:
+        reclaimed = cache.compact(compression, progress)
+    finally:
+        cache.close()
+    print("Kept %d pages, reclaiming %d bytes" % (count, reclaimed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the wikiparse page cache')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    migrate_parser = subparsers.add_parser('migrate', help="Copy every page from one cache file into another")
+    migrate_parser.add_argument('-u', '--update', help="Overwrites pages that already exist in the target", action="store_true", default=False)
+    migrate_parser.add_argument('-v', '--verbose', help="Prints page titles as they get copied", action="store_true", default=False)
+    migrate_parser.add_argument('-d', '--dictionary', help="Compresses the copied pages against a dictionary trained from a sample of the source", action="store_true", default=False)
+    migrate_parser.add_argument('-s', '--source_shards', help="The number of shards the source is split into (defaults to the configured number)", type=int, default=None)
+    migrate_parser.add_argument('-t', '--target_shards', help="The number of shards to split the target into (defaults to the configured number)", type=int, default=None)
+    migrate_parser.add_argument('source', help="The cache file to copy pages from")
+    migrate_parser.add_argument('target', help="The cache file to copy pages into")
+    migrate_parser.set_defaults(run=migrate)
+
+    train_parser = subparsers.add_parser('train', help="Train a compression dictionary for a cache")
+    train_parser.add_argument('-n', '--samples', help="The number of pages to train from", type=int, default=2000)
+    train_parser.add_argument('-s', '--shards', help="The number of shards the cache is split into (defaults to the configured number)", type=int, default=None)
+    train_parser.add_argument('cache', help="The cache file to train a dictionary for")
+    train_parser.set_defaults(run=train)
+
+    compact_parser = subparsers.add_parser('compact', help="Reclaim the space taken by overwritten pages")
+    compact_parser.add_argument('-v', '--verbose', help="Prints page titles as they get copied", action="store_true", default=False)
+    compact_parser.add_argument('-c', '--compression_level', help="Recompresses every page at this level (0 to 3, as in config.json)", type=int, choices=range(len(storage.compression_levels)), default=None)
+    compact_parser.add_argument('-s', '--shards', help="The number of shards the cache is split into (defaults to the configured number)", type=int, default=None)
+    compact_parser.add_argument('cache', help="The cache file to compact")
+    compact_parser.set_defaults(run=compact)
+
+    args = parser.parse_args()
+    args.run(args, load_config())
@@ -7,7 +7,7 @@ import os, sys, inspect
 cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
 if cmd_folder not in sys.path:
    sys.path.insert(0, cmd_folder)
-from wikiparse import wikipage
+from wikiparse import filemanager, wikipage
 
 class WikiCorpus(object):
    def __init__(self, *page_names):
@@ -15,6 +15,8 @@ class WikiCorpus(object):
    
    def __iter__(self):
       for name in self.page_names:
+         if filemanager.is_known_missing(name):
+            continue
          try:
             yield wikipage.WikiPage(name)
          except:
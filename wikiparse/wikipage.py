@@ -26,6 +26,7 @@ page without any loss of information.
 
 import re
 import collections
+import functools
 import json
 from collections import OrderedDict as Odict
 # http://stackoverflow.com/questions/279237/import-a-module-from-a-relative-path
@@ -35,7 +36,7 @@ import os, sys, inspect
 cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
 if cmd_folder not in sys.path:
     sys.path.insert(0, cmd_folder)
-from wikiparse import filemanager
+from wikiparse import filemanager, metrics
 
 
 
@@ -463,6 +464,18 @@ def construct(page, cur_section, parent, json_data):  # introduce current sectio
             raise ex
 
 
+def _timed_build(init):
+    # Times reading and building each page under page.build. Following redirections builds the pages it passes
+    # through, which are timed on their own.
+    @functools.wraps(init)
+    def timed_init(self, title, follow_redirections=True, archive=None):
+        if follow_redirections:
+            return init(self, title, follow_redirections, archive)
+        with metrics.timed("page.build"):
+            return init(self, title, follow_redirections, archive)
+    return timed_init
+
+
 # class PageFilteredElement(PageElement):
 #    def __init__(self, src, filter):
 #
@@ -527,18 +540,22 @@ class WikiPage(object):
                   so consider using :py:meth:`wikiparse.filemanager.possible_titles` if you want to make sure that you
                   are using a cached page.
     :type title: str
+    :param archive: The archive to read the page from, or None for the default one (see
+                    :py:class:`wikiparse.filemanager.Archive`)
+    :type archive: wikiparse.filemanager.Archive
     """
 
-    def __init__(self, title, follow_redirections=True):
+    @_timed_build
+    def __init__(self, title, follow_redirections=True, archive=None):
         if follow_redirections:
-            actual = WikiPage.resolve_page(title, True)
+            actual = WikiPage.resolve_page(title, True, archive)
             for attr in ['title', 'root_section', 'no_section', 'all_elements', 'root',
                          'content', 'templates', 'refs', 'internals', 'externals',
                          'sections', 'intro']:
                 attr = "_%s" % attr
                 setattr(self, attr, getattr(actual, attr))
         else:            
-           json_data = json.loads(filemanager.read_json(title))
+           json_data = (archive or filemanager.default_archive()).read_tree(title)
            if json_data is None:
                raise LookupError("The requested page '%s' was not found" % str(title))
            self._title = title
@@ -572,18 +589,20 @@ class WikiPage(object):
         return self._redir
 
     @staticmethod
-    def resolve_page(title, follow_redirections=True):
+    def resolve_page(title, follow_redirections=True, archive=None):
         """ Retrieves the specified page, capable of following redirection pages.
 
         :param title: The title of the page to construct
         :type title: str
         :param follow_redictions: Whether or not to follow redirection pages automatically
         :type follow_redictions: bool
+        :param archive: The archive to read the page from, or None for the default one
+        :type archive: wikiparse.filemanager.Archive
         """
-        page = WikiPage(title, follow_redirections=False)
+        page = WikiPage(title, follow_redirections=False, archive=archive)
         if follow_redirections:
             while page.redirection is not None:
-                page = WikiPage(page.redirection, follow_redirections=False)
+                page = WikiPage(page.redirection, follow_redirections=False, archive=archive)
         return page
 
     @property
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+'''
+A runnable script for parsing every cached page of wikitext ahead of time, so
+that :py:func:`wikiparse.filemanager.read_json` finds the json already cached
+rather than waiting on the parser for each page it reads.
+
+Pages are read from the cache in storage order, spread over a pool of parser
+workers (see :py:mod:`wikiparse.parserpool`), and their json is written back in
+batches. While one batch is being parsed, the next is read from the cache and
+the one before is written. Pages that already have json are skipped, so an
+interrupted run can simply be started again, and a later run (e.g. after
+wikisplitter has cached more pages) parses just the pages that are new. A small
+checkpoint file records which pages the parser couldn't convert, which are
+skipped from then on unless the ``retry_failed`` (``r``) option is given::
+
+    python3 wikipreparser.py -w 8 -v
+
+Each page's json records which wikitext it was converted from, and by which
+version of the parser (see :py:func:`wikiparse.filemanager.is_json_stale`).
+After updating the cache from a newer dump, or rebuilding the parser, the
+``stale`` (``s``) option converts just the pages whose json no longer matches::
+
+    python3 wikipreparser.py -s
+
+When it's done, the script reports how many pages each worker converted, and how
+fast.
+
+::
+
+    usage: wikipreparser.py [-h] [-w WORKERS] [-b BATCH_SIZE]
+                            [-i COMMIT_INTERVAL] [-c CHECKPOINT] [-r] [-s] [-v]
+
+    Parse every cached page of wikitext to json ahead of time
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -w WORKERS, --workers WORKERS
+                            The number of parser workers (defaults to the
+                            configured number)
+      -b BATCH_SIZE, --batch_size BATCH_SIZE
+                            The number of pages to write at once
+      -i COMMIT_INTERVAL, --commit_interval COMMIT_INTERVAL
+                            How often to commit the parsed pages to disk, in
+                            seconds
+      -c CHECKPOINT, --checkpoint CHECKPOINT
+                            The file to keep the pages that failed to parse in
+                            (defaults to the cache's path with .preparse
+                            appended)
+      -r, --retry_failed    Tries again to parse pages that failed in earlier
+                            runs
+      -s, --stale           Also parses pages whose json is stale
+      -v, --verbose         Prints progress as pages get parsed
+'''
+
+import argparse
+import json
+import os
+import sys
+from time import time
+
+from wikiparse import filemanager
+from wikiparse.parserpool import ParserPool
+
+
+def load_checkpoint(path):
+    '''Reads which pages earlier runs failed to parse.
+
+    :param path: The checkpoint file
+    :type path: str
+    :return: The titles the parser failed to convert
+    :rtype: set of str
+    '''
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return set()
+    return set(checkpoint['failed'])
+
+
+def save_checkpoint(path, failed):
+    '''Records which pages the parser failed to convert.
+
+    :param path: The checkpoint file
+    :type path: str
+    :param failed: The titles the parser failed to convert
+    :type failed: set of str
+    '''
+    temporary = path + ".tmp"
+    with open(temporary, 'w') as checkpoint_file:
+        json.dump({'failed': sorted(failed)}, checkpoint_file)
+    os.replace(temporary, path)
+
+
+def pending_titles(failed=(), retry_failed=False, stale=False):
+    '''Lists the pages that have wikitext but no json yet, in sorted order.
+
+    :param failed: Titles the parser failed to convert before
+    :type failed: set of str
+    :param retry_failed: Whether to include the titles in ``failed`` anyway
+    :type retry_failed: bool
+    :param stale: Whether to also include every page whose json is stale (see
+                  :py:func:`wikiparse.filemanager.is_json_stale`), wherever it comes in the order
+    :type stale: bool
+    :rtype: list of str
+    '''
+    wikitext_suffix = "." + filemanager.WIKITEXT
+    names = set(filemanager.backend.names())
+    titles = []
+    for name in names:
+        if name.endswith(wikitext_suffix):
+            title = name[:-len(wikitext_suffix)]
+            if filemanager._pick_path(title, filemanager.JSON) in names:
+                continue
+            # Json is written under the page's canonical title, whatever title its wikitext was stored under
+            canonical = filemanager.canonical_title(title)
+            if canonical != title and filemanager._pick_path(canonical, filemanager.JSON) in names:
+                continue
+            if retry_failed or title not in failed:
+                titles.append(title)
+    if stale:
+        titles.extend(filemanager.stale_json())
+    return sorted(set(titles))
+
+
+def preparse(pool, titles, batch_size=1000, checkpoint=None, failed=None, progress=None, commit_interval=60):
+    '''Parses pages of cached wikitext and caches their json. The json is committed to disk every
+    ``commit_interval`` seconds and at the end, rather than after every batch, since committing a zip archive writes
+    out its whole directory, which would take longer and longer as the run went on.
+
+    :param pool: The parser pool to parse pages with
+    :type pool: wikiparse.parserpool.ParserPool
+    :param titles: The pages to parse
+    :type titles: list of str
+    :param batch_size: The number of pages to write at once
+    :type batch_size: int
+    :param checkpoint: The checkpoint file to update whenever the json is committed, if any
+    :type checkpoint: str
+    :param failed: Titles that failed in earlier runs, which are kept in the checkpoint along with this run's
+    :type failed: set of str
+    :param progress: Called with the title of each page once it has been parsed, and whether that worked
+    :type progress: function
+    :param commit_interval: How often to commit the json written so far, in seconds
+    :type commit_interval: float
+    :return: The titles the parser failed to convert in this run
+    :rtype: list of str
+    '''
+    failed = set(failed or ())
+    newly_failed = []
+    last_commit = [time()]
+
+    def write(writer, batch):
+        for title, wikitext, future in batch:
+            try:
+                res_json = future.result()
+            except Exception:
+                newly_failed.append(title)
+                failed.add(title)
+                if progress:
+                    progress(title, False)
+                continue
+            failed.discard(title)
+            writer.write_json(title, res_json, wikitext)
+            if progress:
+                progress(title, True)
+        writer.write_pending()
+        if time() - last_commit[0] >= commit_interval:
+            commit()
+
+    def commit():
+        filemanager.flush()
+        filemanager.enable_writing()
+        last_commit[0] = time()
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, failed)
+
+    # Pages may only be here because their json is stale, in which case it gets replaced
+    with filemanager.batch_writer(batch_size * 2 + 1, overwrite=True) as writer:
+        parsing = []
+        for start in range(0, len(titles), batch_size):
+            # Read the whole batch before writing anything, since writing invalidates the pages being scanned
+            batch = [(title, str(content, filemanager.text_encoding))
+                     for title, content in filemanager.scan_pages(filemanager.WIKITEXT, titles[start:start + batch_size])]
+            futures = pool.submit_many(wikitext for _, wikitext in batch)
+            write(writer, parsing)
+            parsing = [(title, wikitext, future) for (title, wikitext), future in zip(batch, futures)]
+        write(writer, parsing)
+    if checkpoint is not None and titles:
+        save_checkpoint(checkpoint, failed)
+    return newly_failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse every cached page of wikitext to json ahead of time')
+    parser.add_argument('-w', '--workers', help="The number of parser workers (defaults to the configured number)", type=int, default=None)
+    parser.add_argument('-b', '--batch_size', help="The number of pages to write at once", type=int, default=1000)
+    parser.add_argument('-i', '--commit_interval', help="How often to commit the parsed pages to disk, in seconds", type=float, default=60)
+    parser.add_argument('-c', '--checkpoint', help="The file to keep the pages that failed to parse in (defaults to the cache's path with .preparse appended)", default=None)
+    parser.add_argument('-r', '--retry_failed', help="Tries again to parse pages that failed in earlier runs", action="store_true", default=False)
+    parser.add_argument('-s', '--stale', help="Also parses pages whose json is stale", action="store_true", default=False)
+    parser.add_argument('-v', '--verbose', help="Prints progress as pages get parsed", action="store_true", default=False)
+    args = parser.parse_args()
+
+    config = filemanager.config
+    checkpoint = args.checkpoint or filemanager.archive_path + ".preparse"
+    failed = load_checkpoint(checkpoint)
+    titles = pending_titles(failed, args.retry_failed, args.stale)
+    print("%d pages to parse" % len(titles))
+
+    count = 0
+
+    def progress(title, parsed):
+        global count
+        count += 1
+        if args.verbose:
+            sys.stdout.write("%d/%d - % -70s\r" % (count, len(titles), title[:70]))
+            sys.stdout.flush()
+
+    daemon_dir = os.path.abspath(os.path.expanduser(config['parser_daemon_dir'])) if config['parser_daemon'] else None
+    start = time()
+    with ParserPool(args.workers or config['parser_workers'], config['parser_batch_size'],
+                    os.path.join(filemanager.WIKIPARSE_DIR, "WikiToJson.jar"), daemon_dir) as pool:
+        newly_failed = preparse(pool, titles, args.batch_size, checkpoint, failed, progress, args.commit_interval)
+    elapsed = time() - start
+
+    print("Parsed %d pages in %.1fs (%.1f pages/sec), %d failed"
+          % (count - len(newly_failed), elapsed, (count - len(newly_failed)) / elapsed if elapsed else 0,
+             len(newly_failed)))
+    for slot, stats in enumerate(pool.worker_stats):
+        print("  worker %d: %d pages, %d failures, %d calls, %.1f pages/sec"
+              % (slot, stats.pages, stats.failures, stats.calls, stats.pages / stats.seconds if stats.seconds else 0))
@@ -30,14 +30,52 @@ The ``verbose`` (``v``) flag outputs file names as well as numerical progress
 indications while unzipping, and also specifies when other major steps are happening
 in the unpacking process.
 
+Decompressing a single bz2 stream only ever uses one core, which makes it by far
+the slowest step. Wikipedia also publishes ``pages-articles-multistream`` dumps,
+which are made of many small bz2 streams of about 100 pages each, along with an
+index file listing the offset of the stream holding each page. Given that index
+with the ``index`` (``i``) option, wikisplitter decompresses and parses the
+streams in parallel, on a pool of ``workers`` (``w``) processes (one per core by
+default), while pages are still written in the order they come in the dump::
+
+    python3 wikisplitter.py -i enwiki-latest-pages-articles-multistream-index.txt.bz2 \
+        enwiki-latest-pages-articles-multistream.xml.bz2
+
+Dumps that come in several parts (``pages-articles1.xml-p1p41242.bz2`` and so
+on) can all be given at once, in which case up to ``workers`` parts are unpacked
+at the same time, each in its own process. Every process hands its pages to
+this one, which writes them all to the cache, so that the processes don't fight
+over the archive, and reports the progress of all the parts together::
+
+    python3 wikisplitter.py -u enwiki-latest-pages-articles*.xml-p*.bz2
+
+To unpack only some of the pages, the ``namespace`` (``n``), ``title_regex``
+(``t``), ``title_list`` (``l``), ``min_id``, ``max_id``, ``min_length`` and
+``max_length`` options each leave out the pages that don't match. The title,
+namespace and id of a page are checked before anything else is read from it,
+and its length is taken from the size the dump gives for its text, so pages
+that are left out are never encoded or written. They are still decompressed and
+parsed along with the rest of the dump, though, which is most of the time it
+takes to read one. Reading is only skipped where the dump says where the pages
+are: given a multistream index, the streams holding none of the wanted ids and
+titles aren't decompressed at all, and the parts of a dump whose names show they
+hold none of the wanted ids aren't opened::
+
+    python3 wikisplitter.py -n 0 --min_length 2000 enwiki-latest-pages-articles.xml.bz2
+
 ::
 
-    usage: wikisplitter.py [-h] [-x] [-u] [-r] [-v] filename
+    usage: wikisplitter.py [-h] [-x] [-u] [-r] [-v] [-i INDEX] [-w WORKERS]
+                           [-n NAMESPACE] [-t TITLE_REGEX] [-l TITLE_LIST]
+                           [--min_id MIN_ID] [--max_id MAX_ID]
+                           [--min_length MIN_LENGTH] [--max_length MAX_LENGTH]
+                           filename [filename ...]
 
     Expand wikipedia file into page files
 
     positional arguments:
-      filename              The filepath to the wikipedia dump file
+      filename              The filepath to the wikipedia dump file, or to each
+                            part of a dump that comes in several parts
 
     optional arguments:
       -h, --help            show this help message and exit
@@ -46,17 +84,45 @@ in the unpacking process.
       -u, --update          Forces overwriting of pages that already exist
       -r, --no_redirects    Ignores redirection pages
       -v, --verbose         Prints page titles as they get output
+      -i INDEX, --index INDEX
+                            The index file of a multistream dump, whose streams
+                            are then unpacked in parallel
+      -w WORKERS, --workers WORKERS
+                            The number of processes unpacking a multistream dump
+                            or the parts of a dump (defaults to the number of
+                            CPUs)
+      -n NAMESPACE, --namespace NAMESPACE
+                            Only keeps pages in this namespace, e.g. 0 for
+                            articles (may be given more than once)
+      -t TITLE_REGEX, --title_regex TITLE_REGEX
+                            Only keeps pages whose titles match this regular
+                            expression
+      -l TITLE_LIST, --title_list TITLE_LIST
+                            Only keeps the pages whose titles are listed in this
+                            file, one per line
+      --min_id MIN_ID       Only keeps pages with at least this page id
+      --max_id MAX_ID       Only keeps pages with at most this page id
+      --min_length MIN_LENGTH
+                            Only keeps pages with at least this many bytes of
+                            wikitext
+      --max_length MAX_LENGTH
+                            Only keeps pages with at most this many bytes of
+                            wikitext
 
 
 .. moduleauthor:: David Maxson <jexmax@gmail.com>
 '''
 from wikiparse import filemanager
-filemanager.enable_writing()
+from wikiparse.titleindex import canonical_title
 
 DB_NAME = "wikipedia.sqlite"
 
-import gzip, argparse, re
+import gzip, argparse, re, bz2, io
+import multiprocessing
+import queue
 from xml.etree import ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import atexit
 from time import time
 
@@ -75,102 +141,484 @@ def verbose(txt):
     if args.verbose:
         print(txt)
 
-def split_xml(xml_stream):
+def split_xml(xml_stream, page_filter=None):
+    output_pages(find_pages(xml_stream, page_filter=page_filter))
+
+def _part_ids(filename):
+    # The range of page ids in the name of a part of a dump, e.g. pages-articles1.xml-p1p41242.bz2
+    ids = re.search(r'p(\d+)p(\d+)', os.path.basename(filename))
+    return (int(ids.group(1)), int(ids.group(2))) if ids is not None else None
+
+def count_dump_pages(filenames):
+    ''' Works out how many pages the parts of a dump hold from the range of page ids in their names, e.g.
+    ``pages-articles1.xml-p1p41242.bz2``.
+
+    :param filenames: The dump's parts
+    :type filenames: list of str
+    :return: The number of pages, or None if not every name holds a range of ids
+    :rtype: int
+    '''
+    total = 0
+    for filename in filenames:
+        ids = _part_ids(filename)
+        if ids is None:
+            return None
+        total += ids[1] - ids[0] + 1
+    return total
+
+def output_pages(pages, num_pages=None):
     verbose("Initializing...")
     num = 0
     prev_time = 0
 
-    def output_page(ttl, cnt):
+    def output_page(writer, ttl, cnt):
         try:
-            filemanager.write_wikitext(ttl, cnt, overwrite=args.update)
+            writer.write_wikitext(ttl, cnt)
         except Exception as ex:
             print("Failed to output page: %s\n%s" % (ttl, repr(ex)))
 
-
     verbose("Extracting pages into individual files...")
     if not args.verbose:
         try:
             from tqdm import tqdm
-            num_pages = re.search(r'p(\d+)p(\d+)', args.filename)
-            num_pages = None if num_pages is None else int(num_pages.group(2)) - int(num_pages.group(1)) + 1
-            all_pages = tqdm(find_pages(xml_stream), total=num_pages)
+            if num_pages is None:
+                num_pages = count_dump_pages(args.filename)
+            all_pages = tqdm(pages, total=num_pages)
             has_progress_bar = True
         except ImportError:
-            all_pages = find_pages(xml_stream)
+            all_pages = pages
             has_progress_bar = False
     else:
-        all_pages = find_pages(xml_stream)
-    for title, page in all_pages:
-        num += 1
-        if (args.verbose or not has_progress_bar) and (time() - prev_time >= 0.1):
-            prev_time = time()
-            if args.verbose:
-                sys.stdout.write("%d - % -79s\r" % (num, title[:79]))
-                sys.stdout.flush()
-            else:
-                sys.stdout.write("%d\r" % num)
-                sys.stdout.flush()
-        output_page(title, page)
+        all_pages = pages
+    with filemanager.batch_writer(overwrite=args.update) as writer:
+        for title, page in all_pages:
+            num += 1
+            if (args.verbose or not has_progress_bar) and (time() - prev_time >= 0.1):
+                prev_time = time()
+                if args.verbose:
+                    sys.stdout.write("%d - % -79s\r" % (num, title[:79]))
+                    sys.stdout.flush()
+                else:
+                    sys.stdout.write("%d\r" % num)
+                    sys.stdout.flush()
+            output_page(writer, title, page)
     #verbose("\nWriting index...")
     #filemanager.finish_recording_index()
     verbose("Done")
 
 
-def find_pages(xml_stream):
-    unknown_index = 0
-    def no_ns(tag):
-        return tag.rpartition('}')[2].lower()
-        
-    def find_el_by_tag(element, tag):
-        for el in list(element):
-            if no_ns(el.tag) == tag:
-                return el
-        return None
-    
-    def title_finder(page_element):
-        nonlocal unknown_index
-        el = find_el_by_tag(page_element, 'title')
-        if el is not None:
-            return el.text
-        unknown_index += 1
-        return "UNKNOWN_%d" % unknown_index
-    
-    def wikitext_finder(page_element):
-        revisions = find_el_by_tag(page_element, 'revision')
-        if revisions is not None:
-            text = find_el_by_tag(revisions, 'text')
-            if text is not None:
-                return text.text
-        return None
-        
+class PageFilter(object):
+    ''' Picks out which pages of a dump to keep. Every test is left out unless it's given, so a filter made without
+    arguments keeps every page. The tests on a page's title, namespace and id are made before anything else is read
+    from it, and the test on its length is made from the size its ``<text>`` element gives, so a page that is left
+    out is never encoded or written. It is still decompressed and parsed, unless the dump is a multistream one with
+    an index showing that its stream holds no wanted titles or ids (see :py:attr:`checks_index`), or it's in a part
+    of the dump whose name shows it holds no wanted ids.
 
+    :param namespaces: The numbers of the namespaces to keep pages from, e.g. ``[0]`` for articles only
+    :type namespaces: list of int
+    :param title_pattern: A regular expression that the titles of the pages to keep must hold (see :py:func:`re.search`)
+    :type title_pattern: str
+    :param titles: The titles of the only pages to keep, in any spelling that resolves to the page's
+    :type titles: list of str
+    :param min_id: The lowest page id to keep
+    :type min_id: int
+    :param max_id: The highest page id to keep
+    :type max_id: int
+    :param min_length: The shortest wikitext to keep, in bytes
+    :type min_length: int
+    :param max_length: The longest wikitext to keep, in bytes
+    :type max_length: int
+    :param no_redirects: Whether to leave out redirection pages
+    :type no_redirects: bool
+    '''
+
+    def __init__(self, namespaces=None, title_pattern=None, titles=None, min_id=None, max_id=None, min_length=None,
+                 max_length=None, no_redirects=False):
+        self.namespaces = frozenset(namespaces) if namespaces is not None else None
+        self.title_pattern = re.compile(title_pattern) if title_pattern is not None else None
+        # Titles in dumps are already in canonical form, so only the wanted ones need to be put in it
+        self.titles = frozenset(canonical_title(title) for title in titles) if titles is not None else None
+        self.min_id = min_id
+        self.max_id = max_id
+        self.min_length = min_length
+        self.max_length = max_length
+        self.no_redirects = no_redirects
+
+    def wants_title(self, title):
+        if self.titles is not None and title not in self.titles:
+            return False
+        return self.title_pattern is None or self.title_pattern.search(title) is not None
+
+    def wants_id(self, page_id):
+        if page_id is None:
+            return self.min_id is None and self.max_id is None
+        return (self.min_id is None or page_id >= self.min_id) and (self.max_id is None or page_id <= self.max_id)
+
+    def wants_ids(self, first_id, last_id):
+        '''
+        :return: Whether any page id from first_id to last_id (inclusive) may be kept
+        :rtype: bool
+        '''
+        return (self.min_id is None or last_id >= self.min_id) and (self.max_id is None or first_id <= self.max_id)
+
+    def wants_page(self, title, ns, page_id, redirect):
+        '''
+        :return: Whether to keep a page, going by the fields that come before its revisions
+        :rtype: bool
+        '''
+        if self.no_redirects and redirect is not None:
+            return False
+        if self.namespaces is not None and ns not in self.namespaces:
+            return False
+        return self.wants_id(page_id) and self.wants_title(title)
+
+    def wants_length(self, length):
+        return (self.min_length is None or length >= self.min_length) and (
+            self.max_length is None or length <= self.max_length)
+
+    @property
+    def checks_length(self):
+        return self.min_length is not None or self.max_length is not None
+
+    @property
+    def checks_index(self):
+        ''' Whether the filter leaves out pages by their title or id, which a multistream index lists
+        '''
+        return (self.titles is not None or self.title_pattern is not None or self.min_id is not None
+                or self.max_id is not None)
+
+def _iter_element_ends(xml_stream):
+    # Only elements ending are reported, which is half the events of also reporting them starting, but the root has
+    # to be caught starting so that what's been read can be let go of. So the root is found by feeding the parser a
+    # character at a time, and then the parser is switched to reporting ends only, through the same internal call
+    # XMLPullParser makes to subscribe to its events in the first place.
+    parser = ET.XMLPullParser(events=('start',))
+    root = None
+    while root is None:
+        data = xml_stream.read(1)
+        if not data:
+            return
+        parser.feed(data)
+        for event, element in parser.read_events():
+            root = element
+    parser._parser._setevents(parser._events_queue, ('end',))
+    while True:
+        for event, element in parser.read_events():
+            # Without the C accelerator, switching events leaves the parser reporting starts too
+            if event == 'end':
+                yield root, element
+        data = xml_stream.read(16 * 1024)
+        if not data:
+            break
+        parser.feed(data)
+    parser.close()
+    for event, element in parser.read_events():
+        if event == 'end':
+            yield root, element
+
+def iter_dump_pages(xml_stream, page_filter=None):
+    ''' Streams the pages out of an xml dump in constant memory: every element is let go of as soon as the page it
+    belongs to has been read, and only the fields that are needed are looked at.
+
+    :param xml_stream: The dump, as a file or a file path
+    :type xml_stream: file or str
+    :param page_filter: Which pages to keep, or None to keep them all
+    :type page_filter: PageFilter
+    :return: The title, namespace number (or None if not given), page id (or None if not given), redirection target
+             (or None if it isn't a redirection page) and wikitext (or None if it has none) of each page
+    :rtype: Generator of (str, int, int, str, str)
+    '''
     if type(xml_stream) == type(''):
         xml_stream = open(xml_stream, 'r', encoding='utf-8')
 
-    event_count = 0
-    context = ET.iterparse(xml_stream)
-    for event, element in context:
-        tag = no_ns(element.tag)
-        if tag == 'page':
-            page_name = str(title_finder(element))
-            # This eliminates redirection pages, but this should be done at a later stage, along with disambiguations
-            is_redirect = find_el_by_tag(element, "redirect")
-            if not args.no_redirects or not is_redirect:
-                wikitext = wikitext_finder(element)
-                yield page_name, wikitext
-            # See for inspiration: http://www.ibm.com/developerworks/xml/library/x-hiperfparse/
-            element.clear()
-            #while element.getprevious() is not None:
-            #    del element.getparent()[0]
-        event_count += 1
-    del context
-
-def split_bz2(filename):
-    if filename.endswith('.bz2'):
-        import bz2 as unzip
+    unknown_index = 0
+    page_tag = None
+    for root, element in _iter_element_ends(xml_stream):
+        if page_tag is None:
+            # The first element to end is inside the first page (or the site info before it), so its namespace is
+            # the dump's
+            namespace = element.tag[:element.tag.index('}') + 1] if element.tag.startswith('{') else ''
+            page_tag, title_tag, ns_tag, id_tag, redirect_tag, revision_tag, text_tag = (
+                namespace + tag for tag in ('page', 'title', 'ns', 'id', 'redirect', 'revision', 'text'))
+        if element.tag != page_tag:
+            continue
+        title = ns = page_id = redirect = revision = None
+        for field in element:
+            tag = field.tag
+            if tag == title_tag:
+                title = field.text
+            elif tag == ns_tag:
+                ns = int(field.text) if field.text else None
+            elif tag == id_tag:
+                page_id = int(field.text) if field.text else None
+            elif tag == redirect_tag:
+                redirect = field.get('title', '')
+            elif tag == revision_tag:
+                # Dumps of the latest pages have one revision, and of the full history, the latest comes last
+                revision = field
+        if title is None:
+            unknown_index += 1
+            title = "UNKNOWN_%d" % unknown_index
+        wanted = page_filter is None or page_filter.wants_page(title, ns, page_id, redirect)
+        text = None
+        if wanted and revision is not None:
+            for revision_field in revision:
+                if revision_field.tag == text_tag:
+                    text = revision_field
+            if page_filter is not None and page_filter.checks_length:
+                length = text.get('bytes') if text is not None else '0'
+                # Dumps give the text's size, which saves encoding the text to measure it
+                length = int(length) if length else len(text.text.encode('utf-8')) if text.text else 0
+                wanted = page_filter.wants_length(length)
+            text = text.text if text is not None else None
+        # Every element read so far hangs off the root, so letting go of them all keeps memory from growing
+        root.clear()
+        if wanted:
+            yield title, ns, page_id, redirect, text
+
+def find_pages(xml_stream, no_redirects=False, page_filter=None):
+    ''' Streams the pages out of an xml dump in constant memory (see :py:func:`iter_dump_pages`).
+
+    :param xml_stream: The dump, as a file or a file path
+    :type xml_stream: file or str
+    :param no_redirects: Whether to leave out redirection pages
+    :type no_redirects: bool
+    :param page_filter: Which pages to keep, or None to keep them all
+    :type page_filter: PageFilter
+    :return: The title and wikitext of each page
+    :rtype: Generator of (str, str)
+    '''
+    for title, ns, page_id, redirect, text in iter_dump_pages(xml_stream, page_filter):
+        # This eliminates redirection pages, but this should be done at a later stage, along with disambiguations
+        if not no_redirects or redirect is None:
+            yield title, text
+
+def open_dump(filename, xml=False):
+    if xml:
+        return open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        return bz2.open(filename, 'r')
     else:
-        import gzip as unzip
-    split_xml(unzip.open(filename, 'r'))
+        return gzip.open(filename, 'r')
+
+def split_bz2(filename, page_filter=None):
+    split_xml(open_dump(filename), page_filter)
+
+# How many pages a worker unpacking one part of a dump hands over at a time
+PART_CHUNK_SIZE = 100
+# How often, in seconds, find_part_pages checks that its workers are still running while it waits for pages
+PART_POLL_INTERVAL = 1
+
+def _split_parts(parts, results, xml, page_filter):
+    # Run in each worker process of find_part_pages. Every part ends with a message without pages, which holds the
+    # error that stopped the part early, if any.
+    for filename in iter(parts.get, None):
+        error = None
+        try:
+            with open_dump(filename, xml) as dump:
+                chunk = []
+                for page in find_pages(dump, page_filter=page_filter):
+                    chunk.append(page)
+                    if len(chunk) >= PART_CHUNK_SIZE:
+                        results.put((filename, chunk, None))
+                        chunk = []
+                results.put((filename, chunk, None))
+        except Exception as ex:
+            error = repr(ex)
+        results.put((filename, None, error))
+
+def find_part_pages(filenames, workers=None, xml=False, page_filter=None):
+    ''' Finds every page in the parts of a dump, unpacking several parts at the same time, each in its own process.
+    Pages from different parts come out interleaved, in whatever order they're found. Parts that can't be unpacked
+    are reported and skipped, and parts whose names show they hold none of the page ids the filter keeps aren't
+    unpacked at all. If a worker dies partway through a part (e.g. killed for running out of memory), this raises
+    :py:class:`RuntimeError` rather than waiting forever for the rest of that part.
+
+    :param filenames: The dump's parts
+    :type filenames: list of str
+    :param workers: The most parts to unpack at the same time, which defaults to the number of CPUs
+    :type workers: int
+    :param xml: Whether the parts are already-unzipped xml files
+    :type xml: bool
+    :param page_filter: Which pages to keep, or None to keep them all
+    :type page_filter: PageFilter
+    :return: The title and wikitext of each page
+    :rtype: Generator of (str, str)
+    '''
+    filenames = _wanted_parts(filenames, page_filter)
+    if not filenames:
+        return
+    workers = max(1, min(workers or os.cpu_count() or 1, len(filenames)))
+    parts = multiprocessing.Queue()
+    # Bounded, so that workers wait rather than pile up pages when they're written more slowly than they're unpacked
+    results = multiprocessing.Queue(4 * workers)
+    for filename in filenames:
+        parts.put(filename)
+    for _ in range(workers):
+        parts.put(None)
+    processes = [multiprocessing.Process(target=_split_parts, args=(parts, results, xml, page_filter), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        remaining = len(filenames)
+        while remaining:
+            try:
+                filename, pages, error = results.get(timeout=PART_POLL_INTERVAL)
+            except queue.Empty:
+                # Workers that finish cleanly have sent everything before exiting, so nothing more is coming from them
+                dead = [process.exitcode for process in processes if not process.is_alive()]
+                if any(dead) or len(dead) == len(processes):
+                    raise RuntimeError("A worker died while unpacking the dump's parts (exit codes %s)"
+                                       % ", ".join(str(code) for code in dead))
+                continue
+            if pages is not None:
+                yield from pages
+            else:
+                remaining -= 1
+                if error is not None:
+                    print("Failed to unpack %s\n%s" % (filename, error))
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+def _wanted_parts(filenames, page_filter):
+    if page_filter is None:
+        return list(filenames)
+    return [filename for filename in filenames
+            if _part_ids(filename) is None or page_filter.wants_ids(*_part_ids(filename))]
+
+def split_parts(filenames, workers=None, xml=False, page_filter=None):
+    wanted = _wanted_parts(filenames, page_filter)
+    verbose("Unpacking %d of %d parts on %d processes..."
+            % (len(wanted), len(filenames), min(workers or os.cpu_count() or 1, max(len(wanted), 1))))
+    output_pages(find_part_pages(wanted, workers, xml, page_filter), count_dump_pages(wanted))
+
+def read_multistream_index(index_filename, page_filter=None):
+    ''' Reads the index of a multistream dump, which lists the offset of the stream holding each page, along with
+    the page's id and title.
+
+    :param index_filename: The index file, which may be bz2 compressed
+    :type index_filename: str
+    :param page_filter: Which pages to keep, in which case streams holding none of the pages whose ids and titles it
+                        keeps are left out
+    :type page_filter: PageFilter
+    :return: The start and end offsets of each stream holding pages to keep, in order (the last end being None for the
+             end of the dump), and the number of pages to keep that the index lists
+    :rtype: (list of (int, int), int)
+    '''
+    opener = bz2.open if index_filename.endswith('.bz2') else open
+    check = page_filter is not None and page_filter.checks_index
+    offsets = []
+    wanted = set()
+    num_pages = 0
+    with opener(index_filename, 'rt', encoding='utf-8') as index_file:
+        for line in index_file:
+            # Each line is "offset:page id:title", and titles may themselves hold colons
+            offset, _, rest = line.partition(':')
+            offset = int(offset)
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+            if check:
+                page_id, _, title = rest.rstrip('\n').partition(':')
+                if not (page_filter.wants_id(int(page_id)) and page_filter.wants_title(title)):
+                    continue
+                wanted.add(offset)
+            num_pages += 1
+    blocks = [(start, end) for start, end in zip(offsets, offsets[1:] + [None]) if not check or start in wanted]
+    return blocks, num_pages
+
+def _decompress_streams(data):
+    # A block may hold several streams back to back, e.g. the last pages and the dump's closing tag
+    chunks = []
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+def split_stream_block(filename, start, end, page_filter=None):
+    ''' Decompresses and parses one block of streams from a multistream dump. This is run in the worker processes of
+    :py:func:`find_multistream_pages`.
+
+    :param filename: The multistream dump
+    :type filename: str
+    :param start: The offset of the block's first stream
+    :type start: int
+    :param end: The offset just past the block's last stream, or None to read to the end of the dump
+    :type end: int
+    :param page_filter: Which pages to keep, or None to keep them all
+    :type page_filter: PageFilter
+    :return: The title and wikitext of each page in the block
+    :rtype: list of (str, str)
+    '''
+    with open(filename, 'rb') as dump:
+        dump.seek(start)
+        data = dump.read(-1 if end is None else end - start)
+    xml = _decompress_streams(data).strip()
+    if xml.endswith(b'</mediawiki>'):
+        xml = xml[:-len(b'</mediawiki>')]
+    # The pages in a stream have no enclosing element of their own, so they are given one to parse them
+    return list(find_pages(io.BytesIO(b'<pages>' + xml + b'</pages>'), page_filter=page_filter))
+
+# The filter of the pool process running split_stream_block, handed over once when the process starts rather than
+# with every block
+_block_filter = None
+
+def _set_block_filter(page_filter):
+    global _block_filter
+    _block_filter = page_filter
+
+def _split_filtered_block(filename, start, end):
+    return split_stream_block(filename, start, end, _block_filter)
+
+def find_multistream_pages(filename, index_filename, workers=None, page_filter=None):
+    ''' Finds every page in a multistream dump, decompressing and parsing its streams in parallel. Pages are generated
+    in the order they appear in the dump. Streams holding none of the pages the filter keeps, going by the ids and
+    titles in the index, are never read.
+
+    :param filename: The multistream dump
+    :type filename: str
+    :param index_filename: The dump's index file
+    :type index_filename: str
+    :param workers: The number of processes to use, which defaults to the number of CPUs
+    :type workers: int
+    :param page_filter: Which pages to keep, or None to keep them all
+    :type page_filter: PageFilter
+    :return: The title and wikitext of each page
+    :rtype: Generator of (str, str)
+    '''
+    blocks, _ = read_multistream_index(index_filename, page_filter)
+    return _find_multistream_pages(filename, blocks, workers, page_filter)
+
+def _find_multistream_pages(filename, blocks, workers, page_filter):
+    workers = workers or os.cpu_count() or 1
+    blocks = iter(blocks)
+    with ProcessPoolExecutor(workers, initializer=_set_block_filter, initargs=(page_filter,)) as executor:
+        def submit_next():
+            block = next(blocks, None)
+            if block is not None:
+                pending.append(executor.submit(_split_filtered_block, filename, block[0], block[1]))
+
+        # Only a few blocks are unpacked ahead of the one being output, which keeps pages in order without holding
+        # the whole dump in memory when pages are output more slowly than they're unpacked
+        pending = deque()
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            yield from pages
+
+def split_multistream(filename, index_filename, workers=None, page_filter=None):
+    verbose("Reading the index...")
+    blocks, num_pages = read_multistream_index(index_filename, page_filter)
+    verbose("Unpacking %d streams on %d processes..." % (len(blocks), workers or os.cpu_count() or 1))
+    output_pages(_find_multistream_pages(filename, blocks, workers, page_filter), num_pages)
 
 if __name__ == '__main__':
     global args
@@ -184,10 +632,36 @@ if __name__ == '__main__':
     #parser.add_argument('-n', '--no_ns', help="Removes the namespace from the xml attribute tags before exporting", default=True, type=bool)
     #parser.add_argument('-c', '--commit', help="Set the number of records to be queued before committing to the database", default=10000, type=int)
     parser.add_argument('-v', '--verbose', help="Prints page titles as they get output", action="store_true", default=False)
-    parser.add_argument('filename', help="The filepath to the wikipedia dump file")
+    parser.add_argument('-i', '--index', help="The index file of a multistream dump, whose streams are then unpacked in parallel", default=None)
+    parser.add_argument('-w', '--workers', help="The number of processes unpacking a multistream dump or the parts of a dump (defaults to the number of CPUs)", type=int, default=None)
+    parser.add_argument('-n', '--namespace', help="Only keeps pages in this namespace, e.g. 0 for articles (may be given more than once)", type=int, action='append', default=None)
+    parser.add_argument('-t', '--title_regex', help="Only keeps pages whose titles match this regular expression", default=None)
+    parser.add_argument('-l', '--title_list', help="Only keeps the pages whose titles are listed in this file, one per line", default=None)
+    parser.add_argument('--min_id', help="Only keeps pages with at least this page id", type=int, default=None)
+    parser.add_argument('--max_id', help="Only keeps pages with at most this page id", type=int, default=None)
+    parser.add_argument('--min_length', help="Only keeps pages with at least this many bytes of wikitext", type=int, default=None)
+    parser.add_argument('--max_length', help="Only keeps pages with at most this many bytes of wikitext", type=int, default=None)
+    parser.add_argument('filename', help="The filepath to the wikipedia dump file, or to each part of a dump that comes in several parts", nargs='+')
     args = parser.parse_args()
+    if args.index and len(args.filename) > 1:
+        parser.error("a multistream index can only be given with a single dump file")
+    try:
+        title_pattern = re.compile(args.title_regex).pattern if args.title_regex is not None else None
+    except re.error as ex:
+        parser.error("invalid title regular expression: %s" % ex)
+    titles = None
+    if args.title_list:
+        with open(args.title_list, encoding='utf-8') as title_list:
+            titles = [line.strip() for line in title_list if line.strip()]
+    page_filter = PageFilter(args.namespace, title_pattern, titles, args.min_id, args.max_id, args.min_length,
+                             args.max_length, args.no_redirects)
 
-    if(args.xml):
-        split_xml(open(args.filename))
+    filemanager.enable_writing()
+    if args.index:
+        split_multistream(args.filename[0], args.index, args.workers, page_filter)
+    elif len(args.filename) > 1:
+        split_parts(args.filename, args.workers, args.xml, page_filter)
+    elif(args.xml):
+        split_xml(open(args.filename[0]), page_filter)
     else:
-        split_bz2(args.filename)
+        split_bz2(args.filename[0], page_filter)